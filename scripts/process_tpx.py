@@ -21,8 +21,8 @@ from pathlib import Path
 import matplotlib.pyplot as plt
 import numpy as np
 
-from instamatic.formats import read_tiff
-from instamatic.processing.ImgConversionTPX import ImgConversionTPX as ImgConversion
+from instamatic.formats import iter_tiff_dataset
+from instamatic.processing.ImgConversionTPX import ImgConversionTPXStream as ImgConversion
 
 
 def mark_cross(img, mask_value=0):
@@ -85,8 +85,6 @@ def reprocess(credlog, tiff_path=None, mrc_path=None, smv_path='SMV_reprocessed'
     else:
         print(n)
 
-    buffer = []
-
     rotation_axis = -2.24  # add np.pi/2 for old files
     acquisition_time = None
 
@@ -129,17 +127,14 @@ def reprocess(credlog, tiff_path=None, mrc_path=None, smv_path='SMV_reprocessed'
     print('Rotation axis:', rotation_axis)
     print('Acquisition time:', acquisition_time)
 
-    def extract_image_number(s):
-        p = Path(s)
-        return int(p.stem.split('_')[-1])
-
-    for i, fn in enumerate(image_fns):
-        j = extract_image_number(fn)
-        img, h = read_tiff(fn)
-        buffer.append((j, img, h))
+    if mrc_path:
+        mrc_path = drc / mrc_path
+    if smv_path:
+        smv_path = drc / smv_path
+    if tiff_path:
+        tiff_path = drc / tiff_path
 
     img_conv = ImgConversion(
-        buffer=buffer,
         osc_angle=osc_angle,
         start_angle=start_angle,
         end_angle=end_angle,
@@ -151,6 +146,12 @@ def reprocess(credlog, tiff_path=None, mrc_path=None, smv_path='SMV_reprocessed'
         wavelength=wavelength,
         stretch_amplitude=stretch_amplitude,
         stretch_azimuth=stretch_azimuth,
+        tiff_path=tiff_path,
+        smv_path=smv_path,
+        mrc_path=mrc_path,
+        write_dials=False,
+        write_pets=False,
+        workers=8,
     )
 
     # azimuth, amplitude = 83.37, 2.43  # add 90 to azimuth for old files
@@ -158,27 +159,13 @@ def reprocess(credlog, tiff_path=None, mrc_path=None, smv_path='SMV_reprocessed'
     print('Stretch amplitude', img_conv.stretch_amplitude)
     print('Stretch azimuth', img_conv.stretch_azimuth)
 
-    # if img_conv.beam_center_std.mean() > 5:
-    #     print("Large beam center variation detected, aligning images!")
-    #     center_images(img_conv)
-
-    if mrc_path:
-        mrc_path = drc / mrc_path
-    if smv_path:
-        smv_path = drc / smv_path
-    if tiff_path:
-        smv_path = drc / tiff_path
-
-    img_conv.threadpoolwriter(
-        tiff_path=tiff_path, mrc_path=mrc_path, smv_path=smv_path, workers=8
-    )
-
-    if mrc_path:
-        img_conv.write_ed3d(mrc_path)
+    # frames are read in parallel and converted as they arrive, so that
+    # only a few frames are held in memory
+    for i, img, h in iter_tiff_dataset(image_fns):
+        img_conv.add_frame(i, img, h)
 
-    if smv_path:
-        img_conv.write_xds_inp(smv_path)
-        # img_conv.to_dials(smv_path)
+    # writes XDS.INP to `smv_path` and the REDp input to `mrc_path`
+    img_conv.close()
 
 
 def main():
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import time
+import types
 from collections import namedtuple
 from concurrent.futures import ThreadPoolExecutor
-from typing import Optional, Tuple
+from typing import Iterator, Optional, Tuple
 
 import numpy as np
 
@@ -19,6 +20,7 @@ from .deflectors import *
 from .lenses import *
 from .microscope import Microscope
 from .stage import *
+from .state import StateCache, StateReader, StateSnapshot
 from .states import *
 
 _ctrl = None  # store reference of ctrl so it can be accessed without re-initializing
@@ -119,6 +121,26 @@ class TEMController:
         self.screen = Screen(tem)
         self.mode = Mode(tem)
 
+        self.state_cache = StateCache(ttl=config.settings.tem_state_cache_ttl)
+        self._state_reader = StateReader(tem, cache=self.state_cache)
+        for component in (
+            self.gunshift,
+            self.guntilt,
+            self.beamshift,
+            self.beamtilt,
+            self.imageshift1,
+            self.imageshift2,
+            self.diffshift,
+            self.stage,
+            self.magnification,
+            self.brightness,
+            self.difffocus,
+            self.mode,
+            self.beam,
+            self.screen,
+        ):
+            component._state_cache = self.state_cache
+
         self.autoblank = False
         self._saved_alignments = config.get_alignments()
 
@@ -158,11 +180,12 @@ class TEMController:
 
     @property
     def spotsize(self) -> int:
-        return self.tem.getSpotSize()
+        return self.state_cache.fetch('SpotSize', self.tem.getSpotSize)
 
     @spotsize.setter
     def spotsize(self, value: int):
         self.tem.setSpotSize(value)
+        self.state_cache.put('SpotSize', value)
 
     def acquire_at_items(self, *args, **kwargs) -> None:
         """Class to automated acquisition at many stage locations. The
@@ -453,6 +476,21 @@ class TEMController:
         gm = GridMontage(self)
         return gm
 
+    def get_state(self, *keys, fresh: bool = False) -> StateSnapshot:
+        """Return a snapshot of the microscope parameters.
+
+        keys: tuple of str (optional)
+            If any keys are specified, only the given properties are read
+        fresh: bool
+            Read all values from the microscope instead of using cached values
+
+        Independent values are read in a single round trip to the TEM server
+        (or concurrently, if the microscope interface allows it). Values are
+        cached for `tem_state_cache_ttl` seconds, or until they are changed
+        through the `TEMController`.
+        """
+        return self._state_reader.snapshot(*keys, fresh=fresh)
+
     def to_dict(self, *keys) -> dict:
         """Store microscope parameters to dict.
 
@@ -461,36 +499,12 @@ class TEMController:
 
         self.to_dict('all') or self.to_dict() will return all properties
         """
-        # Each of these costs about 40-60 ms per call on a JEOL 2100, stage is 265 ms per call
-        funcs = {
-            'FunctionMode': self.tem.getFunctionMode,
-            'GunShift': self.gunshift.get,
-            'GunTilt': self.guntilt.get,
-            'BeamShift': self.beamshift.get,
-            'BeamTilt': self.beamtilt.get,
-            'ImageShift1': self.imageshift1.get,
-            'ImageShift2': self.imageshift2.get,
-            'DiffShift': self.diffshift.get,
-            'StagePosition': self.stage.get,
-            'Magnification': self.magnification.get,
-            'DiffFocus': self.difffocus.get,
-            'Brightness': self.brightness.get,
-            'SpotSize': self.tem.getSpotSize,
-        }
-
-        dct = {}
-
-        if 'all' in keys or not keys:
-            keys = funcs.keys()
-
-        for key in keys:
-            try:
-                dct[key] = funcs[key]()
-            except ValueError:
-                # print(f"No such key: `{key}`")
-                pass
+        # Each of these costs about 40-60 ms per call on a JEOL 2100, stage is 265 ms per call,
+        # so they are read together, see `get_state`
+        if 'all' in keys:
+            keys = ()
 
-        return dct
+        return self.get_state(*keys).to_dict(*keys)
 
     def from_dict(self, dct: dict):
         """Restore microscope parameters from dict."""
@@ -512,6 +526,7 @@ class TEMController:
 
         mode = dct['FunctionMode']
         self.tem.setFunctionMode(mode)
+        self.state_cache.invalidate()
 
         for k, v in dct.items():
             if k in funcs:
@@ -646,7 +661,9 @@ class TEMController:
         if not header_keys:
             h = {}
         else:
-            h = self.to_dict(header_keys)
+            if isinstance(header_keys, str):
+                header_keys = (header_keys,)
+            h = self.to_dict(*header_keys)
 
         if self.autoblank:
             self.beam.unblank()
@@ -706,7 +723,9 @@ class TEMController:
         Returns
         -------
         stack : Tuple[np.ndarray]
-            List of numpy arrays with image data.
+            List of numpy arrays with image data. If the camera runs behind
+            the cam server, this is a generator yielding the frames as they
+            arrive.
         """
         if not self.cam:
             raise AttributeError(
@@ -724,10 +743,21 @@ class TEMController:
         stack = self.cam.get_movie(n_frames=n_frames, exposure=exposure, binsize=binsize)
 
         if self.autoblank:
-            self.beam.blank()
+            if isinstance(stack, types.GeneratorType):
+                # frames are streamed, blank once the last one has arrived
+                stack = self._blank_after(stack)
+            else:
+                self.beam.blank()
 
         return stack
 
+    def _blank_after(self, frames: Iterator[np.ndarray]) -> Iterator[np.ndarray]:
+        """Yield from `frames` and blank the beam when done."""
+        try:
+            yield from frames
+        finally:
+            self.beam.blank()
+
     def store_diff_beam(self, name: str = 'beam', save_to_file: bool = False):
         """Record alignment for current diffraction beam. Stores Guntilt (for
         dose control), diffraction focus, spot size, brightness, and the
@@ -19,6 +19,7 @@ class Deflector:
         self._getter = None
         self._setter = None
         self.key = 'def'
+        self._state_cache = None  # set by `TEMController`
 
     def __repr__(self):
         x, y = self.get()
@@ -32,9 +33,20 @@ class Deflector:
     def set(self, x: int, y: int):
         """Set the X and Y values of the deflector."""
         self._setter(x, y)
+        # the microscope may round or clip the values, read them again
+        if self._state_cache is not None:
+            self._state_cache.invalidate(self.name)
 
-    def get(self) -> Tuple[int, int]:
-        """Get X and Y values of the deflector."""
+    def get(self, fresh: bool = False) -> Tuple[int, int]:
+        """Get X and Y values of the deflector.
+
+        Returns the cached value if available, unless `fresh` is True.
+        """
+        if self._state_cache is None:
+            return self._read()
+        return self._state_cache.fetch(self.name, self._read, fresh=fresh)
+
+    def _read(self) -> Tuple[int, int]:
         return DeflectorTuple(*self._getter())
 
     @property
@@ -70,6 +82,12 @@ class Deflector:
     def neutral(self):
         """Return deflector to stored neutral values."""
         self._tem.setNeutral(self.key)
+        self._invalidate()
+
+    def _invalidate(self):
+        """Remove the value of the deflector from the state cache."""
+        if self._state_cache is not None:
+            self._state_cache.invalidate(self.name)
 
 
 class GunShift(Deflector):
@@ -11,6 +11,7 @@ class Lens:
         self._getter = None
         self._setter = None
         self.key = 'lens'
+        self._state_cache = None  # set by `TEMController`
 
     def __repr__(self):
         try:
@@ -25,9 +26,25 @@ class Lens:
 
     def set(self, value: int):
         self._setter(value)
+        self._invalidate()
 
-    def get(self) -> int:
-        return self._getter()
+    def get(self, fresh: bool = False) -> int:
+        """Get the value of the lens.
+
+        Returns the cached value if available, unless `fresh` is True.
+        """
+        if self._state_cache is None:
+            return self._getter()
+        return self._state_cache.fetch(self.name, self._getter, fresh=fresh)
+
+    def _invalidate(self):
+        """Remove the value of the lens from the state cache.
+
+        The value that was set is not stored, because the microscope
+        may round or clip it, so it is read again when needed.
+        """
+        if self._state_cache is not None:
+            self._state_cache.invalidate(self.name)
 
     @property
     def value(self) -> int:
@@ -55,6 +72,7 @@ class DiffFocus(Lens):
         silently fail if the TEM is in the wrong mode.
         """
         self._setter(value, confirm_mode=confirm_mode)
+        self._invalidate()
 
     def defocus(self, offset):
         """Apply a defocus to the IL1 lens, use `.refocus` to restore the
@@ -66,6 +84,8 @@ class DiffFocus(Lens):
             self._focused_value = current = self.get()
         except ValueError:
             self._tem.setFunctionMode('diff')
+            if self._state_cache is not None:
+                self._state_cache.invalidate()  # all lenses depend on the mode
             self._focused_value = current = self.get()
 
         target = current + offset
@@ -119,7 +139,9 @@ class Magnification(Lens):
 
     @property
     def index(self) -> int:
-        return self._indexgetter()
+        if self._state_cache is None:
+            return self._indexgetter()
+        return self._state_cache.fetch('MagnificationIndex', self._indexgetter)
 
     @property
     def absolute_index(self) -> int:
@@ -128,6 +150,14 @@ class Magnification(Lens):
     @index.setter
     def index(self, index: int):
         self._indexsetter(index)
+        self._invalidate()
+
+    def _invalidate(self):
+        """Remove the magnification and its index from the state cache,
+        both change when either is set."""
+        if self._state_cache is not None:
+            self._state_cache.invalidate(self.name)
+            self._state_cache.invalidate('MagnificationIndex')
 
     def increase(self) -> None:
         try:
@@ -5,6 +5,9 @@ from typing import Tuple
 
 
 class MicroscopeBase(ABC):
+    # Set to True if the getters can be called from several threads at once
+    thread_safe = False
+
     @abstractmethod
     def getBeamShift(self) -> Tuple[int, int]:
         pass
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import atexit
 import datetime
 import json
@@ -8,11 +9,15 @@ import socket
 import subprocess as sp
 import threading
 import time
+from concurrent.futures import Future
 from functools import wraps
+from typing import Iterable
 
 from instamatic import config
-from instamatic.exceptions import TEMCommunicationError, exception_list
-from instamatic.server.serializer import dumper, loader
+from instamatic.exceptions import TEMCommunicationError
+from instamatic.server import protocol
+from instamatic.server.protocol import get_exception
+from instamatic.server.serializer import codec, dumper, loader
 
 HOST = config.settings.tem_server_host
 PORT = config.settings.tem_server_port
@@ -49,6 +54,9 @@ class MicroscopeClient:
         self.interface = interface
         self.name = interface
         self._bufsize = BUFSIZE
+        self._msg_id = 0
+        # the connection can be shared between threads, one request at a time
+        self._lock = threading.RLock()
 
         try:
             self.connect()
@@ -78,6 +86,9 @@ class MicroscopeClient:
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.s.connect((HOST, PORT))
         print(f'Connected to TEM server ({HOST}:{PORT})')
+        self._framed = protocol.negotiate(
+            self.s, key='func_name', loader=loader, dumper=dumper, bufsize=self._bufsize
+        )
 
     def __getattr__(self, func_name):
         try:
@@ -96,22 +107,127 @@ class MicroscopeClient:
 
     def _eval_dct(self, dct):
         """Takes approximately 0.2-0.3 ms per call if HOST=='localhost'."""
-        self.s.send(dumper(dct))
+        with self._lock:
+            if self._framed:
+                status, data = self._eval_framed(dct)
+            else:
+                self.s.send(dumper(dct))
 
-        response = self.s.recv(self._bufsize)
+                response = self.s.recv(self._bufsize)
 
-        if response:
-            status, data = loader(response)
+                if response:
+                    status, data = loader(response)
 
         if status == 200:
             return data
 
-        elif status == 500:
-            error_code, args = data
-            raise exception_list.get(error_code, TEMCommunicationError)(*args)
+        raise get_exception(status, data)
 
+    def call_many(self, calls: Iterable, return_exceptions: bool = False) -> list:
+        """Evaluate a sequence of calls on the server in a single round trip.
+
+        The calls are evaluated in order on the microscope thread.
+
+        Parameters
+        ----------
+        calls : Iterable
+            Each call is given as the function name, or as a tuple
+            `(func_name, args)` or `(func_name, args, kwargs)`.
+        return_exceptions : bool
+            If True, failed calls return the exception instead of
+            raising it. Otherwise the first exception is raised once all
+            calls have been evaluated.
+
+        Returns
+        -------
+        results : list
+            List with the return value of every call.
+
+        Usage:
+            ht, (x, y, z, a, b) = tem.call_many(['getHTValue', 'getStagePosition'])
+        """
+        calls = [self._make_call(call) for call in calls]
+
+        if self._framed:
+            dct = {'func_name': protocol.BATCH, 'args': (calls,), 'kwargs': {}}
+            responses = self._eval_dct(dct)
+        else:
+            # the legacy protocol cannot carry large responses, evaluate one by one
+            responses = []
+            for dct in calls:
+                try:
+                    responses.append((200, self._eval_dct(dct)))
+                except Exception as e:
+                    responses.append((500, e))
+
+        results = []
+        for status, data in responses:
+            if status == 200:
+                results.append(data)
+                continue
+
+            if isinstance(data, Exception):
+                exc = data
+            else:
+                exc = get_exception(status, data)
+
+            if not return_exceptions:
+                raise exc
+            results.append(exc)
+
+        return results
+
+    def batch(self) -> 'Batch':
+        """Collect calls and evaluate them in a single round trip on exiting
+        the context.
+
+        Each call returns a `concurrent.futures.Future` that holds the
+        result once the batch has been evaluated.
+
+        Usage:
+            with tem.batch() as b:
+                ht = b.getHTValue()
+                pos = b.getStagePosition()
+            ht.result(), pos.result()
+        """
+        return Batch(self)
+
+    def _make_call(self, call) -> dict:
+        """Convert `call` to a call dictionary."""
+        if isinstance(call, str):
+            func_name, args, kwargs = call, (), {}
         else:
-            raise ConnectionError(f'Unknown status code: {status}')
+            func_name, args, kwargs, *_ = (*call, (), {})
+
+        if func_name not in self._dct:
+            raise AttributeError(
+                f'`{self.__class__.__name__}` object has no attribute `{func_name}`'
+            )
+
+        return {'func_name': func_name, 'args': tuple(args), 'kwargs': dict(kwargs)}
+
+    def _eval_framed(self, dct):
+        """Send `dct` as a framed message and return the status and data of
+        the response."""
+        self._msg_id = (self._msg_id + 1) & 0xFFFFFFFF
+        protocol.send_message(self.s, dct, codec=codec, msg_id=self._msg_id)
+
+        message = protocol.recv_message(self.s)
+        if message is None:
+            raise TEMCommunicationError('Connection to the TEM server was closed')
+
+        header, response = message
+        if header.msg_id != self._msg_id:
+            raise protocol.ProtocolError(
+                f'Response id {header.msg_id} does not match request id {self._msg_id}'
+            )
+
+        return response
+
+    def get_server_metrics(self) -> dict:
+        """Return statistics on the requests handled by the TEM server, such
+        as the number of clients and the depth of the request queue."""
+        return self._eval_dct({'func_name': protocol.METRICS})
 
     def _init_dict(self):
         from instamatic.TEMController.microscope import get_tem
@@ -132,9 +248,181 @@ class MicroscopeClient:
             config.settings.use_goniotool = self.is_goniotool_available()
 
 
+class Batch:
+    """Collects calls on a `MicroscopeClient` and evaluates them in a single
+    round trip when the context is exited.
+
+    See `MicroscopeClient.batch`.
+    """
+
+    def __init__(self, client: MicroscopeClient):
+        self._client = client
+        self._calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.submit()
+        else:
+            for _, future in self._calls:
+                future.cancel()
+
+    def __getattr__(self, func_name):
+        self._client._make_call(func_name)  # check that the function exists
+
+        def wrapper(*args, **kwargs):
+            future = Future()
+            self._calls.append(((func_name, args, kwargs), future))
+            return future
+
+        return wrapper
+
+    def submit(self) -> None:
+        """Evaluate the collected calls and set the results on their
+        futures."""
+        calls, self._calls = self._calls, []
+        if not calls:
+            return
+
+        try:
+            results = self._client.call_many(
+                [call for call, _ in calls], return_exceptions=True
+            )
+        except Exception as e:
+            for _, future in calls:
+                future.set_exception(e)
+            raise
+
+        for (_, future), result in zip(calls, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class AsyncMicroscopeClient:
+    """Asyncio version of `MicroscopeClient`.
+
+    Every function of the microscope interface is a coroutine. Calls
+    from different tasks share one connection and do not wait for each
+    other's round trips, so stage polling, deflector reads, and image
+    acquisition can be overlapped in a single event loop. The server
+    must support framed messages.
+
+    Usage:
+        async with AsyncMicroscopeClient(interface='jeol') as tem:
+            pos, ht = await asyncio.gather(tem.getStagePosition(), tem.getHTValue())
+    """
+
+    def __init__(self, *, interface: str):
+        self.interface = interface
+        self.name = interface
+        self._connection = None
+
+        self._init_dict()
+
+    async def connect(self):
+        """Connect to the TEM server, starting it if necessary."""
+        kwargs = {'key': 'func_name', 'loader': loader, 'dumper': dumper}
+        kwargs.update(bufsize=BUFSIZE, codec=codec)
+
+        try:
+            self._connection = await protocol.AsyncConnection.open(HOST, PORT, **kwargs)
+        except ConnectionRefusedError:
+            start_server_in_subprocess()
+
+            for t in range(30):
+                try:
+                    self._connection = await protocol.AsyncConnection.open(HOST, PORT, **kwargs)
+                except ConnectionRefusedError:
+                    await asyncio.sleep(1)
+                    if t > 3:
+                        print('Waiting for server')
+                else:
+                    break
+            else:
+                raise TEMCommunicationError('Cannot establish server connection (timeout)')
+
+        print(f'Connected to TEM server ({HOST}:{PORT})')
+
+        if config.settings.use_goniotool:
+            config.settings.use_goniotool = await self.is_goniotool_available()
+
+    async def close(self):
+        if self._connection is not None:
+            await self._connection.close()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, kind, value, traceback):
+        await self.close()
+
+    def __getattr__(self, func_name):
+        try:
+            wrapped = self._dct[func_name]
+        except KeyError as e:
+            raise AttributeError(
+                f'`{self.__class__.__name__}` object has no attribute `{func_name}`'
+            ) from e
+
+        @wraps(wrapped)
+        async def wrapper(*args, **kwargs):
+            dct = {'func_name': func_name, 'args': args, 'kwargs': kwargs}
+            return await self._eval_dct(dct)
+
+        return wrapper
+
+    async def _eval_dct(self, dct):
+        if self._connection is None:
+            raise TEMCommunicationError('Not connected to the TEM server, call `connect` first')
+
+        status, data = await self._connection.request(dct)
+
+        if status == 200:
+            return data
+
+        raise get_exception(status, data)
+
+    async def call_many(self, calls: Iterable, return_exceptions: bool = False) -> list:
+        """Evaluate a sequence of calls on the server in a single round trip,
+        see `MicroscopeClient.call_many`."""
+        calls = [self._make_call(call) for call in calls]
+
+        dct = {'func_name': protocol.BATCH, 'args': (calls,), 'kwargs': {}}
+        responses = await self._eval_dct(dct)
+
+        results = []
+        for status, data in responses:
+            if status == 200:
+                results.append(data)
+                continue
+
+            exc = get_exception(status, data)
+            if not return_exceptions:
+                raise exc
+            results.append(exc)
+
+        return results
+
+    async def get_server_metrics(self) -> dict:
+        """Return statistics on the requests handled by the TEM server."""
+        return await self._eval_dct({'func_name': protocol.METRICS})
+
+    _init_dict = MicroscopeClient._init_dict
+    _make_call = MicroscopeClient._make_call
+    __dir__ = MicroscopeClient.__dir__
+
+
 class TraceVariable:
     """Simple class to trace a variable over time.
 
+    To sample several variables at fixed rates, see
+    `instamatic.TEMController.telemetry.TelemetrySampler`.
+
     Usage:
         t = TraceVariable(ctrl.stage.get, verbose=True)
         t.start()
@@ -41,6 +41,8 @@ class SimuMicroscope(MicroscopeBase):
     are randomized based on the config file loaded.
     """
 
+    thread_safe = True
+
     def __init__(self, name: str = 'simulate'):
         super().__init__()
 
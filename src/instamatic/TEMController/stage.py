@@ -20,6 +20,7 @@ class Stage:
         self._setter = self._tem.setStagePosition
         self._getter = self._tem.getStagePosition
         self._wait = True  # properties only
+        self._state_cache = None  # set by `TEMController`
 
     def __repr__(self):
         x, y, z, a, b = self.get()
@@ -41,6 +42,7 @@ class Stage:
     ) -> None:
         """Wait: bool, block until stage movement is complete (JEOL only)"""
         self._setter(x, y, z, a, b, wait=wait)
+        self._invalidate()
 
     def set_with_speed(
         self,
@@ -58,6 +60,7 @@ class Stage:
         speed: float, set stage rotation with specified speed (FEI only)
         """
         self._setter(x, y, z, a, b, wait=wait, speed=speed)
+        self._invalidate()
 
     def set_rotation_speed(self, speed=1) -> None:
         """Sets the stage (rotation) movement speed on the TEM."""
@@ -221,6 +224,12 @@ class Stage:
         """This will halt the stage preemptively if `wait=False` is passed to
         Stage.set."""
         self._tem.stopStage()
+        self._invalidate()
+
+    def _invalidate(self):
+        """Remove the stage position from the state cache."""
+        if self._state_cache is not None:
+            self._state_cache.invalidate('StagePosition')
 
     def alpha_wobbler(self, delta: float = 5.0, event=None) -> None:
         """Tilt the stage by plus/minus the value of delta (degrees) If event
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, NamedTuple, Optional, Tuple, Union
+
+from .deflectors import DeflectorTuple
+from .stage import StagePositionTuple
+
+# Microscope getters read for a state snapshot, and the type of their values
+STATE_GETTERS = {
+    'FunctionMode': ('getFunctionMode', None),
+    'GunShift': ('getGunShift', DeflectorTuple),
+    'GunTilt': ('getGunTilt', DeflectorTuple),
+    'BeamShift': ('getBeamShift', DeflectorTuple),
+    'BeamTilt': ('getBeamTilt', DeflectorTuple),
+    'ImageShift1': ('getImageShift1', DeflectorTuple),
+    'ImageShift2': ('getImageShift2', DeflectorTuple),
+    'DiffShift': ('getDiffShift', DeflectorTuple),
+    'StagePosition': ('getStagePosition', StagePositionTuple),
+    'Magnification': ('getMagnification', None),
+    'DiffFocus': ('getDiffFocus', None),
+    'Brightness': ('getBrightness', None),
+    'SpotSize': ('getSpotSize', None),
+}
+
+# Values that change without a call from instamatic, e.g. the stage position
+# during a rotation. These are not cached unless a TTL is given explicitly.
+VOLATILE_KEYS = ('StagePosition',)
+
+
+class StateSnapshot(NamedTuple):
+    """Microscope state at a single point in time.
+
+    Values that were not requested, or that are not available in the
+    current mode (e.g. `DiffFocus` in imaging mode), are None.
+    """
+
+    FunctionMode: Optional[str] = None
+    GunShift: Optional[DeflectorTuple] = None
+    GunTilt: Optional[DeflectorTuple] = None
+    BeamShift: Optional[DeflectorTuple] = None
+    BeamTilt: Optional[DeflectorTuple] = None
+    ImageShift1: Optional[DeflectorTuple] = None
+    ImageShift2: Optional[DeflectorTuple] = None
+    DiffShift: Optional[DeflectorTuple] = None
+    StagePosition: Optional[StagePositionTuple] = None
+    Magnification: Optional[int] = None
+    DiffFocus: Optional[int] = None
+    Brightness: Optional[int] = None
+    SpotSize: Optional[int] = None
+
+    def to_dict(self, *keys) -> dict:
+        """Return the available values as a dict, optionally only those in
+        `keys`."""
+        if not keys:
+            keys = self._fields
+        return {key: getattr(self, key) for key in keys if getattr(self, key) is not None}
+
+
+class StateCache:
+    """Thread-safe store for the last known microscope state.
+
+    The lens, deflector, and state controls of the `TEMController` read
+    their values through the cache (see `fetch`), so repeated reads in a
+    loop do not go to the microscope. Setting a lens or deflector
+    removes its value from the cache, because the microscope may round
+    or clip it; the discrete states store the value they set.
+    Each value expires after the time-to-live (TTL) of its key. `ttl`
+    is either the TTL in seconds for all keys (except `VOLATILE_KEYS`,
+    which are never cached), or a dict with the TTL per key (keys that
+    are not listed are not cached).
+    """
+
+    def __init__(self, ttl: Union[float, Dict[str, float]] = 0.0):
+        if isinstance(ttl, dict):
+            self._ttl = dict(ttl)
+            self._default_ttl = 0.0
+        else:
+            self._ttl = dict.fromkeys(VOLATILE_KEYS, 0.0)
+            self._default_ttl = float(ttl)
+
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def ttl(self, key: str) -> float:
+        """Return the TTL of `key` in seconds."""
+        return self._ttl.get(key, self._default_ttl)
+
+    def get(self, key: str) -> Tuple[bool, object]:
+        """Return a tuple `(found, value)` with the cached value of `key`, if
+        it has not expired."""
+        with self._lock:
+            item = self._values.get(key)
+
+        if item is None:
+            return False, None
+
+        t, value = item
+        if time.perf_counter() - t > self.ttl(key):
+            return False, None
+
+        return True, value
+
+    def put(self, key: str, value) -> None:
+        """Store `value` for `key`."""
+        if self.ttl(key) <= 0:
+            return
+        with self._lock:
+            self._values[key] = (time.perf_counter(), value)
+
+    def fetch(self, key: str, getter: Callable, fresh: bool = False):
+        """Return the cached value of `key`, or read it with `getter` and
+        store it.
+
+        If `fresh` is True, the value is always read with `getter`.
+        """
+        if not fresh:
+            found, value = self.get(key)
+            if found:
+                return value
+
+        value = getter()
+        self.put(key, value)
+        return value
+
+    def invalidate(self, *keys) -> None:
+        """Remove `keys` from the cache, or all values if no keys are
+        given."""
+        with self._lock:
+            if not keys:
+                self._values.clear()
+            for key in keys:
+                self._values.pop(key, None)
+
+
+class StateReader:
+    """Reads the microscope state for image headers with as few round trips
+    as possible.
+
+    The getters in `STATE_GETTERS` are independent, so they are read in
+    a single batch through the TEM server (`MicroscopeClient.call_many`),
+    concurrently if the microscope interface is thread-safe, and one by
+    one otherwise. Values are kept in `cache` and only read again once
+    they have expired or have been invalidated by a setter.
+    """
+
+    def __init__(self, tem, cache: StateCache = None, max_workers: int = 4):
+        self._tem = tem
+        self.cache = cache if cache is not None else StateCache()
+        self._max_workers = max_workers
+        self._executor = None
+
+    def snapshot(self, *keys, fresh: bool = False) -> StateSnapshot:
+        """Return the microscope state for `keys` (default: all).
+
+        If `fresh` is True, the cache is bypassed and all values are
+        read from the microscope.
+        """
+        if not keys or 'all' in keys:
+            keys = tuple(STATE_GETTERS)
+
+        for key in keys:
+            if key not in STATE_GETTERS:
+                raise KeyError(f'No such state key: `{key}`')
+
+        values = {}
+        missing = []
+        for key in keys:
+            found, value = (False, None) if fresh else self.cache.get(key)
+            if found:
+                values[key] = value
+            else:
+                missing.append(key)
+
+        for key, value in self._read(missing).items():
+            self.cache.put(key, value)
+            values[key] = value
+
+        return StateSnapshot(**values)
+
+    def _read(self, keys: list) -> dict:
+        """Read `keys` from the microscope, values that are not available
+        (`ValueError`) are left out."""
+        if not keys:
+            return {}
+
+        names = [STATE_GETTERS[key][0] for key in keys]
+
+        if hasattr(self._tem, 'call_many'):
+            results = self._tem.call_many(names, return_exceptions=True)
+        elif getattr(self._tem, 'thread_safe', False) and len(keys) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+            futures = [self._executor.submit(getattr(self._tem, name)) for name in names]
+            results = [future.exception() or future.result() for future in futures]
+        else:
+            results = []
+            for name in names:
+                try:
+                    results.append(getattr(self._tem, name)())
+                except ValueError as e:
+                    results.append(e)
+
+        values = {}
+        for key, result in zip(keys, results):
+            if isinstance(result, ValueError):
+                continue
+            if isinstance(result, Exception):
+                raise result
+
+            convert = STATE_GETTERS[key][1]
+            values[key] = convert(*result) if convert else result
+
+        return values
@@ -11,6 +11,7 @@ class State:
         self._tem = tem
         self._getter = None
         self._setter = None
+        self._state_cache = None  # set by `TEMController`
 
     def __repr__(self):
         return f'{self.name}({repr(self.state)})'
@@ -26,6 +27,18 @@ class State:
         """Return name of the state control."""
         return self.__class__.__name__
 
+    def _fetch(self, key: str, fresh: bool = False):
+        """Read the state with the getter, or from the state cache if
+        available."""
+        if self._state_cache is None:
+            return self._getter()
+        return self._state_cache.fetch(key, self._getter, fresh=fresh)
+
+    def _store(self, key: str, value) -> None:
+        """Store the state that was set in the state cache."""
+        if self._state_cache is not None:
+            self._state_cache.put(key, value)
+
 
 class Beam(State):
     """Control for the beam blanker."""
@@ -44,12 +57,13 @@ class Beam(State):
     @property
     def is_blanked(self) -> bool:
         """Return the status of the beam blanker as a `bool`"""
-        return self._getter()
+        return self._fetch('BeamBlanked')
 
     def blank(self, delay: float = 0.0) -> None:
         """Turn the beamblank on, optionally wait for `delay` in ms to allow
         the beam to settle."""
         self._setter(True)
+        self._store('BeamBlanked', True)
         if delay:
             time.sleep(delay)
 
@@ -57,6 +71,7 @@ class Beam(State):
         """Turn the beamblank off, optionally wait for `delay` in ms to allow
         the beam to settle."""
         self._setter(False)
+        self._store('BeamBlanked', False)
         if delay:
             time.sleep(delay)
 
@@ -66,9 +81,9 @@ class Beam(State):
         f = (self.unblank, self.blank)[index]
         f(delay=delay)
 
-    def get(self) -> str:
+    def get(self, fresh: bool = False) -> str:
         """Get current state of the beam."""
-        return self._states[self.is_blanked]
+        return self._states[self._fetch('BeamBlanked', fresh=fresh)]
 
 
 class Mode(State):
@@ -87,10 +102,14 @@ class Mode(State):
     def set(self, mode: str) -> None:
         """Set the function mode."""
         self._setter(mode)
+        if self._state_cache is not None:
+            self._state_cache.invalidate()  # all lenses depend on the mode
+        if isinstance(mode, str):
+            self._store('FunctionMode', mode)
 
-    def get(self) -> str:
+    def get(self, fresh: bool = False) -> str:
         """Returns the function mode."""
-        return self._getter()
+        return self._fetch('FunctionMode', fresh=fresh)
 
 
 class Screen(State):
@@ -121,10 +140,11 @@ class Screen(State):
         """Lower the fluorescence screen."""
         self.set(self._DOWN)
 
-    def get(self) -> str:
+    def get(self, fresh: bool = False) -> str:
         """Get the position of the fluorescence screen."""
-        return self._getter()
+        return self._fetch('ScreenPosition', fresh=fresh)
 
     def set(self, state: str) -> None:
         """Set the position of the fluorescence screen (up/down)."""
         self._setter(state)
+        self._store('ScreenPosition', state)
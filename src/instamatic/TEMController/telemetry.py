@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+# Microscope getters available as telemetry channels by name
+TELEMETRY_GETTERS = {
+    'stage': 'getStagePosition',
+    'beamshift': 'getBeamShift',
+    'beamtilt': 'getBeamTilt',
+    'diffshift': 'getDiffShift',
+    'difffocus': 'getDiffFocus',
+    'brightness': 'getBrightness',
+    'magnification': 'getMagnification',
+    'high_tension': 'getHTValue',
+    'current_density': 'getCurrentDensity',
+}
+
+# Sampling interval in seconds of the default channels
+DEFAULT_CHANNELS = {
+    'stage': 0.1,
+    'beamshift': 0.5,
+    'difffocus': 0.5,
+    'high_tension': 5.0,
+    'current_density': 1.0,
+}
+
+
+class Channel:
+    """Ring buffer with the timestamped samples of a single getter.
+
+    The buffers are allocated on the first value (when the number of
+    values per sample is known) and reused afterwards. Samples are
+    written by a single thread, and read without locks: the latest
+    sample is published as an immutable tuple, and `window` discards
+    samples that were overwritten while they were being copied.
+    """
+
+    def __init__(self, name: str, getter: Callable, interval: float, capacity: int):
+        self.name = name
+        self.getter = getter
+        self.interval = interval
+        self.capacity = capacity
+
+        # one spare slot, so the slot being written is never one of the
+        # `capacity` most recent samples
+        self._size = capacity + 1
+        self.times = np.full(self._size, np.nan)
+        self.values = None
+        self.count = 0  # total number of samples written
+        self.last_error = None
+
+        self._latest = None
+
+    def add(self, t: float, value) -> None:
+        """Write a sample, called by the sampler thread only."""
+        value = np.atleast_1d(np.asarray(value, dtype=float))
+        if self.values is None:
+            # samples that were missing before the first value read as NaN
+            self.values = np.full((self._size, value.size), np.nan)
+
+        i = self.count % self._size
+        self.times[i] = t
+        self.values[i] = value
+        self.count += 1
+
+        self._latest = (t, value)
+
+    def add_missing(self, t: float) -> None:
+        """Write a sample without value, e.g. DiffFocus in imaging mode.
+
+        The values of the sample are NaN in `window`, and None in
+        `latest`.
+        """
+        i = self.count % self._size
+        self.times[i] = t
+        if self.values is not None:
+            self.values[i] = np.nan
+        self.count += 1
+
+        self._latest = (t, None)
+
+    def latest(self) -> Optional[Tuple[float, np.ndarray]]:
+        """Return the timestamp and values of the last sample, or None."""
+        return self._latest
+
+    def window(self, t0: float = -np.inf, t1: float = np.inf) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the timestamps and values of the samples between `t0` and
+        `t1`, in chronological order."""
+        count = self.count
+        if count == 0:
+            return np.empty(0), np.empty((0, 0))
+
+        start = max(count - self.capacity, 0)
+        index = np.arange(start, count) % self._size
+        times = self.times[index]
+        if self.values is None:
+            # no value has been read yet, so the number of values is unknown
+            values = np.empty((len(index), 0))
+        else:
+            values = self.values[index]
+
+        # samples that the writer overwrote (or is overwriting) while they
+        # were being copied
+        overwritten = self.count - self.capacity - start
+        if overwritten > 0:
+            times = times[overwritten:]
+            values = values[overwritten:]
+
+        sel = (times >= t0) & (times <= t1)
+        return times[sel], values[sel]
+
+
+class TelemetrySampler(threading.Thread):
+    """Samples microscope getters at fixed rates on a dedicated thread.
+
+    Each channel keeps the last `capacity` samples in a ring buffer, use
+    `latest` to get the most recent value without waiting for the
+    microscope, and `window` to get all samples in a time range. The
+    timestamps are taken from `clock` (`time.perf_counter` by default,
+    like the image timestamps in `TEMController.get_image`) halfway
+    through each call.
+
+    tem: Microscope control object, e.g. `ctrl.tem`
+    channels: dict with the sampling interval in seconds of the channels
+        in `TELEMETRY_GETTERS`, defaults to `DEFAULT_CHANNELS`
+
+    Usage:
+        sampler = TelemetrySampler(ctrl.tem)
+        sampler.start()
+        t, (x, y, z, a, b) = sampler.latest('stage')
+        times, positions = sampler.window('stage', t0, t1)
+        sampler.stop()
+    """
+
+    def __init__(
+        self,
+        tem,
+        channels: Dict[str, float] = None,
+        capacity: int = 4096,
+        clock: Callable = time.perf_counter,
+    ):
+        super().__init__(name='TelemetrySampler', daemon=True)
+        self._tem = tem
+        self.capacity = capacity
+        self.clock = clock
+
+        self.channels = {}
+        self._stop_event = threading.Event()
+
+        if channels is None:
+            channels = DEFAULT_CHANNELS
+
+        for name, interval in channels.items():
+            self.add_channel(name, getattr(tem, TELEMETRY_GETTERS[name]), interval)
+
+    def add_channel(self, name: str, getter: Callable, interval: float) -> Channel:
+        """Sample `getter` every `interval` seconds, must be called before
+        the sampler is started."""
+        if self.is_alive():
+            raise RuntimeError('Cannot add channels to a running sampler')
+        if interval <= 0:
+            raise ValueError(f'Invalid sampling interval: {interval}')
+
+        channel = Channel(name, getter, interval, self.capacity)
+        self.channels[name] = channel
+        return channel
+
+    def latest(self, name: str) -> Optional[Tuple[float, np.ndarray]]:
+        """Return the timestamp and values of the last sample of channel
+        `name`, or None if it has not been sampled yet."""
+        return self.channels[name].latest()
+
+    def window(
+        self, name: str, t0: float = -np.inf, t1: float = np.inf
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the timestamps and values of channel `name` between `t0` and
+        `t1`."""
+        return self.channels[name].window(t0, t1)
+
+    def stop(self, timeout: float = None) -> None:
+        """Stop sampling and wait for the thread to finish."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self) -> None:
+        channels = list(self.channels.values())
+        if not channels:
+            return
+
+        now = self.clock()
+        due = [now] * len(channels)
+
+        while not self._stop_event.is_set():
+            i = int(np.argmin(due))
+            delay = due[i] - self.clock()
+            if delay > 0 and self._stop_event.wait(delay):
+                break
+
+            channel = channels[i]
+            self._sample(channel)
+
+            # keep a fixed rate, skip samples if the getter is too slow
+            due[i] += channel.interval
+            now = self.clock()
+            if due[i] < now:
+                due[i] += channel.interval * np.ceil((now - due[i]) / channel.interval)
+
+    def _sample(self, channel: Channel) -> None:
+        t_start = self.clock()
+        try:
+            value = channel.getter()
+        except Exception as e:
+            channel.last_error = e
+            channel.add_missing((t_start + self.clock()) / 2)
+        else:
+            channel.add((t_start + self.clock()) / 2, value)
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 
 from numpy import ndarray
 
@@ -50,6 +50,25 @@ class CameraBase(ABC):
             for _ in range(n_frames)
         ]
 
+    def iter_movie(
+        self, n_frames: int, exposure: float = None, binsize: int = None, **kwargs
+    ) -> Iterator[ndarray]:
+        """Yield the frames of a movie one at a time as they are acquired.
+
+        If the subclass has a dedicated movie mode (`get_movie`), e.g. a
+        gapless acquisition, it is used, so that the timing of the frames
+        is the same as with `get_movie`. The frames are then only yielded
+        once the movie has been acquired. Otherwise, each frame is
+        acquired with `get_image`, so that only one frame is held in
+        memory. Subclasses that can return the frames of their movie mode
+        before the movie is finished should override this.
+        """
+        if type(self).get_movie is not CameraBase.get_movie:
+            yield from self.get_movie(n_frames, exposure=exposure, binsize=binsize, **kwargs)
+        else:
+            for _ in range(n_frames):
+                yield self.get_image(exposure=exposure, binsize=binsize, **kwargs)
+
     def __enter__(self):
         self.establish_connection()
         return self
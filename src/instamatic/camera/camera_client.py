@@ -1,24 +1,33 @@
 from __future__ import annotations
 
+import asyncio
 import atexit
 import socket
 import subprocess as sp
 import time
+import weakref
+from collections import deque
 from functools import wraps
 
 import numpy as np
 
 from instamatic import config
 from instamatic.exceptions import TEMCommunicationError, exception_list
+from instamatic.server import protocol
+from instamatic.server.protocol import get_exception
+from instamatic.server.serializer import CODEC_RAW, CODECS, loads
 from instamatic.server.serializer import pickle_dumper as dumper
 from instamatic.server.serializer import pickle_loader as loader
 
 if config.settings.cam_use_shared_memory:
     from multiprocessing import shared_memory
 
+    from instamatic.server.frame_pool import SharedFrame
+
 HOST = config.settings.cam_server_host
 PORT = config.settings.cam_server_port
 BUFSIZE = 4096
+CODEC = CODECS['pickle']
 
 
 class ServerError(Exception):
@@ -54,9 +63,18 @@ class CamClient:
         self.name = name
         self.interface = interface
         self._bufsize = BUFSIZE
+        self._msg_id = 0
         self.streamable = False  # overrides cam settings
         self.verbose = False
 
+        # Receive raw images into the same array on every call, note that
+        # each call to `get_image` then overwrites the previously returned image
+        self.reuse_image_buffer = False
+        self._image_buffer = None
+
+        # weak reference to the active movie stream and its message id
+        self._stream = None
+
         try:
             self.connect()
         except ConnectionRefusedError:
@@ -81,6 +99,8 @@ class CamClient:
 
         self.buffers = {}
         self.shms = {}
+        self._slot_shms = {}
+        self._releases = deque()
 
         self._init_dict()
         self._init_attr_dict()
@@ -100,6 +120,9 @@ class CamClient:
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.s.connect((HOST, PORT))
         print(f'Connected to CAM server ({HOST}:{PORT})')
+        self._framed = protocol.negotiate(
+            self.s, key='attr_name', loader=loader, dumper=dumper, bufsize=self._bufsize
+        )
 
     def __getattr__(self, attr_name):
         if attr_name in self._dct:
@@ -121,24 +144,28 @@ class CamClient:
 
     def _eval_dct(self, dct):
         """Takes approximately 0.2-0.3 ms per call if HOST=='localhost'."""
-        self.s.send(dumper(dct))
-
         acquiring_image = dct['attr_name'] == 'get_image'
-        acquiring_movie = dct['attr_name'] == 'get_movie'
-
-        if acquiring_movie:
-            raise NotImplementedError('Acquiring movies over a socket is not supported.')
 
-        if acquiring_image and not self.use_shared_memory:
-            response = self.s.recv(self._imagebufsize)
+        if self._framed:
+            if acquiring_image:
+                dct['transport'] = 'ring' if self.use_shared_memory else 'raw'
+            status, data = self._eval_framed(dct)
         else:
-            response = self.s.recv(self._bufsize)
+            self.s.send(dumper(dct))
 
-        if response:
-            status, data = loader(response)
+            if acquiring_image and not self.use_shared_memory:
+                response = self.s.recv(self._imagebufsize)
+            else:
+                response = self.s.recv(self._bufsize)
 
-        if self.use_shared_memory and acquiring_image:
-            data = self.get_data_from_shared_memory(**data)
+            if response:
+                status, data = loader(response)
+
+        if acquiring_image and status == 200 and isinstance(data, dict):
+            if 'slot' in data:
+                data = self.get_frame_from_shared_memory(**data)
+            else:
+                data = self.get_data_from_shared_memory(**data)
 
         if status == 200:
             return data
@@ -150,6 +177,139 @@ class CamClient:
         else:
             raise ConnectionError(f'Unknown status code: {status}')
 
+    def _eval_framed(self, dct):
+        """Send `dct` as a framed message and return the status and data of
+        the response."""
+        self._finish_stream()
+        msg_id = self._send_framed(dct)
+
+        out = self._image_buffer if self.reuse_image_buffer else None
+        header, response = self._recv_framed(msg_id, out=out)
+        if self.reuse_image_buffer and header.codec == CODEC_RAW:
+            self._image_buffer = response[1]
+
+        return response
+
+    def _send_framed(self, dct) -> int:
+        """Send `dct` as a framed message, returns the message id."""
+        if self._releases:
+            dct['release'] = self._pop_releases()
+        self._msg_id = (self._msg_id + 1) & 0xFFFFFFFF
+        protocol.send_message(self.s, dct, codec=CODEC, msg_id=self._msg_id)
+        return self._msg_id
+
+    def _recv_framed(self, msg_id: int, out: np.ndarray = None):
+        """Receive the next response to request `msg_id`.
+
+        Returns the frame header and a tuple with the status and data.
+        Raw frames are received as numpy arrays (into `out` if
+        possible).
+        """
+        header = protocol.recv_header(self.s)
+        if header is None:
+            raise TEMCommunicationError('Connection to the CAM server was closed')
+
+        if header.msg_id != msg_id:
+            raise protocol.ProtocolError(
+                f'Response id {header.msg_id} does not match request id {msg_id}'
+            )
+
+        if header.codec == CODEC_RAW:
+            return header, (200, protocol.recv_array(self.s, header, out=out))
+
+        payload = protocol.recv_exactly(self.s, header.length)
+        if payload is None:
+            raise TEMCommunicationError('Connection to the CAM server was closed')
+
+        return header, loads(payload, header.codec)
+
+    def get_movie(self, n_frames: int, exposure: float = None, binsize: int = None, **kwargs):
+        """Acquire a movie through the camera server.
+
+        Returns a generator that yields the frames one at a time as they
+        are received. Cameras that can stream their movie mode send each
+        frame as soon as it is acquired, so that the full stack is never
+        held in memory on the server; cameras with a dedicated (e.g.
+        gapless) movie mode send the frames after it has finished (see
+        `CameraBase.iter_movie`). The generator must be consumed or
+        closed before the camera can be used for anything else.
+
+        Parameters
+        ----------
+        n_frames : int
+            Number of frames to collect
+        exposure : float, optional
+            Exposure time in seconds.
+        binsize : int, optional
+            Which binning to use.
+
+        Returns
+        -------
+        frames : Iterator[np.ndarray]
+        """
+        if not self._framed:
+            raise NotImplementedError(
+                'Acquiring movies requires a CAM server that supports framed messages.'
+            )
+
+        self._finish_stream()
+
+        kwargs.update(exposure=exposure, binsize=binsize)
+        dct = {'attr_name': 'iter_movie', 'args': (n_frames,), 'kwargs': kwargs, 'stream': True}
+        msg_id = self._send_framed(dct)
+
+        stream = self._iter_stream(msg_id)
+        self._stream = (weakref.ref(stream), msg_id)
+        return stream
+
+    def _iter_stream(self, msg_id: int):
+        """Yield frames from the response to request `msg_id` until the final
+        response arrives."""
+        try:
+            while True:
+                header, (status, data) = self._recv_framed(msg_id)
+                if not header.flags & protocol.FLAG_MORE:
+                    break
+                yield data
+        except GeneratorExit:
+            self._drain_stream(msg_id)
+            raise
+        finally:
+            self._stream = None
+
+        if status == 500:
+            error_code, args = data
+            raise exception_list.get(error_code, TEMCommunicationError)(*args)
+        elif status != 200:
+            raise ConnectionError(f'Unknown status code: {status}')
+
+    def _drain_stream(self, msg_id: int) -> None:
+        """Receive and discard the remaining frames of the stream `msg_id`."""
+        while True:
+            header, _ = self._recv_framed(msg_id)
+            if not header.flags & protocol.FLAG_MORE:
+                break
+
+    def _finish_stream(self) -> None:
+        """Make sure no movie is being streamed before sending a request."""
+        if self._stream is None:
+            return
+
+        ref, msg_id = self._stream
+        if ref() is not None:
+            raise RuntimeError(
+                'A movie is being streamed from the CAM server, consume or close it first.'
+            )
+
+        # the generator was discarded before it was started
+        self._drain_stream(msg_id)
+        self._stream = None
+
+    def get_server_metrics(self) -> dict:
+        """Return statistics on the requests handled by the CAM server, such
+        as the number of clients and the depth of the request queue."""
+        return self._eval_dct({'attr_name': protocol.METRICS})
+
     def _init_dict(self):
         """Get list of functions and their doc strings from the uninitialized
         class."""
@@ -196,8 +356,187 @@ class CamClient:
 
         return data
 
+    def get_frame_from_shared_memory(
+        self, name: str, shape: tuple, dtype: str, slot: int, seq: int, **kwargs
+    ):
+        """Return a view of the frame in shared memory slot `slot`.
+
+        The server does not overwrite the slot until the frame has been
+        released, either explicitly through `release_image`, or when the
+        returned array and all views of it have been garbage collected.
+        """
+        shm = self._slot_shms.get(slot)
+        if shm is None or shm.name != name:
+            # the server re-allocated the slot; the previous block is not
+            # closed here, frames handed out earlier keep it open until
+            # they are garbage collected
+            shm = shared_memory.SharedMemory(name=name)
+            self._slot_shms[slot] = shm
+            if self.verbose:
+                print(f'Connect to buffer: `{name}` (slot {slot}) | {shape} ({dtype})')
+
+        frame = SharedFrame(shm, shape, dtype, slot=slot, seq=seq, on_release=self._add_release)
+        return np.asarray(frame)
+
+    def release_image(self, arr) -> None:
+        """Tell the server that the image `arr` is no longer used, so that its
+        shared memory slot can be reused.
+
+        `arr` and all views of it must not be used afterwards. Has no
+        effect for images that were not passed via shared memory.
+        """
+        if not self.use_shared_memory:
+            return
+        frame = SharedFrame.from_array(arr)
+        if frame is not None:
+            frame.release()
+
+    def _add_release(self, slot: int, seq: int) -> None:
+        """Schedule the release of `slot`, releases are sent to the server
+        with the next request."""
+        self._releases.append((slot, seq))
+
+    def _pop_releases(self) -> list:
+        releases = []
+        while self._releases:
+            releases.append(self._releases.popleft())
+        return releases
+
     def block(self):
         raise NotImplementedError('This camera cannot be streamed.')
 
     def unblock(self):
         raise NotImplementedError('This camera cannot be streamed.')
+
+
+class AsyncCamClient:
+    """Asyncio version of `CamClient`.
+
+    Every function of the camera interface is a coroutine, and camera
+    attributes are awaitables (`await cam.name_of_attr`). Requests from
+    different tasks share one connection without waiting for each
+    other's round trips. Images are received as raw frames, and movies
+    are streamed with `async for frame in cam.get_movie(n)`. The server
+    must support framed messages.
+
+    Usage:
+        async with AsyncCamClient(name='simulate', interface='simulate') as cam:
+            img = await cam.get_image(exposure=0.1)
+    """
+
+    def __init__(self, name: str, interface: str):
+        self.name = name
+        self.interface = interface
+        self.streamable = False  # overrides cam settings
+        self._connection = None
+        self._attr_dct = {}
+
+        self._init_dict()
+
+    async def connect(self):
+        """Connect to the CAM server, starting it if necessary."""
+        kwargs = {'key': 'attr_name', 'loader': loader, 'dumper': dumper}
+        kwargs.update(bufsize=BUFSIZE, codec=CODEC)
+
+        try:
+            self._connection = await protocol.AsyncConnection.open(HOST, PORT, **kwargs)
+        except ConnectionRefusedError:
+            start_server_in_subprocess()
+
+            for t in range(30):
+                try:
+                    self._connection = await protocol.AsyncConnection.open(HOST, PORT, **kwargs)
+                except ConnectionRefusedError:
+                    await asyncio.sleep(1)
+                    if t > 3:
+                        print('Waiting for server')
+                else:
+                    break
+            else:
+                raise RuntimeError('Cannot establish server connection (timeout)')
+
+        print(f'Connected to CAM server ({HOST}:{PORT})')
+
+        self._attr_dct = await self.get_attrs()
+
+    async def close(self):
+        if self._connection is not None:
+            await self._connection.close()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, kind, value, traceback):
+        await self.close()
+
+    def __getattr__(self, attr_name):
+        if attr_name in self._dct:
+            wrapped = self._dct[attr_name]
+        elif attr_name in self._attr_dct:
+            return self._eval_dct({'attr_name': attr_name})
+        else:
+            raise AttributeError(
+                f'`{self.__class__.__name__}` object has no attribute `{attr_name}`'
+            )
+
+        @wraps(wrapped)
+        async def wrapper(*args, **kwargs):
+            dct = {'attr_name': attr_name, 'args': args, 'kwargs': kwargs}
+            return await self._eval_dct(dct)
+
+        return wrapper
+
+    async def _eval_dct(self, dct):
+        if self._connection is None:
+            raise TEMCommunicationError('Not connected to the CAM server, call `connect` first')
+
+        if dct['attr_name'] == 'get_image':
+            dct['transport'] = 'raw'
+
+        status, data = await self._connection.request(dct)
+
+        if status == 200:
+            return data
+
+        raise get_exception(status, data)
+
+    async def get_movie(
+        self, n_frames: int, exposure: float = None, binsize: int = None, **kwargs
+    ):
+        """Acquire a movie through the camera server, see
+        `CamClient.get_movie`.
+
+        Returns an asynchronous generator that yields the frames as they
+        are received. Other requests can be sent while the movie is
+        streamed, they are answered once the movie has finished.
+        """
+        if self._connection is None:
+            raise TEMCommunicationError('Not connected to the CAM server, call `connect` first')
+
+        kwargs.update(exposure=exposure, binsize=binsize)
+        dct = {'attr_name': 'iter_movie', 'args': (n_frames,), 'kwargs': kwargs, 'stream': True}
+        msg_id, responses = await self._connection.open_stream(dct)
+
+        try:
+            while True:
+                item = await responses.get()
+                if isinstance(item, Exception):
+                    raise item
+
+                header, (status, data) = item
+                if not header.flags & protocol.FLAG_MORE:
+                    break
+                yield data
+        finally:
+            self._connection.close_stream(msg_id)
+
+        if status != 200:
+            raise get_exception(status, data)
+
+    async def get_server_metrics(self) -> dict:
+        """Return statistics on the requests handled by the CAM server."""
+        return await self._eval_dct({'attr_name': protocol.METRICS})
+
+    _init_dict = CamClient._init_dict
+    __dir__ = CamClient.__dir__
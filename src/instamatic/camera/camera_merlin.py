@@ -20,6 +20,10 @@ frame = cam.get_image(exposure=0.1)
 
 # acquire multiple frames with gapless acquisition
 frames = cam.get_movie(n_frames=10, exposure=0.1)
+
+# long movies, frames are handed to the consumer as they arrive
+for frame in cam.iter_movie(n_frames=100_000, exposure=0.001):
+    ...
 ```
 """
 
@@ -27,9 +31,11 @@ from __future__ import annotations
 
 import atexit
 import logging
+import queue
 import socket
+import threading
 import time
-from typing import Any, List
+from typing import Any, Callable, Iterator, List, Tuple
 
 import numpy as np
 
@@ -43,6 +49,8 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+_DONE = object()
+
 # socket.settimeout(5)  # seconds
 socket.setdefaulttimeout(5)  # seconds
 
@@ -96,19 +104,63 @@ class CameraMerlin(CameraBase):
 
         atexit.register(self.release_connection)
 
-    def receive_data(self, *, nbytes: int) -> bytearray:
-        """Safely receive from the socket until `n_bytes` of data are
-        received."""
-        data = bytearray()
+    def receive_into(self, buffer) -> int:
+        """Safely receive from the socket until the writable `buffer` is
+        filled.
+
+        The data are written directly into `buffer` with
+        `socket.recv_into`, so that no intermediate copies are made.
+        Returns the number of bytes received.
+        """
+        view = memoryview(buffer).cast('B')
+        nbytes = view.nbytes
+        received = 0
         n = 0
         t0 = time.perf_counter()
-        while len(data) != nbytes:
-            data.extend(self.s_data.recv(nbytes - len(data)))
+        while received < nbytes:
+            size = self.s_data.recv_into(view[received:], nbytes - received)
+            if not size:
+                raise ConnectionError(
+                    f'Merlin data connection closed after {received} of {nbytes} bytes'
+                )
+            received += size
             n += 1
         t1 = time.perf_counter()
-        logger.info('Received %d bytes in %d steps (%f s)', len(data), n, t1 - t0)
+        logger.info('Received %d bytes in %d steps (%f s)', received, n, t1 - t0)
+        return received
+
+    def receive_data(self, *, nbytes: int) -> bytearray:
+        """Safely receive from the socket until `n_bytes` of data are
+        received."""
+        data = bytearray(nbytes)
+        self.receive_into(data)
         return data
 
+    def receive_movie(self, n_frames: int) -> np.ndarray:
+        """Receive `n_frames` frames from the data socket.
+
+        The frames, including their MPX headers, are received into a
+        single preallocated buffer of `n_frames` times the frame length,
+        which is read from the MPX header of the first frame.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (n_frames, ny, nx), a strided view of the
+            image data in the buffer
+        """
+        mpx_header = self.receive_data(nbytes=self.START_SIZE)
+        frame_length = self.START_SIZE + int(mpx_header[4:])
+
+        logger.info('Receiving %s frames of %s bytes (%s)', n_frames, frame_length, mpx_header)
+
+        buffer = np.empty(n_frames * frame_length, dtype=np.uint8)
+        buffer[: self.START_SIZE] = np.frombuffer(mpx_header, dtype=np.uint8)
+        self.receive_into(buffer[self.START_SIZE :])
+
+        # Must skip first byte when loading data to avoid off-by-one error
+        return load_mib(buffer, skip=self.START_SIZE + 1, stride=frame_length)
+
     def merlin_set(self, key: str, value: Any):
         """Set state on Merlin parameter through command socket.
 
@@ -270,29 +322,15 @@ class CameraMerlin(CameraBase):
 
         return data
 
-    def get_movie(self, n_frames: int, exposure: float = None, **kwargs) -> List[np.ndarray]:
-        """Gapless movie acquisition routine. If the exposure is not given, the
-        default value is read from the config file.
-
-        Parameters
-        ----------
-        n_frames : int
-            Number of frames to collect
-        exposure : float, optional
-            Exposure time in seconds.
-
-        Returns
-        -------
-        List[np.ndarray]
-            List of image data
-        """
+    def start_movie(self, n_frames: int, exposure: float = None) -> None:
+        """Start gapless acquisition of `n_frames` frames, and receive the
+        acquisition header. The frames can then be received from the data
+        socket."""
         if self._soft_trigger_mode:
             self.teardown_soft_trigger()
 
         if exposure is None:
             exposure = self.default_exposure
-        if not binsize:
-            binsize = self.default_binsize
 
         # convert s to ms
         exposure_ms = exposure * 1000
@@ -313,29 +351,83 @@ class CameraMerlin(CameraBase):
 
         logger.debug('Header data received (%s).', header_size)
 
-        frames = []
-        full_framesize = 0
+    def get_movie(
+        self, n_frames: int, exposure: float = None, binsize: int = None, **kwargs
+    ) -> List[np.ndarray]:
+        """Gapless movie acquisition routine. If the exposure is not given, the
+        default value is read from the config file.
 
-        for x in range(n_frames):
-            if not full_framesize:
-                mpx_header = self.receive_data(nbytes=self.START_SIZE)
-                size = int(mpx_header[4:])
+        All frames are kept in memory, use `iter_movie` or `stream_movie`
+        for long movies.
 
-                framedata = self.receive_data(nbytes=size)
-                logger.info('Received frame %s: %s (%s)', x, size, mpx_header)
+        Parameters
+        ----------
+        n_frames : int
+            Number of frames to collect
+        exposure : float, optional
+            Exposure time in seconds.
+        binsize : int, optional
+            Not used, the Merlin does not bin the data
 
-                full_framesize = self.START_SIZE + size
-            else:
-                framedata = self.receive_data(nbytes=full_framesize)[self.START_SIZE :]
+        Returns
+        -------
+        List[np.ndarray]
+            List of image data, views into a single buffer
+        """
+        self.start_movie(n_frames, exposure=exposure)
 
-            frames.append(framedata)
+        data = self.receive_movie(n_frames)
 
         logger.info('%s frames received.', n_frames)
 
-        # Must skip first byte when loading data to avoid off-by-one error
-        data = [load_mib(frame, skip=1).squeeze() for frame in frames]
+        return list(data)
 
-        return data
+    def stream_movie(
+        self,
+        n_frames: int,
+        exposure: float = None,
+        callback: Callable = None,
+        maxsize: int = 64,
+        block: bool = True,
+    ) -> MerlinMovieStream:
+        """Start gapless acquisition of `n_frames` frames, which are received
+        and decoded in a background thread as they arrive (see
+        `MerlinMovieStream`).
+
+        Parameters
+        ----------
+        n_frames : int
+            Number of frames to collect
+        exposure : float, optional
+            Exposure time in seconds.
+        callback : Callable, optional
+            Called as `callback(i, frame)` for each frame in a consumer
+            thread, otherwise the frames are obtained by iterating over
+            the stream.
+        maxsize : int, optional
+            Maximum number of frames waiting for the consumer
+        block : bool, optional
+            If the consumer falls behind, wait for it (True) or drop
+            frames (False)
+
+        Returns
+        -------
+        MerlinMovieStream
+        """
+        self.start_movie(n_frames, exposure=exposure)
+        return MerlinMovieStream(
+            self, n_frames, callback=callback, maxsize=maxsize, block=block
+        )
+
+    def iter_movie(
+        self, n_frames: int, exposure: float = None, binsize: int = None, **kwargs
+    ) -> Iterator[np.ndarray]:
+        """Gapless movie acquisition routine that yields each frame as soon
+        as it is received, so that the memory use does not depend on the
+        length of the movie."""
+        with self.stream_movie(n_frames, exposure=exposure) as stream:
+            for i, frame in stream:
+                yield frame
 
     def get_image_dimensions(self) -> (int, int):
         """Get the binned dimensions reported by the camera."""
@@ -408,6 +500,190 @@ class CameraMerlin(CameraBase):
         logger.info(msg)
 
 
+class MerlinMovieStream:
+    """Receives the frames of a Merlin movie in a background thread.
+
+    Each frame is received into its own buffer and decoded as soon as it
+    is complete, and `(i, frame)` is put on a queue of at most `maxsize`
+    frames. The frames are taken from the queue by iterating over the
+    stream, or by a consumer thread that calls `callback(i, frame)`.
+
+    If the queue is full, the receiving thread waits for the consumer
+    (`block=True`), which eventually stalls the data connection, or
+    drops the frame (`block=False`). The number of frames received and
+    dropped are kept in `n_received` and `n_dropped`.
+
+    `join` waits until all frames have been consumed, `close` stops the
+    acquisition if it is still running and discards the frames that
+    have not been consumed yet. Errors in the receiving thread or the
+    callback are raised again by both.
+
+    Usage:
+        with cam.stream_movie(n_frames, exposure, block=False) as stream:
+            for i, frame in stream:
+                live_view.update(frame)
+        print(stream.n_dropped)
+    """
+
+    def __init__(
+        self,
+        cam: CameraMerlin,
+        n_frames: int,
+        callback: Callable = None,
+        maxsize: int = 64,
+        block: bool = True,
+    ):
+        self.cam = cam
+        self.n_frames = n_frames
+        self.callback = callback
+        self.block = block
+
+        self.n_received = 0
+        self.n_dropped = 0
+        self.errors = []
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+
+        self._threads = [
+            threading.Thread(target=self._receive, name='MerlinReceiver', daemon=True)
+        ]
+        if callback is not None:
+            self._threads.append(
+                threading.Thread(target=self._consume, name='MerlinConsumer', daemon=True)
+            )
+
+        for t in self._threads:
+            t.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                break
+            yield item
+
+        self._raise()
+
+    @property
+    def running(self) -> bool:
+        return self._threads[0].is_alive()
+
+    def _put(self, item) -> bool:
+        """Put `item` on the queue, waiting for space until the stream is
+        stopped."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def _put_done(self) -> None:
+        """Put the end-of-stream marker on the queue. If the stream was
+        stopped while the queue is full, the oldest frames are discarded to
+        make room."""
+        if self._put(_DONE):
+            return
+        while True:
+            try:
+                self._queue.put_nowait(_DONE)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _receive(self) -> None:
+        cam = self.cam
+        start_size = cam.START_SIZE
+        buffer = None
+
+        try:
+            mpx_header = cam.receive_data(nbytes=start_size)
+            frame_length = start_size + int(mpx_header[4:])
+
+            for i in range(self.n_frames):
+                if self._stop.is_set():
+                    break
+
+                # the buffer of a dropped frame is reused
+                if buffer is None:
+                    buffer = np.empty(frame_length, dtype=np.uint8)
+
+                if i == 0:
+                    buffer[:start_size] = np.frombuffer(mpx_header, dtype=np.uint8)
+                    cam.receive_into(buffer[start_size:])
+                else:
+                    cam.receive_into(buffer)
+
+                self.n_received += 1
+
+                # Must skip first byte when loading data to avoid off-by-one error
+                frame = load_mib(buffer, skip=start_size + 1)[0]
+
+                if self.block:
+                    if not self._put((i, frame)):
+                        break
+                else:
+                    try:
+                        self._queue.put_nowait((i, frame))
+                    except queue.Full:
+                        self.n_dropped += 1
+                        continue
+
+                buffer = None
+        except Exception as e:
+            if not self._stop.is_set():
+                logger.exception('Error while receiving Merlin frames')
+                self.errors.append(e)
+        finally:
+            logger.info('%s frames received, %s dropped.', self.n_received, self.n_dropped)
+            self._put_done()
+
+    def _consume(self) -> None:
+        try:
+            for i, frame in self:
+                if self._stop.is_set():
+                    break
+                self.callback(i, frame)
+        except Exception as e:
+            logger.exception('Error in Merlin frame callback')
+            self.errors.append(e)
+            self._stop.set()
+
+    def _raise(self) -> None:
+        if self.errors:
+            raise self.errors[0]
+
+    def join(self) -> None:
+        """Wait until all frames have been received and consumed."""
+        for t in self._threads:
+            t.join()
+        self._raise()
+
+    def close(self) -> None:
+        """Stop the acquisition if it is still running, and wait for the
+        threads to finish."""
+        if self.running:
+            self._stop.set()
+            logger.info('Stopping movie acquisition')
+            self.cam.merlin_cmd('STOPACQUISITION')
+
+        self._stop.set()
+        for t in self._threads:
+            t.join()
+        self._raise()
+
+
 def test_movie(cam):
     print('\n\nMovie acquisition\n---\n')
 
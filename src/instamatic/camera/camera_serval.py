@@ -5,10 +5,10 @@ import logging
 from pathlib import Path
 
 import numpy as np
-from serval_toolkit.camera import Camera as ServalCamera
 
 from instamatic import config
 from instamatic.camera.camera_base import CameraBase
+from instamatic.camera.serval_io import ServalFrameStream
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +17,9 @@ logger = logging.getLogger(__name__)
 # 2. `java -jar .\server\serv-2.1.3.jar`
 # 3. launch `instamatic`
 
+# Number of triggers of a measurement in continuous mode
+CONTINUOUS_TRIGGERS = 2**31 - 1
+
 
 class CameraServal(CameraBase):
     """Interfaces with Serval from ASI."""
@@ -27,6 +30,11 @@ class CameraServal(CameraBase):
         """Initialize camera module."""
         super().__init__(name)
 
+        self._exposure = None
+        self._recording = False
+        self._stream = None
+        self._stream_exposure = None
+
         self.establish_connection()
 
         msg = f'Camera {self.get_name()} initialized'
@@ -48,23 +56,110 @@ class CameraServal(CameraBase):
         if not binsize:
             binsize = self.default_binsize
 
-        # Upload exposure settings (Note: will do nothing if no change in settings)
-        self.conn.set_detector_config(
-            ExposureTime=exposure, TriggerPeriod=exposure + 0.00050001
-        )
+        if self._stream is not None:
+            if exposure != self._stream_exposure:
+                self.start_continuous(exposure=exposure)
+            try:
+                return self._stream.get()
+            except Exception:
+                # the stream has ended, return to single frames so that
+                # the next call starts cleanly
+                self.stop_continuous()
+                raise
+
+        # Upload exposure settings, only if they changed
+        if exposure != self._exposure:
+            self.conn.set_detector_config(
+                ExposureTime=exposure, TriggerPeriod=exposure + 0.00050001
+            )
+            self._exposure = exposure
 
         # Check if measurement is running. If not: start
+        if not self._recording:
+            self._check_measurement()
+
+        try:
+            img = self._trigger_image()
+        except Exception:
+            # the measurement may have ended on the Serval side, restart it
+            # and try once more
+            logger.warning(
+                'Could not acquire an image, checking the measurement', exc_info=True
+            )
+            self._recording = False
+            self._check_measurement()
+            try:
+                img = self._trigger_image()
+            except Exception:
+                self._recording = False
+                raise
+
+        arr = np.asarray(img)
+        return arr
+
+    def _check_measurement(self) -> None:
+        """Start the measurement if it is not running."""
         db = self.conn.dashboard
         if db['Measurement'] is None or db['Measurement']['Status'] != 'DA_RECORDING':
             self.conn.measurement_start()
+        self._recording = True
 
+    def _trigger_image(self):
         # Start the acquisition
         self.conn.trigger_start()
 
         # Request a frame. Will be streamed *after* the exposure finishes
-        img = self.conn.get_image_stream(nTriggers=1, disable_tqdm=True)[0]
-        arr = np.array(img)
-        return arr
+        return self.conn.get_image_stream(nTriggers=1, disable_tqdm=True)[0]
+
+    def start_continuous(self, exposure: float = None, drop: bool = True) -> None:
+        """Keep a measurement running in continuous trigger mode, and
+        prefetch the frames in the background (see `ServalFrameStream`).
+        `get_image` then returns the next frame without triggering it. If
+        the stream fails, `get_image` raises the error once and continuous
+        acquisition is stopped.
+
+        exposure:
+            Exposure time in seconds.
+        drop:
+            If the frames are not consumed fast enough, return the most
+            recent frame (True), or keep all frames (False).
+        """
+        if exposure is None:
+            exposure = self.default_exposure
+
+        self.stop_continuous()
+
+        self.conn.measurement_stop()
+        self.conn.set_detector_config(
+            TriggerMode='CONTINUOUS',
+            ExposureTime=exposure,
+            TriggerPeriod=exposure + 0.00050001,
+            nTriggers=CONTINUOUS_TRIGGERS,
+        )
+        self.conn.measurement_start()
+
+        self._stream = ServalFrameStream(self.url, file_format=self.file_format, drop=drop)
+        self._stream_exposure = exposure
+        logger.info('Started continuous acquisition (exposure: %s s)', exposure)
+
+    def stop_continuous(self) -> None:
+        """Stop continuous acquisition, and restore the detector config."""
+        if self._stream is None:
+            return
+
+        self._stream.close()
+        logger.info(
+            'Stopped continuous acquisition (%s frames received, %s dropped)',
+            self._stream.n_received,
+            self._stream.n_dropped,
+        )
+        self._stream = None
+        self._stream_exposure = None
+
+        self.conn.measurement_stop()
+        self.conn.set_detector_config(**self.detector_config)
+        self._exposure = None
+        self._recording = False
 
     def get_movie(self, n_frames, exposure=None, binsize=None, **kwargs):
         """Movie acquisition routine. If the exposure and binsize are not
@@ -82,6 +177,8 @@ class CameraServal(CameraBase):
         if not binsize:
             binsize = self.default_binsize
 
+        self.stop_continuous()
+
         self.conn.set_detector_config(TriggerMode='CONTINUOUS')
 
         arr = self.conn.get_images(
@@ -90,6 +187,10 @@ class CameraServal(CameraBase):
             TriggerPeriod=exposure,
         )
 
+        # the detector config and measurement have changed
+        self._exposure = None
+        self._recording = False
+
         return arr
 
     def get_image_dimensions(self) -> (int, int):
@@ -104,6 +205,8 @@ class CameraServal(CameraBase):
 
     def establish_connection(self) -> None:
         """Establish connection to the camera."""
+        from serval_toolkit.camera import Camera as ServalCamera
+
         self.conn = ServalCamera()
         self.conn.connect(self.url)
         self.conn.set_chip_config_files(
@@ -115,16 +218,16 @@ class CameraServal(CameraBase):
         # use pgm since it is more efficient
         self.pixel_depth = self.conn.detector_config['PixelDepth']
         if self.pixel_depth == 24:
-            file_format = 'tiff'
+            self.file_format = 'tiff'
         else:
-            file_format = 'pgm'
+            self.file_format = 'pgm'
         self.conn.destination = {
             'Image': [
                 {
                     # Where to place the preview files (HTTP end-point: GET localhost:8080/measurement/image)
                     'Base': 'http://localhost',
                     # What (image) format to provide the files in.
-                    'Format': file_format,
+                    'Format': self.file_format,
                     # What data to build a frame from
                     'Mode': 'count',
                 }
@@ -133,6 +236,7 @@ class CameraServal(CameraBase):
 
     def release_connection(self) -> None:
         """Release the connection to the camera."""
+        self.stop_continuous()
         self.conn.measurement_stop()
         name = self.get_name()
         msg = f"Connection to camera '{name}' released"
@@ -83,7 +83,13 @@ class CameraSimu(CameraBase):
         -------
         stack : List[np.ndarray]
         """
-        return [self.get_image(exposure=exposure, binsize=binsize) for _ in range(n_frames)]
+        return list(self.iter_movie(n_frames, exposure=exposure, binsize=binsize))
+
+    def iter_movie(self, n_frames, *, exposure: float = None, binsize: int = None, **kwargs):
+        """Yield the frames of a movie as they are acquired, see
+        `get_movie`."""
+        for _ in range(n_frames):
+            yield self.get_image(exposure=exposure, binsize=binsize)
 
     def acquire_image(self) -> int:
         """For TVIPS compatibility."""
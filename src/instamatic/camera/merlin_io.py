@@ -5,6 +5,15 @@ from typing import List
 
 import numpy as np
 
+# Size of a Medipix3 chip in pixels
+CHIP_SIZE = 256
+
+# Width of the gap between the chips of a quad detector in pixels
+CROSS_GAP = 3
+
+# Number of bits used to store each pixel in RAW (R64) data, by counter depth
+RAW_BITS = {1: 1, 6: 8, 12: 16, 24: 32}
+
 
 class MIBProperties:
     """Class covering Merlin MIB file properties."""
@@ -28,8 +37,14 @@ class MIBProperties:
             self.single = False
             self.quad = True
 
+        self.n_chips = int(head[3])
         self.raw = head[6] == 'R64'
 
+        # the counter depth is in the extended header (MQ1A)
+        self.counter_depth = None
+        if 'MQ1A' in head:
+            self.counter_depth = int(head[head.index('MQ1A') + 3])
+
         if not self.raw:
             if head[6] == 'U08':
                 self.pixeltype = np.dtype('uint8')
@@ -40,9 +55,16 @@ class MIBProperties:
             elif head[6] == 'U32':
                 self.pixeltype = np.dtype('>u4')
                 self.dyn_range = '24-bit'
+            self.data_size = self.merlin_size[0] * self.merlin_size[1] * self.pixeltype.itemsize
         else:
-            self.dyn_range = '12-bit'
-            self.pixeltype = np.uint16
+            if self.counter_depth not in RAW_BITS:
+                raise ValueError(
+                    f'Cannot decode RAW data with counter depth: {self.counter_depth}'
+                )
+            self.dyn_range = f'{self.counter_depth}-bit'
+            self.pixeltype = np.dtype(f'uint{max(8, RAW_BITS[self.counter_depth])}')
+            n_pixels = self.n_chips * CHIP_SIZE * CHIP_SIZE
+            self.data_size = n_pixels * RAW_BITS[self.counter_depth] // 8
 
         self.packed = False
         self.offset = 0
@@ -91,38 +113,153 @@ class MIBProperties:
     @classmethod
     def from_buffer(cls, buffer: bytes):
         """Return MIB properties from buffer."""
-        head = buffer[:384].decode().split(',')
+        headsize = int(bytes(buffer[:384]).decode().split(',')[2])
+        head = bytes(buffer[:headsize]).decode(errors='replace').split(',')
         return cls(head)
 
 
-def load_mib(buffer: bytes, skip: int = 0):
-    """Load Quantum Detectors MIB file from a memory buffer.
+def decode_raw(data: np.ndarray, counter_depth: int) -> np.ndarray:
+    """Decode RAW (R64) frames.
+
+    In RAW mode, the counters are sent as 64-bit big-endian words, with
+    the first pixel in the least significant bits of each word, and
+    stored with `RAW_BITS[counter_depth]` bits per pixel. In 24-bit mode,
+    each frame holds two 12-bit images, the high counter first.
+
+    Converting the words to little-endian puts the pixels in order and
+    makes them little-endian as well, so the frames are decoded with a
+    single (vectorized) copy of the data.
+
+    data : np.ndarray
+        Array of shape (n, nbytes) with the data of n frames as uint8
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n, npixels)
+    """
+    n = len(data)
+    data = data.view('>u8').astype('<u8').view(np.uint8).reshape(n, -1)
+
+    if counter_depth == 1:
+        return np.unpackbits(data, axis=-1, bitorder='little')
+    elif counter_depth == 6:
+        return data
+    elif counter_depth == 12:
+        return data.view('<u2')
+    elif counter_depth == 24:
+        high, low = np.split(data.view('<u2'), 2, axis=-1)
+        return (high.astype(np.uint32) << 12) | low
+    else:
+        raise ValueError(f'Cannot decode RAW data with counter depth: {counter_depth}')
+
+
+def assemble_chips(data: np.ndarray, n_chips: int, geometry: str = '1x1') -> np.ndarray:
+    """Arrange the chips of RAW frames.
+
+    RAW data holds the chips side by side, i.e. each frame is an image of
+    CHIP_SIZE rows and `n_chips * CHIP_SIZE` columns. For a quad (2x2)
+    detector, the first two chips form the bottom half of the image, and
+    the last two, which are mounted upside down, the top half.
+
+    data : np.ndarray
+        Array of shape (n, npixels)
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n, ny, nx)
+    """
+    n = len(data)
+    strip = data.reshape(n, CHIP_SIZE, n_chips * CHIP_SIZE)
+
+    if geometry != '2x2':
+        return strip
+
+    out = np.empty((n, 2 * CHIP_SIZE, 2 * CHIP_SIZE), dtype=data.dtype)
+    out[:, CHIP_SIZE:] = strip[..., : 2 * CHIP_SIZE]
+    out[:, :CHIP_SIZE] = strip[..., ::-1, : 2 * CHIP_SIZE - 1 : -1]
+    return out
+
+
+def insert_cross(data: np.ndarray, gap: int = CROSS_GAP) -> np.ndarray:
+    """Insert a cross of `gap` empty pixels between the chips of quad (2x2)
+    frames, to account for the physical gap between the chips.
+
+    data : np.ndarray
+        Array of shape (..., ny, nx)
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (..., ny + gap, nx + gap)
+    """
+    *shape, ny, nx = data.shape
+    cy, cx = ny // 2, nx // 2
+
+    out = np.zeros((*shape, ny + gap, nx + gap), dtype=data.dtype)
+    out[..., :cy, :cx] = data[..., :cy, :cx]
+    out[..., :cy, cx + gap :] = data[..., :cy, cx:]
+    out[..., cy + gap :, :cx] = data[..., cy:, :cx]
+    out[..., cy + gap :, cx + gap :] = data[..., cy:, cx:]
+    return out
+
+
+def load_mib(buffer, skip: int = 0, stride: int = None, add_cross: bool = False) -> np.ndarray:
+    """Load Quantum Detectors MIB frames from a memory buffer.
+
+    The frames are returned as an array of shape (n, ny, nx). Processed
+    frames are a view into `buffer`, no data are copied (the pixels stay
+    big-endian). RAW frames are decoded (see `decode_raw`), and the chips
+    of quad detectors are arranged (see `assemble_chips`).
 
     skip : int, optional
         Skip first n bytes.
+    stride : int, optional
+        Number of bytes from the start of one frame to the start of the
+        next, if the frames are separated by other data (e.g. the MPX
+        headers in the data stream of the camera). By default, the
+        frames follow each other directly.
+    add_cross : bool, optional
+        Insert the gap between the chips of a quad detector
     """
-    buffer = buffer[skip:]
+    buffer = memoryview(buffer).cast('B')
 
-    assert isinstance(buffer, (bytes, bytearray))
+    props = MIBProperties.from_buffer(buffer[skip:])
+    props.addCross = add_cross and props.detectorgeometry == '2x2'
 
-    props = MIBProperties.from_buffer(buffer)
+    frame_size = props.headsize + props.data_size
+    if stride is None:
+        stride = frame_size
+        assert (len(buffer) - skip) % frame_size == 0, (
+            'buffer size must be a multiple of item size'
+        )
 
-    merlin_frame_dtype = np.dtype(
-        [
-            ('header', np.bytes_, props.headsize),
-            ('data', props.pixeltype, props.merlin_size),
-        ]
-    )
+    count = (len(buffer) - skip - frame_size) // stride + 1
+    props.xy = count
 
-    assert (
-        len(buffer) % merlin_frame_dtype.itemsize == 0
-    ), 'buffer size must be a multiple of item size'
+    if props.raw:
+        data = np.ndarray(
+            shape=(count, props.data_size),
+            dtype=np.uint8,
+            buffer=buffer,
+            offset=skip + props.headsize,
+            strides=(stride, 1),
+        )
+        data = decode_raw(data, props.counter_depth)
+        data = assemble_chips(data, props.n_chips, props.detectorgeometry)
+    else:
+        dtype = props.pixeltype
+        ny, nx = props.merlin_size
+        data = np.ndarray(
+            shape=(count, ny, nx),
+            dtype=dtype,
+            buffer=buffer,
+            offset=skip + props.headsize,
+            strides=(stride, nx * dtype.itemsize, dtype.itemsize),
+        )
 
-    data = np.frombuffer(
-        buffer,
-        dtype=merlin_frame_dtype,
-        count=-1,
-        offset=0,
-    )
+    if props.addCross:
+        data = insert_cross(data)
 
-    return data['data']
+    return data
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import http.client
+import io
+import logging
+import socket
+import threading
+from urllib.parse import urlsplit
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMAGE_PATH = '/measurement/image'
+
+
+def read_pgm(buffer) -> np.ndarray:
+    """Decode a binary (P5) PGM image from a memory buffer.
+
+    The image is returned as a view into `buffer`, no data are copied.
+    Pixels are 8-bit, or 16-bit big-endian if the maximum value is larger
+    than 255.
+    """
+    view = memoryview(buffer).cast('B')
+
+    # magic, width, height and maxval, separated by whitespace or comments
+    fields = []
+    pos = 0
+    while len(fields) < 4:
+        while view[pos] in b' \t\r\n':
+            pos += 1
+        if view[pos] == ord('#'):
+            while view[pos] not in b'\r\n':
+                pos += 1
+            continue
+        start = pos
+        while view[pos] not in b' \t\r\n':
+            pos += 1
+        fields.append(bytes(view[start:pos]))
+
+    magic, width, height, maxval = fields
+    if magic != b'P5':
+        raise ValueError(f'Not a binary PGM image: {magic}')
+
+    dtype = np.dtype('u1') if int(maxval) < 256 else np.dtype('>u2')
+    shape = (int(height), int(width))
+
+    # a single whitespace character separates the header from the data
+    image = np.frombuffer(view, dtype=dtype, count=shape[0] * shape[1], offset=pos + 1)
+    return image.reshape(shape)
+
+
+def read_image(buffer, file_format: str = 'pgm') -> np.ndarray:
+    """Decode an image in `file_format` (pgm or tiff), as sent by Serval."""
+    if file_format == 'pgm':
+        return read_pgm(buffer)
+
+    import tifffile
+
+    return tifffile.imread(io.BytesIO(buffer))
+
+
+class ServalFrameStream:
+    """Prefetches the frames of a running Serval measurement.
+
+    A background thread requests the next frame from the HTTP end-point
+    of Serval (`/measurement/image`) over a persistent connection, while
+    the previous one is being consumed. The last frame received waits in
+    a single slot until it is taken with `get` (double buffering).
+
+    If the consumer is slower than the camera, the frame in the slot is
+    replaced by the next one (`drop=True`, counted in `n_dropped`), so
+    that `get` returns the most recent frame, or the thread waits until
+    the slot is free (`drop=False`).
+
+    The frames are converted to the native byte order in the background
+    thread (16-bit PGM images are big-endian).
+    """
+
+    def __init__(
+        self, url: str, file_format: str = 'pgm', drop: bool = True, timeout: float = 10
+    ):
+        parts = urlsplit(url)
+        self.file_format = file_format
+        self.drop = drop
+
+        self.n_received = 0
+        self.n_dropped = 0
+        self.error = None
+
+        self._conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+        self._path = parts.path.rstrip('/') + IMAGE_PATH
+        self._slot = None
+        self._done = False
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name='ServalFrameStream', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def _fetch(self) -> bytearray:
+        """Request the next frame, the response is read into a new buffer
+        which the decoded frame is a (writable) view of."""
+        self._conn.request('GET', self._path)
+        response = self._conn.getresponse()
+
+        length = response.getheader('Content-Length')
+        if response.status != 200 or length is None:
+            data = bytearray(response.read())
+        else:
+            data = bytearray(int(length))
+            view = memoryview(data)
+            received = 0
+            while received < len(data):
+                n = response.readinto(view[received:])
+                if not n:
+                    raise ConnectionError('Connection to Serval closed while receiving a frame')
+                received += n
+
+        if response.status != 200:
+            raise ConnectionError(f'Serval returned {response.status}: {bytes(data[:200])!r}')
+        return data
+
+    def _run(self) -> None:
+        try:
+            while not self._stop.is_set():
+                frame = read_image(self._fetch(), self.file_format)
+                frame = frame.astype(frame.dtype.newbyteorder('='), copy=False)
+
+                with self._cond:
+                    if not self.drop:
+                        self._cond.wait_for(lambda: self._slot is None or self._stop.is_set())
+                        if self._stop.is_set():
+                            break
+                    if self._slot is not None:
+                        self.n_dropped += 1
+                    self._slot = frame
+                    self.n_received += 1
+                    self._cond.notify_all()
+        except Exception as e:
+            if not self._stop.is_set():
+                logger.exception('Error while receiving Serval frames')
+                self.error = e
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def get(self, timeout: float = None) -> np.ndarray:
+        """Return the next frame, waiting until it has been received."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._slot is not None or self._done, timeout):
+                raise TimeoutError('No frame received from Serval')
+            if self._slot is None:
+                raise self.error or RuntimeError('The frame stream is closed')
+            frame, self._slot = self._slot, None
+            self._cond.notify_all()
+        return frame
+
+    def close(self) -> None:
+        """Stop receiving frames."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        # interrupt a pending request
+        sock = self._conn.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._thread.join()
+        self._conn.close()
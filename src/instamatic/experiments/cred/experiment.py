@@ -11,12 +11,20 @@ import numpy as np
 import instamatic
 from instamatic import config
 from instamatic.experiments.experiment_base import ExperimentBase
-from instamatic.formats import write_tiff
+from instamatic.formats import read_tiff, write_tiff
+from instamatic.processing.flatfield import apply_flatfield_correction
+from instamatic.processing.framestore import get_frame_buffer, release_frame_buffer
 from instamatic.processing.ImgConversionTPX import ImgConversionTPX as ImgConversion
+from instamatic.processing.ImgConversionTPX import ImgConversionTPXStream as ImgConversionStream
+from instamatic.processing.pipeline import FramePipeline
+from instamatic.tools import find_beam_centers
 
 # degrees to rotate before activating data collection procedure
 ACTIVATION_THRESHOLD = 0.2
 
+# maximum number of frames waiting to be processed in pipelined mode
+PIPELINE_BUFFER = 64
+
 use_vm = config.settings.use_VM_server_exe
 
 
@@ -52,8 +60,14 @@ class Experiment(ExperimentBase):
         Image interval only - Exposure time for defocused images
     write_tiff, write_xds, write_dials, write_red:
         Specify which data types/input files should be written
+    write_nexus:
+        Also write all frames to a single NeXus/NXmx file (`data.nxs`)
     stop_event:
         Instance of `threading.Event()` that signals the experiment to be terminated.
+    use_pipeline:
+        Process and write the frames while the data are being collected
+        (see `ImgConversionStream`), defaults to `cred_use_pipeline` in
+        the settings.
     """
 
     def __init__(
@@ -74,7 +88,9 @@ class Experiment(ExperimentBase):
         write_xds: bool = True,
         write_dials: bool = True,
         write_red: bool = True,
+        write_nexus: bool = False,
         stop_event=None,
+        use_pipeline: bool = None,
     ):
         super().__init__()
         self.ctrl = ctrl
@@ -98,6 +114,7 @@ class Experiment(ExperimentBase):
         self.write_dials = write_dials
         self.write_red = write_red
         self.write_pets = write_tiff  # TODO
+        self.write_nexus = write_nexus
 
         self.image_interval_enabled = enable_image_interval
         if enable_image_interval:
@@ -116,6 +133,10 @@ class Experiment(ExperimentBase):
         self.track_stage_position = config.settings.cred_track_stage_positions
         self.stage_positions = []
 
+        if use_pipeline is None:
+            use_pipeline = config.settings.cred_use_pipeline
+        self.use_pipeline = use_pipeline
+
         if use_vm:
             self.s2 = socket.socket()
             vm_host = config.settings.VM_server_host
@@ -211,6 +232,7 @@ class Experiment(ExperimentBase):
         self.tiff_path = self.path / 'tiff' if self.write_tiff else None
         self.smv_path = self.path / 'SMV' if (self.write_xds or self.write_dials) else None
         self.mrc_path = self.path / 'RED' if self.write_red else None
+        self.nexus_path = self.path / 'data.nxs' if self.write_nexus else None
 
     def start_rotation(self) -> float:
         """Controls the starting of the rotation of the experiment.
@@ -275,7 +297,7 @@ class Experiment(ExperimentBase):
         self.setup_paths()
         self.log_start_status()
 
-        buffer = []
+        buffer = get_frame_buffer(self.path)
         image_buffer = []
 
         if self.ctrl.mode != 'diff':
@@ -289,6 +311,7 @@ class Experiment(ExperimentBase):
             self.relax_beam()
 
         self.start_angle = self.start_rotation()
+        pipeline = self.start_pipeline() if self.use_pipeline else None
         self.ctrl.cam.block()
 
         i = 1
@@ -324,7 +347,10 @@ class Experiment(ExperimentBase):
             else:
                 img, h = self.ctrl.get_image(self.exposure, header_keys=None)
                 # print(f"{i} Image!")
-                buffer.append((i, img, h))
+                if pipeline:
+                    pipeline.put((i, img, h))
+                else:
+                    buffer.append((i, img, h))
 
             i += 1
 
@@ -356,9 +382,16 @@ class Experiment(ExperimentBase):
             print('Blanking beam')
             self.ctrl.beam.blank()
 
+        if pipeline:
+            print('Waiting for the frames to be processed...')
+            pipeline.close()
+
         # in case something went wrong starting data collection, return gracefully
         if i == 1:
             print_and_log('Data collection interrupted', logger=self.logger)
+            release_frame_buffer(buffer)
+            if pipeline:
+                self.img_conv.close(finalize=False)
             return False
 
         self.spotsize = self.ctrl.spotsize
@@ -379,7 +412,7 @@ class Experiment(ExperimentBase):
         self.stretch_azimuth = config.camera.stretch_azimuth  # deg
         self.stretch_amplitude = config.camera.stretch_amplitude  # %
 
-        self.nframes_diff = len(buffer)
+        self.nframes_diff = pipeline.n_put if pipeline else len(buffer)
         self.nframes_image = len(image_buffer)
 
         self.log_end_status()
@@ -389,10 +422,23 @@ class Experiment(ExperimentBase):
                 f'Not enough frames collected. Data will not be written (nframes={self.nframes})',
                 logger=self.logger,
             )
+            release_frame_buffer(buffer)
+            if pipeline:
+                self.img_conv.close(finalize=False)
             return False
 
-        self.write_data(buffer)
+        if pipeline:
+            print('Writing input files...')
+            self.img_conv.close(
+                end_angle=self.end_angle,
+                osc_angle=self.osc_angle,
+                acquisition_time=self.acquisition_time,
+                pixelsize=self.pixelsize,
+            )
+        else:
+            self.write_data(buffer)
         self.write_image_data(image_buffer)
+        release_frame_buffer(buffer)
 
         print('Data Collection and Conversion Done.')
 
@@ -411,6 +457,47 @@ class Experiment(ExperimentBase):
 
         return True
 
+    def start_pipeline(self) -> FramePipeline:
+        """Start the pipeline that applies the flatfield correction, finds the
+        beam center, and writes each frame while the data are being
+        collected.
+
+        The frames are written by `self.img_conv`, which is finalized
+        once the data collection has finished.
+        """
+        flatfield = None
+        if self.flatfield is not None:
+            flatfield, _ = read_tiff(self.flatfield)
+
+        self.img_conv = ImgConversionStream(
+            start_angle=self.start_angle,
+            rotation_axis=config.camera.camera_rotation_vs_stage_xy,
+            flatfield=None,
+            physical_pixelsize=config.camera.physical_pixelsize,
+            wavelength=config.microscope.wavelength,
+            path=self.path,
+            tiff_path=self.tiff_path,
+            smv_path=self.smv_path,
+            mrc_path=self.mrc_path,
+            nexus_path=self.nexus_path,
+            write_xds=self.write_xds,
+            write_dials=self.write_dials,
+            write_pets=self.write_pets,
+            write_red=self.write_red,
+        )
+
+        def correct(item):
+            i, img, h = item
+            if flatfield is not None:
+                img = apply_flatfield_correction(img, flatfield)
+            h['beam_center'] = find_beam_centers(img[np.newaxis], sigma=10)[0]
+            return i, img, h
+
+        def convert(item):
+            self.img_conv.add_frame(*item)
+
+        return FramePipeline((correct, 2), convert, maxsize=PIPELINE_BUFFER, name='cRED')
+
     def write_data(self, buffer: list):
         """Write diffraction data in the buffer.
 
@@ -438,8 +525,10 @@ class Experiment(ExperimentBase):
 
         print('Writing data files...')
         img_conv.threadpoolwriter(
-            tiff_path=self.tiff_path, mrc_path=self.mrc_path, smv_path=self.smv_path, workers=8
+            tiff_path=self.tiff_path, mrc_path=self.mrc_path, smv_path=self.smv_path
         )
+        if self.nexus_path is not None:
+            img_conv.nexus_writer(self.nexus_path)
 
         print('Writing input files...')
         if self.write_dials:
@@ -11,6 +11,7 @@ from tqdm.auto import tqdm
 from instamatic import config
 from instamatic.experiments.experiment_base import ExperimentBase
 from instamatic.formats import write_tiff
+from instamatic.processing.framestore import get_frame_buffer, release_frame_buffer
 from instamatic.processing.ImgConversionTPX import ImgConversionTPX as ImgConversion
 
 
@@ -47,7 +48,7 @@ class Experiment(ExperimentBase):
 
         self.offset = 1
         self.current_angle = None
-        self.buffer = []
+        self.buffer = get_frame_buffer(self.path)
 
     def start_collection(self, exposure_time: float, tilt_range: float, stepsize: float):
         """Start or continue data collection for `tilt_range` degrees with
@@ -184,7 +185,7 @@ class Experiment(ExperimentBase):
         )
 
         print('Writing data files...')
-        img_conv.threadpoolwriter(tiff_path=self.tiff_path, mrc_path=self.mrc_path, workers=8)
+        img_conv.threadpoolwriter(tiff_path=self.tiff_path, mrc_path=self.mrc_path)
 
         print('Writing input files...')
         img_conv.write_ed3d(self.mrc_path)
@@ -192,6 +193,8 @@ class Experiment(ExperimentBase):
 
         img_conv.write_beam_centers(self.path)
 
+        release_frame_buffer(self.buffer)
+
         print('Data Collection and Conversion Done.')
         print()
 
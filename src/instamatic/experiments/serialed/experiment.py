@@ -148,9 +148,22 @@ class Experiment(ExperimentBase):
 
     Related publication:     J. Appl. Cryst. (2018). 51, 1262-1273
     https://doi.org/10.1107/S1600576718009500.
+
+    If `single_file` is True, the images and diffraction patterns are
+    appended to `images.nxs` and `data.nxs` in the experiment directory,
+    instead of being written to one HDF5 file each.
     """
 
-    def __init__(self, ctrl, params, scan_radius=None, begin_here=False, expdir=None, log=None):
+    def __init__(
+        self,
+        ctrl,
+        params,
+        scan_radius=None,
+        begin_here=False,
+        expdir=None,
+        log=None,
+        single_file=False,
+    ):
         super().__init__()
         self.ctrl = ctrl
         self.camera = ctrl.cam.name
@@ -158,8 +171,10 @@ class Experiment(ExperimentBase):
 
         self.scan_radius = scan_radius
         self.begin_here = begin_here
+        self.single_file = single_file
 
         self.setup_folders(expdir=expdir)
+        self.writers = {}
 
         self.load_calibration(**params)
 
@@ -219,7 +234,7 @@ class Experiment(ExperimentBase):
             self.ctrl.mode.set('mag1')
             self.ctrl.store('image')
             self.ctrl.brightness.set(image_brightness)
-            self.ctrl.tem.setSpotSize(self.image_spotsize)
+            self.ctrl.spotsize = self.image_spotsize
 
             self.calib_beamshift = CalibBeamShift.live(self.ctrl, outdir=self.calibdir)
 
@@ -245,7 +260,7 @@ class Experiment(ExperimentBase):
         except OSError:
             self.ctrl.mode.set('diff')
             self.ctrl.store('diffraction')
-            self.ctrl.tem.setSpotSize(self.diff_spotsize)
+            self.ctrl.spotsize = self.diff_spotsize
 
             self.calib_directbeam = CalibDirectBeam.live(self.ctrl, outdir=self.calibdir)
 
@@ -313,7 +328,7 @@ class Experiment(ExperimentBase):
         self.ctrl.mode.set('diff')
         self.ctrl.brightness.set(self.diff_brightness)
         self.ctrl.difffocus.set(self.diff_difffocus)
-        self.ctrl.tem.setSpotSize(self.diff_spotsize)
+        self.ctrl.spotsize = self.diff_spotsize
         input('\nPress <ENTER> to get neutral diffraction shift')
         self.neutral_diffshift = np.array(self.ctrl.diffshift.get())
         self.log.info('DiffShift(x=%d, y=%d)', *self.neutral_diffshift)
@@ -323,7 +338,7 @@ class Experiment(ExperimentBase):
         self.ctrl.brightness.max()
         self.calib_beamshift.center(self.ctrl)
         self.neutral_beamshift = self.ctrl.beamshift.get()
-        self.ctrl.tem.setSpotSize(self.image_spotsize)
+        self.ctrl.spotsize = self.image_spotsize
 
     def image_mode(self, delay=0.2):
         """Switch to image mode (mag1), reset beamshift/diffshift, spread
@@ -469,6 +484,17 @@ class Experiment(ExperimentBase):
 
             yield dct
 
+    def write_frame(self, outfile, img, h, kind: str = 'data'):
+        """Write the image to `outfile` in HDF5 format, or append it to the
+        single file for `kind` (`image` or `data`) with the name of
+        `outfile` in the header."""
+        writer = self.writers.get(kind)
+        if writer is None:
+            write_hdf5(outfile, img, header=h)
+        else:
+            h['name'] = outfile.name
+            writer.add(img, h)
+
     def apply_corrections(self, img, h):
         if self.flatfield is not None:
             img = remove_deadpixels(img, deadpixels=self.deadpixels)
@@ -506,95 +532,106 @@ class Experiment(ExperimentBase):
 
         input("\nPress <ENTER> to start experiment ('Ctrl-C' to interrupt)\n")
 
-        for i, d_pos in enumerate(self.loop_positions()):
-            outfile = self.imagedir / f'image_{i:04d}'
+        if self.single_file:
+            self.writers = {
+                'image': NXmxWriter(self.expdir / 'images.nxs'),
+                'data': NXmxWriter(self.expdir / 'data.nxs'),
+            }
 
-            if self.change_spotsize:
-                self.ctrl.tem.setSpotSize(self.image_spotsize)
+        try:
+            for i, d_pos in enumerate(self.loop_positions()):
+                outfile = self.imagedir / f'image_{i:04d}'
 
-            img, h = self.ctrl.get_image(
-                exposure=self.image_exposure,
-                binsize=self.image_binsize,
-                header_keys=header_keys,
-            )
+                if self.change_spotsize:
+                    self.ctrl.spotsize = self.image_spotsize
 
-            if self.change_spotsize:
-                self.ctrl.tem.setSpotSize(self.image_spotsize)
+                img, h = self.ctrl.get_image(
+                    exposure=self.image_exposure,
+                    binsize=self.image_binsize,
+                    header_keys=header_keys,
+                )
 
-            self.ctrl.tem.setSpotSize(self.diff_spotsize)
+                if self.change_spotsize:
+                    self.ctrl.spotsize = self.image_spotsize
 
-            im_mean = img.mean()
-            if im_mean < self.image_threshold:
-                # self.log.debug("Dark image detected (mean=%f)", im_mean)
-                continue
+                self.ctrl.spotsize = self.diff_spotsize
 
-            img, h = self.apply_corrections(img, h)
+                im_mean = img.mean()
+                if im_mean < self.image_threshold:
+                    # self.log.debug("Dark image detected (mean=%f)", im_mean)
+                    continue
 
-            crystal_positions = (
-                self.find_crystals(img, self.magnification, spread=self.crystal_spread)
-                * self.image_binsize
-            )
-            crystal_coords = [(crystal.x, crystal.y) for crystal in crystal_positions]
+                img, h = self.apply_corrections(img, h)
 
-            for d in (d_image, d_pos):
-                h.update(d)
-            h['exp_crystal_coords'] = crystal_coords
+                crystal_positions = (
+                    self.find_crystals(img, self.magnification, spread=self.crystal_spread)
+                    * self.image_binsize
+                )
+                crystal_coords = [(crystal.x, crystal.y) for crystal in crystal_positions]
 
-            write_hdf5(outfile, img, header=h)
+                for d in (d_image, d_pos):
+                    h.update(d)
+                h['exp_crystal_coords'] = crystal_coords
 
-            ncrystals = len(crystal_coords)
-            if ncrystals == 0:
-                continue
+                self.write_frame(outfile, img, h, kind='image')
 
-            self.log.info('%d crystals found in %s', ncrystals, outfile)
+                ncrystals = len(crystal_coords)
+                if ncrystals == 0:
+                    continue
 
-            for k, d_cryst in enumerate(self.loop_crystals(crystal_coords)):
-                outfile = self.datadir / f'image_{i:04d}_{k:04d}'
-                comment = f'Image {i} Crystal {k}'
-                img, h = self.ctrl.get_image(
-                    binsize=self.diff_binsize,
-                    exposure=self.diff_exposure,
-                    comment=comment,
-                    header_keys=header_keys,
-                )
-                img, h = self.apply_corrections(img, h)
+                self.log.info('%d crystals found in %s', ncrystals, outfile)
 
-                for d in (d_diff, d_pos, d_cryst):
-                    h.update(d)
+                for k, d_cryst in enumerate(self.loop_crystals(crystal_coords)):
+                    outfile = self.datadir / f'image_{i:04d}_{k:04d}'
+                    comment = f'Image {i} Crystal {k}'
+                    img, h = self.ctrl.get_image(
+                        binsize=self.diff_binsize,
+                        exposure=self.diff_exposure,
+                        comment=comment,
+                        header_keys=header_keys,
+                    )
+                    img, h = self.apply_corrections(img, h)
 
-                h['crystal_is_isolated'] = crystal_positions[k].isolated
-                h['crystal_clusters'] = crystal_positions[k].n_clusters
-                h['total_area_micrometer'] = crystal_positions[k].area_micrometer
-                h['total_area_pixel'] = crystal_positions[k].area_pixel
+                    for d in (d_diff, d_pos, d_cryst):
+                        h.update(d)
 
-                # img_processed = neural_network.preprocess(img.astype(float))
-                # quality = neural_network.predict(img_processed)
-                # h["crystal_quality"] = quality
+                    h['crystal_is_isolated'] = crystal_positions[k].isolated
+                    h['crystal_clusters'] = crystal_positions[k].n_clusters
+                    h['total_area_micrometer'] = crystal_positions[k].area_micrometer
+                    h['total_area_pixel'] = crystal_positions[k].area_pixel
 
-                write_hdf5(outfile, img, header=h)
+                    # img_processed = neural_network.preprocess(img.astype(float))
+                    # quality = neural_network.predict(img_processed)
+                    # h["crystal_quality"] = quality
 
-                if self.sample_rotation_angles:
-                    for rotation_angle in self.sample_rotation_angles:
-                        self.log.debug('Rotation angle = %f', rotation_angle)
-                        self.ctrl.stage.a = rotation_angle
+                    self.write_frame(outfile, img, h)
 
-                        outfile = self.datadir / f'image_{i:04d}_{k:04d}_{rotation_angle}'
-                        img, h = self.ctrl.get_image(
-                            exposure=self.diff_exposure,
-                            binsize=self.diff_binsize,
-                            comment=comment,
-                            header_keys=header_keys,
-                        )
-                        img, h = self.apply_corrections(img, h)
+                    if self.sample_rotation_angles:
+                        for rotation_angle in self.sample_rotation_angles:
+                            self.log.debug('Rotation angle = %f', rotation_angle)
+                            self.ctrl.stage.a = rotation_angle
 
-                        for d in (d_diff, d_pos, d_cryst):
-                            h.update(d)
+                            outfile = self.datadir / f'image_{i:04d}_{k:04d}_{rotation_angle}'
+                            img, h = self.ctrl.get_image(
+                                exposure=self.diff_exposure,
+                                binsize=self.diff_binsize,
+                                comment=comment,
+                                header_keys=header_keys,
+                            )
+                            img, h = self.apply_corrections(img, h)
 
-                        write_hdf5(outfile, img, header=h)
+                            for d in (d_diff, d_pos, d_cryst):
+                                h.update(d)
 
-                    self.ctrl.stage.a = 0
+                            self.write_frame(outfile, img, h)
 
-            self.image_mode()
+                        self.ctrl.stage.a = 0
+
+                self.image_mode()
+        finally:
+            for writer in self.writers.values():
+                writer.close()
+            self.writers = {}
 
         print('\n\nData collection finished.')
 
@@ -611,6 +648,13 @@ def main():
         description=description, formatter_class=argparse.RawDescriptionHelpFormatter
     )
 
+    parser.add_argument(
+        '--single-file',
+        action='store_true',
+        dest='single_file',
+        help='Write the images and diffraction patterns to one NeXus file each.',
+    )
+
     options = parser.parse_args()
 
     from instamatic import TEMController
@@ -630,7 +674,7 @@ def main():
 
     ctrl = TEMController.initialize()
 
-    exp = Experiment(ctrl, params, log=log)
+    exp = Experiment(ctrl, params, log=log, single_file=options.single_file)
     exp.report_status()
     exp.run()
 
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import collections
+import itertools
 import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import h5py
@@ -9,10 +12,14 @@ import numpy as np
 import tifffile
 import yaml
 
-from .adscimage import read_adsc, write_adsc
+from .adscimage import read_adsc, update_adsc_header, write_adsc
 from .csvIO import read_csv, read_ycsv, write_csv, write_ycsv
+from .header_loader import HeaderLoader
 from .mrc import read_image as read_mrc
 from .mrc import write_image as write_mrc
+from .nexus import NXmxWriter, read_nexus
+from .xdscbf import read as read_cbf
+from .xdscbf import update_header as update_cbf_header
 from .xdscbf import write as write_cbf
 
 
@@ -29,6 +36,8 @@ def read_image(fname: str) -> (np.array, dict):
         img, h = read_mrc(fname)
     elif ext in ('.cbf'):
         img, h = read_cbf(fname)
+    elif ext == '.nxs':
+        img, h = read_nexus(fname)
     else:
         raise OSError(f'Cannot open file {fname}, unknown extension: {ext}')
     return img, h
@@ -72,7 +81,7 @@ def read_tiff(fname: str) -> (np.array, dict):
     img = page.asarray()
 
     if page.software == 'instamatic':
-        header = yaml.load(page.tags['ImageDescription'].value, Loader=yaml.Loader)
+        header = yaml.load(page.tags['ImageDescription'].value, Loader=HeaderLoader)
     elif tiff.is_tvips:
         header = tiff.tvips_metadata
     else:
@@ -81,6 +90,40 @@ def read_tiff(fname: str) -> (np.array, dict):
     return img, header
 
 
+def frame_number(fname: str) -> int:
+    """Return the frame number at the end of the file name, e.g. 12 for
+    `image_0012.tiff` or `00012.tiff`."""
+    return int(Path(fname).stem.split('_')[-1])
+
+
+def iter_tiff_dataset(fns, workers: int = 4, reader=read_tiff):
+    """Read the TIFF files `fns` in a thread pool, and yield `(i, img, h)`
+    tuples in order of the frame number `i` in the file name (see
+    `frame_number`).
+
+    The tuples are yielded as soon as they are read, and at most
+    `2*workers` files are read ahead, so the result can be passed as
+    the buffer of `ImgConversion`, which starts before all files have
+    been read. `reader` is the function used to read a file.
+    """
+    fns = sorted(fns, key=frame_number)
+    queue = iter(fns)
+    pending = collections.deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for fn in itertools.islice(queue, 2 * workers):
+            pending.append((frame_number(fn), executor.submit(reader, fn)))
+
+        while pending:
+            i, future = pending.popleft()
+            img, h = future.result()
+
+            for fn in itertools.islice(queue, 1):
+                pending.append((frame_number(fn), executor.submit(reader, fn)))
+
+            yield i, img, h
+
+
 def write_hdf5(fname: str, data, header: dict = None):
     """Simple function to write data to hdf5 format using h5py.
 
@@ -116,8 +159,3 @@ def read_hdf5(fname: str) -> (np.array, dict):
 
     f = h5py.File(fname, 'r')
     return np.array(f['data']), dict(f['data'].attrs)
-
-
-def read_cbf(fname: str):
-    """CBF reader not implemented."""
-    raise NotImplementedError('CBF reader not implemented.')
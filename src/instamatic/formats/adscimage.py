@@ -21,13 +21,8 @@ def swap_needed(header: dict) -> bool:
         return True
 
 
-def write_adsc(fname: str, data: np.array, header: dict = {}):
-    """Write adsc format."""
-    if 'SIZE1' not in header and 'SIZE2' not in header:
-        dim2, dim1 = data.shape
-        header['SIZE1'] = dim1
-        header['SIZE2'] = dim2
-
+def encode_header(header: dict) -> bytes:
+    """Return the adsc header as bytes, padded to `HEADER_BYTES`."""
     out = b'{\n'
     for key in header:
         out += f'{key}={header[key]};\n'.encode()
@@ -40,6 +35,17 @@ def write_adsc(fname: str, data: np.array, header: dict = {}):
         pad = hsize - len(out) - 2
     out += b'}' + (pad + 1) * b'\x00'
     assert len(out) % 512 == 0, 'Header is not multiple of 512'
+    return out
+
+
+def write_adsc(fname: str, data: np.array, header: dict = {}):
+    """Write adsc format."""
+    if 'SIZE1' not in header and 'SIZE2' not in header:
+        dim2, dim1 = data.shape
+        header['SIZE1'] = dim1
+        header['SIZE2'] = dim2
+
+    out = encode_header(header)
 
     # NOTE: XDS can handle only "SMV" images of TYPE=unsigned_short.
     dtype = np.uint16
@@ -54,6 +60,25 @@ def write_adsc(fname: str, data: np.array, header: dict = {}):
         outf.write(data.tobytes())
 
 
+def update_adsc_header(fname: str, header: dict):
+    """Replace the header of an existing adsc file in place, the image data
+    are not read or rewritten.
+
+    The new header must have the same size (`HEADER_BYTES`) as the
+    existing one.
+    """
+    out = encode_header(header)
+
+    with open(fname, 'r+b') as f:
+        old = readheader(f)
+        if int(old['HEADER_BYTES']) != len(out):
+            raise ValueError(
+                f'Header size {len(out)} does not match the header of {fname}: {old["HEADER_BYTES"]}'
+            )
+        f.seek(0)
+        f.write(out)
+
+
 def readheader(infile):
     """Read an adsc header."""
     header = {}
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import numpy as np
+import yaml
+
+# the C implementation is several times faster if libyaml is available
+_SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+PYTHON_TAG = 'tag:yaml.org,2002:python/'
+
+# numpy functions used by `yaml.dump` to represent numpy scalars and arrays
+NUMPY_SCALAR = ('numpy.core.multiarray.scalar', 'numpy._core.multiarray.scalar')
+NUMPY_ARRAY = ('numpy.core.multiarray._reconstruct', 'numpy._core.multiarray._reconstruct')
+NUMPY_DTYPE = ('numpy.dtype',)
+
+
+class HeaderLoader(_SafeLoader):
+    """Safe YAML loader for the image headers written by `yaml.dump`.
+
+    Like `yaml.SafeLoader`, it does not call arbitrary Python functions.
+    It understands the tags that `yaml.dump` uses for the values in
+    the headers: tuples, and numpy scalars, dtypes and arrays. Other
+    Python objects are loaded as the plain lists/dicts/strings that
+    represent them.
+    """
+
+
+def _construct_plain(loader, node):
+    if isinstance(node, yaml.MappingNode):
+        return loader.construct_mapping(node, deep=True)
+    elif isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node, deep=True)
+    else:
+        return loader.construct_scalar(node)
+
+
+def _construct_dtype(args, state=None) -> np.dtype:
+    dtype = np.dtype(args[0])
+    if state and state[1] in '<>':
+        dtype = dtype.newbyteorder(state[1])
+    return dtype
+
+
+def _construct_python(loader, suffix, node):
+    """Construct the values with a `!!python/...` tag."""
+    if suffix == 'tuple':
+        return tuple(loader.construct_sequence(node, deep=True))
+
+    kind, _, name = suffix.partition(':')
+    value = _construct_plain(loader, node)
+    if kind != 'object/apply':
+        return value
+
+    # `object/apply` is a list of arguments, or a dict with `args` and `state`
+    if isinstance(value, dict):
+        args, state = value.get('args', []), value.get('state')
+    else:
+        args, state = value, None
+
+    if name in NUMPY_DTYPE:
+        return _construct_dtype(args, state)
+    elif name in NUMPY_SCALAR:
+        dtype, data = args
+        return np.frombuffer(data, dtype=dtype)[0]
+    elif name in NUMPY_ARRAY:
+        _, shape, dtype, is_fortran, data = state
+        order = 'F' if is_fortran else 'C'
+        return np.frombuffer(data, dtype=dtype).reshape(shape, order=order).copy()
+
+    return value
+
+
+HeaderLoader.add_multi_constructor(PYTHON_TAG, _construct_python)
@@ -231,10 +231,11 @@ def cache_data():
     :Returns:
 
     extra : dict
-            Keyword arguments
+            Keyword arguments, `cache` keeps the open files for
+            `read_image`
     """
 
-    return {'header': None, 'no_strict_mrc': False, 'force_volume': False}
+    return {'cache': {}, 'no_strict_mrc': False, 'force_volume': False}
 
 
 def is_format_header(h):
@@ -572,6 +573,10 @@ def read_image(filename, index=None, cache=None, no_strict_mrc=False, force_volu
                    Filename or open stream for a file
         index : int, optional
                 Index of image to get, if None, first image (Default: None)
+        cache : dict, optional
+                Keeps the files as `MRCStack` objects by filename, so that
+                reading more images from the same file does not parse the
+                header again (used if `index` is given)
         no_strict_mrc : bool
                         Perform strict MRC header checking (recommended) - Only
                         EPU MRC files and Yifan's frame alignment require this
@@ -585,6 +590,12 @@ def read_image(filename, index=None, cache=None, no_strict_mrc=False, force_volu
               Array with image information from the file
     """
 
+    if cache is not None and index is not None and not force_volume:
+        stack = cache.get(filename)
+        if stack is None:
+            stack = cache[filename] = MRCStack(filename, no_strict_mrc=no_strict_mrc)
+        return stack.read_image(index), dict(stack.header)
+
     idx = 0 if index is None else index
     f = util.uopen(filename, 'rb')
     try:
@@ -631,6 +642,94 @@ def read_image(filename, index=None, cache=None, no_strict_mrc=False, force_volu
     return out, header
 
 
+class MRCStack:
+    """Stack of images in an MRC file, read lazily.
+
+    The header is parsed once, and the images are exposed as a memory-
+    mapped array of shape (nz, ny, nx) in `data`, so that an image or a
+    range of images is only read from disk when it is accessed.
+
+    :Parameters:
+
+    filename : str
+               Filename of the MRC file
+    no_strict_mrc : bool
+                    Perform strict MRC header checking (recommended) - Only
+                    EPU MRC files and Yifan's frame alignment require this
+                    to be off.
+
+    Usage:
+        with MRCStack('stack.mrc') as stack:
+            img = stack[5]          # memory-mapped image
+            imgs = stack.read(0, 8)  # images 0-7 as an array
+    """
+
+    def __init__(self, filename, no_strict_mrc=False):
+        self.filename = filename
+
+        with open(filename, 'rb') as f:
+            h = read_mrc_header(f, no_strict_mrc)
+            total = file_size(f)
+
+        self.header = read_header(h)
+
+        dtype = numpy.dtype(mrc2numpy[h['mode'][0]])
+        if header_image_dtype.newbyteorder()[0] == h.dtype[0]:
+            dtype = dtype.newbyteorder()
+
+        shape = (int(h['nz'][0]), int(h['ny'][0]), int(h['nx'][0]))
+        offset = 1024 + int(h['nsymbt'][0])
+        expected = offset + shape[0] * shape[1] * shape[2] * dtype.itemsize
+        if total != expected:
+            raise util.InvalidHeaderException(
+                'file size != header: %d != %d -- %d' % (total, expected, int(h['nsymbt'][0]))
+            )
+
+        self.data = numpy.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({str(self.filename)!r}, shape={self.data.shape})'
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def read(self, start=0, stop=None):
+        """Read the images `start` to `stop` (exclusive) into memory with a
+        single read."""
+        return numpy.array(self.data[start:stop])
+
+    def read_image(self, index=0):
+        """Read image `index` into memory."""
+        if not -len(self) <= index < len(self):
+            raise OSError(
+                'Index exceeds number of images in stack: %d < %d' % (index, len(self))
+            )
+        return numpy.array(self.data[index])
+
+    def close(self):
+        """Release the memory map, arrays returned by indexing become
+        invalid."""
+        if self.data is not None:
+            self.data._mmap.close()
+            self.data = None
+
+
 def reshape_data(out, h, index, count, force_volume=False):
     """Reshape the data to the proper dimensions.
 
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import json
+import numbers
+import threading
+
+import h5py
+import numpy as np
+
+DATA_PATH = 'entry/data/data'
+HEADERS_PATH = 'entry/headers'
+OMEGA_PATH = 'entry/sample/goniometer/omega'
+COLUMN_CHUNKS = 1024
+
+
+def _to_json(value) -> str:
+    return json.dumps(value, default=lambda o: o.tolist() if hasattr(o, 'tolist') else str(o))
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (numbers.Number, np.number)) and not isinstance(value, complex)
+
+
+class NXmxWriter:
+    """Write a series of frames to a single HDF5 file, in the NeXus/NXmx
+    layout used for rotation data.
+
+    The frames are appended to one chunked, compressed dataset
+    (`/entry/data/data`, one frame per chunk by default), so that the
+    file is only opened once instead of once per frame. The header of
+    each frame is stored in a table in `/entry/headers`, with one
+    dataset per key: numbers as floats (NaN if missing), other values
+    as JSON strings (empty if missing). The tables are resizable, so
+    `flush` (every `flush_every` frames) and `close` only write the rows
+    that were added since the previous flush.
+
+    The geometry (wavelength, detector distance, pixel size, beam
+    center, rotation angles) can be given with `set_geometry`.
+
+    Usage:
+        with NXmxWriter('data.h5') as writer:
+            for i in range(n):
+                img, h = ctrl.get_image(exposure)
+                writer.add(img, h)
+    """
+
+    def __init__(
+        self,
+        fname: str,
+        compression: str = 'gzip',
+        compression_opts: int = 4,
+        chunk_frames: int = 1,
+        flush_every: int = 100,
+    ):
+        self.fname = fname
+        self.compression = compression
+        self.compression_opts = compression_opts if compression == 'gzip' else None
+        self.chunk_frames = chunk_frames
+        self.flush_every = flush_every
+
+        self.file = h5py.File(fname, 'w')
+        self._dataset = None
+        self._pending = {}
+        self._n_added = 0
+        self._n_omega = 0
+        self._geometry = {}
+        self._lock = threading.RLock()
+
+        entry = self._group('entry', 'NXentry')
+        entry['definition'] = 'NXmx'
+        self._group('entry/data', 'NXdata').attrs['signal'] = 'data'
+        self._group('entry/instrument', 'NXinstrument')
+        self._group('entry/instrument/beam', 'NXbeam')
+        self._group('entry/instrument/detector', 'NXdetector')
+        self._group('entry/sample', 'NXsample')
+        self._group(HEADERS_PATH, 'NXcollection')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return 0 if self._dataset is None else self._dataset.shape[0]
+
+    def _group(self, path: str, nx_class: str) -> h5py.Group:
+        group = self.file.require_group(path)
+        group.attrs['NX_class'] = nx_class
+        return group
+
+    def _set(self, path: str, value, units: str = None) -> None:
+        if path in self.file:
+            del self.file[path]
+        dataset = self.file.create_dataset(path, data=value)
+        if units:
+            dataset.attrs['units'] = units
+
+    def _column(self, path: str, numeric: bool) -> h5py.Dataset:
+        """Return the resizable header column at `path`, created if
+        needed.
+
+        A numeric column that receives other values is converted once
+        to a column of JSON strings.
+        """
+        column = self.file.get(path)
+        if column is not None and (numeric or column.dtype.kind != 'f'):
+            return column
+
+        old = None
+        if column is not None:
+            old = column[()]
+            del self.file[path]
+
+        if numeric:
+            dtype, fillvalue = 'f8', np.nan
+        else:
+            dtype, fillvalue = h5py.string_dtype(), ''
+        column = self.file.create_dataset(
+            path,
+            shape=(0,),
+            maxshape=(None,),
+            chunks=(COLUMN_CHUNKS,),
+            dtype=dtype,
+            fillvalue=fillvalue,
+        )
+
+        if old is not None:
+            column.resize(old.shape)
+            column[:] = np.array(
+                ['' if np.isnan(value) else _to_json(value.item()) for value in old],
+                dtype=object,
+            )
+        return column
+
+    def add(self, img: np.ndarray, h: dict = None, index: int = None) -> int:
+        """Write image `img` with header `h` at position `index` (0-based)
+        of the dataset, or append it if `index` is None.
+
+        The dataset is grown as needed, frames that are never written
+        read as zeros. Returns the position of the frame.
+        """
+        img = np.asarray(img)
+
+        with self._lock:
+            if self._dataset is None:
+                self._dataset = self.file.create_dataset(
+                    DATA_PATH,
+                    shape=(0, *img.shape),
+                    maxshape=(None, *img.shape),
+                    chunks=(self.chunk_frames, *img.shape),
+                    dtype=img.dtype,
+                    compression=self.compression,
+                    compression_opts=self.compression_opts,
+                    shuffle=self.compression is not None,
+                )
+
+            if index is None:
+                index = len(self)
+            if index >= len(self):
+                self._dataset.resize(index + 1, axis=0)
+
+            self._dataset[index] = img
+
+            for key, value in (h or {}).items():
+                key = str(key).replace('/', '_')
+                self._pending.setdefault(key, {})[index] = value
+
+            self._n_added += 1
+            if self.flush_every and self._n_added % self.flush_every == 0:
+                self.flush()
+
+        return index
+
+    def set_geometry(
+        self,
+        wavelength: float = None,  # Angstrom
+        distance: float = None,  # mm
+        pixel_size: float = None,  # mm
+        beam_center: tuple = None,  # pixels, (x, y) in the XDS convention
+        start_angle: float = None,  # degrees
+        osc_angle: float = None,  # degrees
+    ) -> None:
+        """Store the experimental geometry in the NXmx groups, the rotation
+        angles of the frames are written by `flush`/`close`."""
+        with self._lock:
+            if wavelength is not None:
+                self._set('entry/instrument/beam/incident_wavelength', wavelength, 'angstrom')
+            if distance is not None:
+                self._set('entry/instrument/detector/distance', distance, 'mm')
+            if pixel_size is not None:
+                self._set('entry/instrument/detector/x_pixel_size', pixel_size, 'mm')
+                self._set('entry/instrument/detector/y_pixel_size', pixel_size, 'mm')
+            if beam_center is not None:
+                self._set('entry/instrument/detector/beam_center_x', beam_center[0], 'pixel')
+                self._set('entry/instrument/detector/beam_center_y', beam_center[1], 'pixel')
+            if start_angle is not None and osc_angle is not None:
+                self._geometry['rotation'] = (start_angle, osc_angle)
+                self._n_omega = 0
+                self._group('entry/sample/goniometer', 'NXtransformations')
+                self._set('entry/sample/goniometer/omega_increment_set', osc_angle, 'deg')
+
+    def flush(self) -> None:
+        """Write the new rows of the header tables and rotation angles,
+        and flush the file."""
+        with self._lock:
+            n = len(self)
+
+            for key, values in self._pending.items():
+                numeric = all(_is_number(value) for value in values.values())
+                column = self._column(f'{HEADERS_PATH}/{key}', numeric)
+                if column.shape[0] < n:
+                    column.resize((n,))
+
+                # only the rows between the first and last new value are written
+                start, stop = min(values), max(values) + 1
+                if column.dtype.kind == 'f':
+                    rows = column[start:stop]
+                    for index, value in values.items():
+                        rows[index - start] = value
+                else:
+                    rows = column.asstr()[start:stop].astype(object)
+                    for index, value in values.items():
+                        rows[index - start] = _to_json(value)
+                column[start:stop] = rows
+            self._pending.clear()
+
+            if 'rotation' in self._geometry and self._n_omega < n:
+                start_angle, osc_angle = self._geometry['rotation']
+                omega = self.file.get(OMEGA_PATH)
+                if omega is None:
+                    omega = self.file.create_dataset(
+                        OMEGA_PATH,
+                        shape=(0,),
+                        maxshape=(None,),
+                        chunks=(COLUMN_CHUNKS,),
+                        dtype='f8',
+                    )
+                    omega.attrs['units'] = 'deg'
+                    omega.attrs['transformation_type'] = 'rotation'
+                omega.resize((n,))
+                omega[self._n_omega : n] = start_angle + osc_angle * np.arange(self._n_omega, n)
+                self._n_omega = n
+
+            self.file.flush()
+
+    def close(self) -> None:
+        """Write the header tables and close the file."""
+        with self._lock:
+            if not self.file:
+                return
+            self.flush()
+            self.file.close()
+
+
+def read_nexus(fname: str, index: int = 0) -> (np.array, dict):
+    """Read frame `index` and its header from a file written by
+    `NXmxWriter`.
+
+    fname: str,
+        path or filename to image which should be opened
+    index: int,
+        position of the frame in the dataset
+
+    Returns:
+        image: np.ndarray, header: dict
+    """
+    with h5py.File(fname, 'r') as f:
+        img = f[DATA_PATH][index]
+
+        header = {}
+        for key, column in f.get(HEADERS_PATH, {}).items():
+            value = column[index]
+            if isinstance(value, bytes):
+                if value:
+                    header[key] = json.loads(value)
+            elif not np.isnan(value):
+                header[key] = value.item()
+
+    return img, header
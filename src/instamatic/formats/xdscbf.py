@@ -20,59 +20,194 @@ DATA_TYPES = {
 STARTER = b'\x0c\x1a\x04\xd5'
 
 
+# Markers preceding the deltas that do not fit in a byte, and the size of
+# the integer that follows, by number of bytes used for a delta
+BYTE_OFFSET_MARKERS = {
+    3: (b'\x80', 2),
+    7: (b'\x80\x00\x80', 4),
+    15: (b'\x80\x00\x80\x00\x00\x00\x80', 8),
+}
+
+
 def compByteOffset(data):
     """Compress a dataset into a string using the byte_offet algorithm.
 
     :param data: ndarray
     :return: string/bytes with compressed data
 
+    The number of bytes needed for each delta is computed first, so that
+    the output can be assembled in a single preallocated buffer.
+
     test = np.array([0,1,2,127,0,1,2,128,0,1,2,32767,0,1,2,32768,0,1,2,2147483647,0,1,2,2147483648,0,1,2,128,129,130,32767,32768,128,129,130,32768,2147483647,2147483648])
     """
     flat = np.ascontiguousarray(data.ravel(), np.int64)
-    delta = np.zeros_like(flat)
-    delta[0] = flat[0]
-    delta[1:] = flat[1:] - flat[:-1]
-    mask = abs(delta) > 127
-    exceptions = np.nonzero(mask)[0]
-    if np.little_endian:
-        byteswap = False
+    delta = np.empty_like(flat)
+    delta[:1] = flat[:1]
+    np.subtract(flat[1:], flat[:-1], out=delta[1:])
+
+    absdelta = np.abs(delta)
+    sizes = np.ones(delta.size, dtype=np.int64)
+    sizes[absdelta > 127] = 3
+    sizes[absdelta > 32767] = 7  # 2**15-1
+    sizes[absdelta > 2147483647] = 15  # 2**31-1
+
+    offsets = np.cumsum(sizes) - sizes
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+
+    # little endian bytes of each delta, the lowest byte is the int8 value
+    delta_bytes = delta.astype('<i8').view(np.uint8).reshape(-1, 8)
+    out[offsets] = delta_bytes[:, 0]
+
+    for size, (marker, nbytes) in BYTE_OFFSET_MARKERS.items():
+        index = np.flatnonzero(sizes == size)
+        if not index.size:
+            continue
+        start = offsets[index, np.newaxis]
+        out[start + np.arange(len(marker))] = np.frombuffer(marker, dtype=np.uint8)
+        out[start + len(marker) + np.arange(nbytes)] = delta_bytes[index, :nbytes]
+
+    return out.tobytes()
+
+
+def decByteOffset(stream, size: int = None, dtype='int64'):
+    """Decompress a string/bytes with data compressed using the byte_offset
+    algorithm.
+
+    :param stream: string/bytes with compressed data
+    :param size: number of elements, checked if given
+    :param dtype: data type of the returned array
+    :return: 1D ndarray
+
+    The deltas are decoded and summed with array operations, only the
+    0x80 bytes that are ambiguous (see below) are checked one at a time.
+    """
+    raw = np.frombuffer(stream, dtype=np.uint8)
+
+    # number of bytes used by a delta if the 0x80 at `candidates` is a marker
+    candidates = np.flatnonzero(raw == 0x80)
+    padded = np.concatenate([raw, np.zeros(7, dtype=np.uint8)])
+    following = padded[candidates[:, np.newaxis] + np.arange(1, 7)]
+    is_int32 = (following[:, 0] == 0x00) & (following[:, 1] == 0x80)
+    is_int64 = is_int32 & (following[:, 2:] == (0x00, 0x00, 0x00, 0x80)).all(axis=1)
+    sizes = np.where(is_int64, 15, np.where(is_int32, 7, 3))
+
+    # a 0x80 byte can also be part of a marker or of the integer following
+    # it. A candidate past the end of all previous candidates is always a
+    # marker, and a candidate within such a marker never is. The others are
+    # resolved in order.
+    ends = candidates + sizes
+    previous_end = np.maximum.accumulate(np.concatenate([[0], ends[:-1]]))
+    is_marker = candidates >= previous_end
+
+    marker_end = np.maximum.accumulate(np.concatenate([[0], np.where(is_marker, ends, 0)[:-1]]))
+    unresolved = np.flatnonzero(~is_marker & (candidates >= marker_end))
+
+    end = 0
+    for k in unresolved.tolist():
+        end = max(end, marker_end[k])
+        if candidates[k] >= end:
+            is_marker[k] = True
+            end = ends[k]
+
+    positions = candidates[is_marker]
+    sizes = sizes[is_marker]
+
+    if positions.size and positions[-1] + sizes[-1] > raw.size:
+        raise ValueError('Byte offset stream ends in the middle of a value')
+
+    values = raw.view(np.int8).astype(np.int64)
+    is_value = np.ones(raw.size, dtype=bool)
+
+    for size_, (marker, nbytes) in BYTE_OFFSET_MARKERS.items():
+        pos = positions[sizes == size_]
+        if not pos.size:
+            continue
+        payload = pos[:, np.newaxis] + len(marker) + np.arange(nbytes)
+        values[pos] = raw[payload].copy().view(f'<i{nbytes}').ravel()
+        is_value[payload] = False
+        is_value[pos[:, np.newaxis] + np.arange(1, len(marker))] = False
+
+    values = values[is_value]
+    if size is not None and values.size != size:
+        raise ValueError(f'Expected {size} elements, found {values.size}')
+
+    return np.cumsum(values).astype(dtype)
+
+
+def read(fname):
+    """Read a CBF file with byte offset compressed data.
+
+    :param str fname: name of the file
+    :return: image as ndarray, header: dict with the miniCBF header
+        (`# key value` lines) and the binary section parameters
+    """
+    with open(fname, 'rb') as f:
+        raw = f.read()
+
+    start = raw.find(STARTER)
+    if start < 0:
+        raise OSError(f'No binary data found in CBF file {fname}')
+
+    mime = raw[:start].decode(errors='replace')
+    if 'x-CBF_BYTE_OFFSET' not in mime:
+        raise NotImplementedError('Only byte offset compressed CBF files are supported')
+
+    header = {}
+    for line in mime.splitlines():
+        line = line.strip()
+        if line.startswith('#') and not line.startswith('###CBF'):
+            key, _, value = line.lstrip('# ').partition(' ')
+            header[key.rstrip(':')] = value.strip()
+            continue
+        key, sep, value = line.partition(':')
+        if sep and key.startswith('X-Binary'):
+            header[key] = value.strip().strip('"')
+
+    dtype = DATA_TYPES.get(header.get('X-Binary-Element-Type'), 'int32')
+    dim1 = int(header['X-Binary-Size-Fastest-Dimension'])
+    dim2 = int(header.get('X-Binary-Size-Second-Dimension', 1))
+    size = int(header.get('X-Binary-Number-of-Elements', dim1 * dim2))
+
+    start += len(STARTER)
+    stream = raw[start : start + int(header['X-Binary-Size'])]
+
+    data = decByteOffset(stream, size=size, dtype=dtype)
+    return data.reshape(dim2, dim1), header
+
+
+def encode_header(header: dict = None) -> list:
+    """Return the lines of the `_array_data.header_*` items, with a miniCBF
+    `# key value` line for each item in `header` (PILATUS convention)."""
+    if header:
+        convention = b'_array_data.header_convention "PILATUS_1.2"'
+        contents = [np.bytes_(f'# {key} {value}') for key, value in header.items()]
     else:
-        byteswap = True
-    start = 0
-    binary_blob = b''
-    for stop in exceptions:
-        if stop - start > 0:
-            binary_blob += delta[start:stop].astype(np.int8).tobytes()
-        exc = delta[stop]
-        absexc = abs(exc)
-        if absexc > 2147483647:  # 2**31-1
-            binary_blob += b'\x80\x00\x80\x00\x00\x00\x80'
-            if byteswap:
-                binary_blob += delta[stop : stop + 1].byteswap().tobytes()
-            else:
-                binary_blob += delta[stop : stop + 1].tobytes()
-        elif absexc > 32767:  # 2**15-1
-            binary_blob += b'\x80\x00\x80'
-            if byteswap:
-                binary_blob += delta[stop : stop + 1].astype(np.int32).byteswap().tobytes()
-            else:
-                binary_blob += delta[stop : stop + 1].astype(np.int32).tobytes()
-        else:  # >127
-            binary_blob += b'\x80'
-            if byteswap:
-                binary_blob += delta[stop : stop + 1].astype(np.int16).byteswap().tobytes()
-            else:
-                binary_blob += delta[stop : stop + 1].astype(np.int16).tobytes()
-        start = stop + 1
-    if start < delta.size:
-        binary_blob += delta[start:].astype(np.int8).tobytes()
-    return binary_blob
-
-
-def write(fname, data, header={}):
+        convention = b'_array_data.header_convention "XDS special"'
+        contents = []
+    return [convention, b'_array_data.header_contents', b';', *contents, b';']
+
+
+def update_header(fname, header: dict):
+    """Replace the miniCBF header of an existing CBF file, the compressed
+    data are copied as they are."""
+    with open(fname, 'rb') as f:
+        raw = f.read()
+
+    start = raw.find(b'_array_data.header_convention')
+    end = raw.find(b'\r\n\r\n_array_data.data')
+    if start < 0 or end < 0:
+        raise OSError(f'No header found in CBF file {fname}')
+
+    with open(fname, 'wb') as f:
+        f.write(raw[:start] + b'\r\n'.join(encode_header(header)) + raw[end:])
+
+
+def write(fname, data, header=None):
     """Write the file in CBF format.
 
     :param str fname: name of the file
+    :param dict header: written as a miniCBF header with a `# key value`
+        line for each item (PILATUS convention), if given
     """
     if data is not None:
         dim2, dim1 = data.shape
@@ -83,15 +218,13 @@ def write(fname, data, header={}):
     for key, value in DATA_TYPES.items():
         if value == data.dtype:
             dtype = key
+
     binary_block = [
         b'###CBF: Version July 2008 generated by XDS',
         b'',
         b'data_a.cbf',
         b'',
-        b'_array_data.header_convention "XDS special"',
-        b'_array_data.header_contents',
-        b';',
-        b';',
+        *encode_header(header),
         b'',
         b'_array_data.data',
         b';',
@@ -82,6 +82,10 @@ class ExperimentalSED(LabelFrame):
         Label(frame, text='Spot size:').grid(row=7, column=2, sticky='W')
         self.e_exp_time_diff = Entry(frame, width=20, textvariable=self.var_image_spotsize)
         self.e_exp_time_diff.grid(row=7, column=3, padx=10)
+
+        Checkbutton(frame, text='Single file (NeXus)', variable=self.var_single_file).grid(
+            row=8, column=0, sticky='W'
+        )
         frame.grid_columnconfigure(0, weight=1)
         frame.grid_columnconfigure(2, weight=1)
 
@@ -128,6 +132,7 @@ class ExperimentalSED(LabelFrame):
         self.var_diff_exposure = DoubleVar(value=0.1)
         self.var_image_spotsize = IntVar(value=4)
         self.var_diff_brightness = IntVar(value=40000)
+        self.var_single_file = BooleanVar(value=False)
 
     def set_trigger(self, trigger=None, q=None):
         self.triggerEvent = trigger
@@ -178,6 +183,7 @@ class ExperimentalSED(LabelFrame):
             'diff_spotsize': self.var_image_spotsize.get(),
             'diff_brightness': self.var_diff_brightness.get(),
             'scan_radius': self.var_scan_radius.get(),
+            'single_file': self.var_single_file.get(),
         }
         return params
 
@@ -190,6 +196,8 @@ def acquire_data_SED(controller, **kwargs):
     expdir = controller.module_io.get_new_experiment_directory()
     expdir.mkdir(exist_ok=True, parents=True)
 
+    single_file = kwargs.pop('single_file', False)
+
     params = workdir / 'params.json'
     try:
         params = json.load(open(params))
@@ -210,6 +218,7 @@ def acquire_data_SED(controller, **kwargs):
         log=controller.log,
         scan_radius=scan_radius,
         begin_here=True,
+        single_file=single_file,
     )
     exp.report_status()
     exp.run()
@@ -9,12 +9,21 @@ from math import cos
 import numpy as np
 
 from instamatic import config
-from instamatic.formats import read_tiff, write_adsc, write_mrc, write_tiff
+from instamatic.formats import (
+    NXmxWriter,
+    read_tiff,
+    write_adsc,
+    write_cbf,
+    write_mrc,
+    write_tiff,
+)
 from instamatic.processing.flatfield import apply_flatfield_correction
+from instamatic.processing.framestore import FrameStore
 from instamatic.processing.stretch_correction import affine_transform_ellipse_to_circle
 from instamatic.tools import (
     find_beam_center,
     find_beam_center_with_beamstop,
+    find_beam_centers,
     find_subranges,
     to_xds_untrusted_area,
 )
@@ -94,6 +103,59 @@ def export_dials_variables(path, *, sequence=(), missing=(), rotation_xyz=None):
         print('::     dials.integrate %exclude_images% refined.pickle refined.json', file=f)
 
 
+def write_tiff_frame(path, i: int, img: np.ndarray, h: dict):
+    """Write the image+header with sequence number `i` to the directory
+    `path` in TIFF format.
+
+    Returns the path to the written image.
+    """
+    # PETS reads only 16bit unsignt integer TIFF
+    img = np.round(img, 0).astype(np.uint16)
+
+    fn = path / f'{i:05d}.tiff'
+    write_tiff(fn, img, header=h)
+    return fn
+
+
+def write_mrc_frame(path, i: int, img: np.ndarray):
+    """Write the image with sequence number `i` to the directory `path` in
+    MRC format.
+
+    Returns the path to the written image.
+    """
+    fn = path / f'{i:05d}.mrc'
+
+    # for RED these need to be as integers
+    dtype = np.uint16
+    if False:
+        # Use maximum range available in data type for extra precision when converting from FLOAT to INT
+        dynamic_range = 11900  # a little bit higher just in case
+        maxval = np.iinfo(dtype).max
+        img = (img / dynamic_range) * maxval
+
+    img = np.round(img, 0).astype(dtype)
+
+    # flip up/down because RED reads images from the bottom left corner
+    img = np.flipud(img)
+
+    write_mrc(fn, img)
+
+    return fn
+
+
+def write_cbf_frame(path, i: int, img: np.ndarray, header: dict):
+    """Write the image with sequence number `i` and miniCBF header `header`
+    to the directory `path` in CBF format (byte offset compressed).
+
+    Returns the path to the written image.
+    """
+    img = np.round(img, 0).astype(np.int32)
+
+    fn = path / f'{i:05d}.cbf'
+    write_cbf(fn, img, header=header)
+    return fn
+
+
 def get_calibrated_rotation_speed(val):
     """Correct for the overestimation of the oscillation angle if the rotation
     was stopped before interrupting the data collection.
@@ -118,7 +180,9 @@ class ImgConversion:
 
     The image buffer is passed as a list of tuples, where each tuple
     contains the index (int), image data (2D numpy array),
-    metadata/header (dict). The buffer index must start at 1.
+    metadata/header (dict). The buffer index must start at 1. For long
+    data collections, a `FrameStore` can be passed instead to keep the
+    frames on disk.
     """
 
     def __init__(
@@ -136,28 +200,11 @@ class ImgConversion:
             flatfield, h = read_tiff(flatfield)
         self.flatfield = flatfield
 
-        self.headers = {}
-        self.data = {}
-
         self.smv_subdrc = 'data'
 
-        while len(buffer) != 0:
-            i, img, h = buffer.pop(0)
-
-            self.headers[i] = h
-
-            if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
-            else:
-                self.data[i] = img
+        self.load_buffer(buffer)
 
         self.untrusted_areas = []
-
-        self.observed_range = set(self.data.keys())
-        self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
-        self.missing_range = self.observed_range ^ self.complete_range
-
-        self.data_shape = img.shape
         try:
             self.pixelsize = config.calibration['diff']['pixelsize'][
                 camera_length
@@ -200,6 +247,44 @@ class ImgConversion:
         self.mean_beam_center, self.beam_center_std = self.get_beam_centers()
         logger.debug(f'Primary beam at: {self.mean_beam_center}')
 
+    def load_buffer(self, buffer) -> None:
+        """Read the frames from `buffer` into `self.data`/`self.headers` and
+        apply the flatfield correction.
+
+        `buffer` is a list of `(i, img, h)` tuples, which is emptied, an
+        iterable of such tuples (e.g. from `formats.iter_tiff_dataset`),
+        or a `FrameStore`, which is used directly so that the frames can
+        stay on disk. Iterables are read completely before the conversion
+        starts, use `ImgConversionStream` to convert the frames as they
+        arrive.
+        """
+        if isinstance(buffer, FrameStore):
+            self.headers = buffer.headers
+            self.data = buffer.data
+            if self.flatfield is not None:
+                for i in sorted(buffer.observed_range):
+                    self.data[i] = apply_flatfield_correction(self.data[i], self.flatfield)
+        else:
+            self.headers = {}
+            self.data = {}
+
+            for i, img, h in buffer:
+                self.headers[i] = h
+
+                if self.flatfield is not None:
+                    self.data[i] = apply_flatfield_correction(img, self.flatfield)
+                else:
+                    self.data[i] = img
+
+            if hasattr(buffer, 'clear'):
+                buffer.clear()
+
+        self.observed_range = set(self.data.keys())
+        self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
+        self.missing_range = self.observed_range ^ self.complete_range
+
+        self.data_shape = self.data[min(self.observed_range)].shape
+
     def check_settings(self) -> None:
         """Check for the presence of all required attributes.
 
@@ -257,22 +342,25 @@ class ImgConversion:
         """Obtain beam centers from the diffraction data Returns a tuple with
         the median beam center and its standard deviation."""
         shape_x, shape_y = self.data_shape
-        centers = []
-        for i, h in self.headers.items():
-            if self.use_beamstop:
-                cx, cy = find_beam_center_with_beamstop(self.data[i], z=99)
-            else:
-                cx, cy = find_beam_center(self.data[i], sigma=10)
+        keys = list(self.headers)
+
+        if self.use_beamstop:
+            centers = np.array(
+                [find_beam_center_with_beamstop(self.data[i], z=99) for i in keys], dtype=float
+            )
+        else:
+            # vectorized over chunks of frames, read lazily from the buffer
+            centers = find_beam_centers((self.data[i] for i in keys), sigma=10)
 
-            if invert_x:
-                cx = shape_x - cx
-            if invert_y:
-                cy = shape_y - cy
+        if invert_x:
+            centers[:, 0] = shape_x - centers[:, 0]
+        if invert_y:
+            centers[:, 1] = shape_y - centers[:, 1]
 
-            h['beam_center'] = (cx, cy)
-            centers.append((cx, cy))
+        for i, (cx, cy) in zip(keys, centers):
+            self.headers[i]['beam_center'] = (cx, cy)
 
-        self._beam_centers = beam_centers = np.array(centers)
+        self._beam_centers = beam_centers = centers
 
         # avg_center = np.mean(centers, axis=0)
         median_center = np.median(beam_centers, axis=0)
@@ -291,8 +379,6 @@ class ImgConversion:
 
         Reads the stretch amplitude/azimuth from the config file
         """
-        from instamatic.formats import write_cbf
-
         center = np.array(self.mean_beam_center)
 
         amplitude_pc = self.stretch_amplitude / (2 * 100)
@@ -343,6 +429,41 @@ class ImgConversion:
 
         logger.debug(f'SMV files saved in folder: {path}')
 
+    def cbf_writer(self, path: str) -> None:
+        """Write all data as CBF files with miniCBF headers to `path`"""
+        print('\033[k', 'Writing CBF files......', end='\r')
+
+        path.mkdir(exist_ok=True)
+
+        for i in self.observed_range:
+            self.write_cbf(path, i)
+
+        logger.debug(f'CBF files saved in folder: {path}')
+
+    def nexus_writer(self, fname: str) -> None:
+        """Write all data to a single NeXus/NXmx file `fname`, frame `i` is
+        stored at position `i-1`."""
+        print('\033[k', 'Writing NeXus file......', end='\r')
+
+        with NXmxWriter(fname) as writer:
+            self.set_nexus_geometry(writer)
+            for i in sorted(self.observed_range):
+                writer.add(self.data[i], self.headers[i], index=i - 1)
+
+        logger.debug(f'NeXus file created: {fname}')
+
+    def set_nexus_geometry(self, writer: NXmxWriter) -> None:
+        """Store the experimental geometry in the NeXus file of `writer`."""
+        writer.set_geometry(
+            wavelength=self.wavelength,
+            distance=self.distance,
+            pixel_size=self.physical_pixelsize,
+            # reverse XY coordinates for XDS
+            beam_center=(self.mean_beam_center[1], self.mean_beam_center[0]),
+            start_angle=self.start_angle,
+            osc_angle=self.osc_angle,
+        )
+
     def mrc_writer(self, path: str) -> None:
         """Write all data as mrc files to `path`"""
         print('\033[k', 'Writing MRC files......', end='\r')
@@ -359,17 +480,27 @@ class ImgConversion:
         tiff_path: str = None,
         smv_path: str = None,
         mrc_path: str = None,
-        workers: int = 8,
-    ) -> None:
+        cbf_path: str = None,
+        workers: int = None,
+        backend: str = None,
+    ) -> dict:
         """Efficiently write all data to the specified formats using a
-        threadpool.
+        thread or process pool.
 
         If a path is given, write data in the corresponding format, i.e.
         if `tiff_path` is specified TIFF files are written to that path.
+
+        `backend` is `thread` or `process` (default:
+        `img_conversion_backend` in the settings), and `workers` the
+        number of threads/processes (default: one per CPU). Returns a
+        dict with the throughput of each format.
         """
+        from .frame_writer import write_frames
+
         write_tiff = tiff_path is not None
         write_smv = smv_path is not None
         write_mrc = mrc_path is not None
+        write_cbf = cbf_path is not None
 
         if write_smv:
             smv_path = smv_path / self.smv_subdrc
@@ -384,20 +515,35 @@ class ImgConversion:
             mrc_path.mkdir(exist_ok=True, parents=True)
             logger.debug(f'MRC files saved in folder: {mrc_path}')
 
-        import concurrent.futures
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            futures = []
-            for i in self.observed_range:
-                if write_tiff:
-                    futures.append(executor.submit(self.write_tiff, tiff_path, i))
-                if write_mrc:
-                    futures.append(executor.submit(self.write_mrc, mrc_path, i))
-                if write_smv:
-                    futures.append(executor.submit(self.write_smv, smv_path, i))
+        if write_cbf:
+            cbf_path.mkdir(exist_ok=True, parents=True)
+            logger.debug(f'CBF files saved in folder: {cbf_path}')
+
+        if backend is None:
+            backend = config.settings.img_conversion_backend
+
+        def get_tasks(i: int) -> list:
+            tasks = []
+            h = self.headers[i]
+            if write_tiff:
+                tasks.append(('tiff', tiff_path, h))
+            if write_mrc:
+                tasks.append(('mrc', mrc_path, None))
+            if write_smv:
+                tasks.append(('smv', smv_path, self.smv_header(i, h, self.data_shape)))
+            if write_cbf:
+                tasks.append(('cbf', cbf_path, self.cbf_header(i, h)))
+            return tasks
+
+        stats = write_frames(
+            self.observed_range,
+            get_image=self.data.__getitem__,
+            get_tasks=get_tasks,
+            backend=backend,
+            workers=workers,
+        )
 
-            for future in futures:
-                ret = future.result()
+        return stats.report()
 
     def to_dials(self, smv_path: str) -> None:
         """Convert the buffer to output compatible with DIALS.
@@ -422,7 +568,7 @@ class ImgConversion:
         path = smv_path / self.smv_subdrc
 
         i = min(observed_range)
-        empty = np.zeros_like(self.data[i])
+        empty = np.zeros(self.data_shape, dtype=np.uint16)
         # copy header from first frame
         h = self.headers[i].copy()
         h['ImageGetTime'] = time.time()
@@ -446,15 +592,7 @@ class ImgConversion:
 
         Returns the path to the written image.
         """
-        img = self.data[i]
-        h = self.headers[i]
-
-        # PETS reads only 16bit unsignt integer TIFF
-        img = np.round(img, 0).astype(np.uint16)
-
-        fn = path / f'{i:05d}.tiff'
-        write_tiff(fn, img, header=h)
-        return fn
+        return write_tiff_frame(path, i, self.data[i], self.headers[i])
 
     def write_smv(self, path: str, i: int) -> str:
         """Write the image+header with sequence number `i` to the directory
@@ -462,11 +600,17 @@ class ImgConversion:
 
         Returns the path to the written image.
         """
-        img = self.data[i]
-        h = self.headers[i]
+        img = np.ushort(self.data[i])
+        header = self.smv_header(i, self.headers[i], img.shape)
 
-        img = np.ushort(img)
-        shape_x, shape_y = img.shape
+        fn = path / f'{i:05d}.img'
+        write_adsc(fn, img, header=header)
+        return fn
+
+    def smv_header(self, i: int, h: dict, shape: tuple) -> dict:
+        """Return the SMV header for the image with sequence number `i`,
+        header `h` and `shape`."""
+        shape_x, shape_y = shape
 
         phi = self.start_angle + self.osc_angle * (i - 1)
 
@@ -506,36 +650,50 @@ class ImgConversion:
         header['BEAM_CENTER_Y'] = f'{mean_beam_center[0]:.4f}'
         header['DENZO_X_BEAM'] = f'{mean_beam_center[0]*self.physical_pixelsize:.4f}'
         header['DENZO_Y_BEAM'] = f'{mean_beam_center[1]*self.physical_pixelsize:.4f}'
-        fn = path / f'{i:05d}.img'
-        write_adsc(fn, img, header=header)
-        return fn
+        return header
 
-    def write_mrc(self, path: str, i: int) -> str:
+    def write_cbf(self, path: str, i: int) -> str:
         """Write the image+header with sequence number `i` to the directory
-        `path` in TIFF format.
+        `path` in CBF format.
 
         Returns the path to the written image.
         """
-        img = self.data[i]
+        return write_cbf_frame(path, i, self.data[i], self.cbf_header(i, self.headers[i]))
 
-        fn = path / f'{i:05d}.mrc'
-
-        # for RED these need to be as integers
-        dtype = np.uint16
-        if False:
-            # Use maximum range available in data type for extra precision when converting from FLOAT to INT
-            dynamic_range = 11900  # a little bit higher just in case
-            maxval = np.iinfo(dtype).max
-            img = (img / dynamic_range) * maxval
+    def cbf_header(self, i: int, h: dict) -> dict:
+        """Return the miniCBF header (PILATUS convention) for the image with
+        sequence number `i` and header `h`."""
+        phi = self.start_angle + self.osc_angle * (i - 1)
+        pixelsize = self.physical_pixelsize / 1000  # m
 
-        img = np.round(img, 0).astype(dtype)
+        try:
+            date = datetime.fromtimestamp(h['ImageGetTime']).isoformat()
+        except BaseException:
+            date = '0'
 
-        # flip up/down because RED reads images from the bottom left corner
-        img = np.flipud(img)
+        header = collections.OrderedDict()
+        header['Detector:'] = self.name
+        header['Timestamp'] = date
+        header['Pixel_size'] = f'{pixelsize:.4e} m x {pixelsize:.4e} m'
+        header['Exposure_time'] = f'{h["ImageExposureTime"]} s'
+        header['Exposure_period'] = f'{self.acquisition_time} s'
+        header['Wavelength'] = f'{self.wavelength:.5f} A'
+        header['Detector_distance'] = f'{self.distance / 1000:.5f} m'
+        # reverse XY coordinates for XDS
+        beam_x, beam_y = self.mean_beam_center[1], self.mean_beam_center[0]
+        header['Beam_xy'] = f'({beam_x:.2f}, {beam_y:.2f}) pixels'
+        header['Start_angle'] = f'{phi:.4f} deg.'
+        header['Angle_increment'] = f'{self.osc_angle:.4f} deg.'
+        header['Detector_2theta'] = '0.0000 deg.'
+        return header
 
-        write_mrc(fn, img)
+    def write_mrc(self, path: str, i: int) -> str:
+        """Write the image+header with sequence number `i` to the directory
+        `path` in TIFF format.
 
-        return fn
+        Returns the path to the written image.
+        """
+        return write_mrc_frame(path, i, self.data[i])
 
     def write_ed3d(self, path: str) -> None:
         """Write .ed3d input file for REDp in directory `path`"""
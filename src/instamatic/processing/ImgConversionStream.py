@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instamatic.formats import NXmxWriter, update_adsc_header, update_cbf_header
+
+from .ImgConversion import *
+
+# Header values kept for each frame after it has been written
+KEEP_HEADER_KEYS = ('ImageGetTime', 'ImageExposureTime', 'beam_center')
+
+
+class RunningStats:
+    """Running mean and standard deviation of a sequence of vectors
+    (Welford's algorithm)."""
+
+    def __init__(self, size: int = 2):
+        self.n = 0
+        self._mean = np.zeros(size)
+        self._m2 = np.zeros(size)
+
+    def add(self, value) -> None:
+        value = np.asarray(value, dtype=float)
+        self.n += 1
+        delta = value - self._mean
+        self._mean += delta / self.n
+        self._m2 += delta * (value - self._mean)
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self._mean.copy()
+
+    @property
+    def std(self) -> np.ndarray:
+        if self.n == 0:
+            return np.zeros_like(self._m2)
+        return np.sqrt(self._m2 / self.n)
+
+
+class ImgConversionStream(ImgConversion):
+    """Converts the frames of a RED/cRED data collection while they are
+    being collected. Files can be generated for REDp, DIALS, XDS, and PETS.
+
+    Frames are passed one at a time to `add_frame`, which applies the
+    flatfield correction, finds the beam center, and hands the frame to
+    a pool of `workers` threads that write it to the TIFF/MRC/SMV/CBF
+    paths that are given, and to a single NeXus file if `nexus_path` is
+    given. The number of frames waiting to be written is
+    bounded, and only the beam center and timestamps of each frame are
+    kept after it has been written, so that the memory use does not
+    depend on the number of frames.
+
+    Values that are only known at the end of the data collection (e.g.
+    the oscillation angle of a continuous rotation) can be passed to
+    `close`. It waits for all frames to be written, updates the SMV
+    and CBF headers, and writes the input files for XDS, DIALS, PETS
+    and REDp (depending on `write_xds`, `write_dials`, `write_pets`,
+    `write_red`) and the beam centers to `path`.
+
+    Usage:
+        img_conv = ImgConversionStream(start_angle=a0, rotation_axis=..., smv_path=...)
+        for i in range(1, n + 1):
+            img, h = ctrl.get_image(exposure)
+            img_conv.add_frame(i, img, h)
+        img_conv.close(end_angle=a1, osc_angle=(a1 - a0) / n, pixelsize=...)
+    """
+
+    def __init__(
+        self,
+        start_angle: float,  # degrees, start angle of the rotation
+        rotation_axis: float,  # radians, specifies the position of the rotation axis
+        osc_angle: float = 0.0,  # degrees, oscillation angle of the rotation
+        end_angle: float = None,  # degrees, end angle of the rotation
+        acquisition_time: float = None,  # seconds, acquisition time (exposure time + overhead)
+        flatfield: str = None,
+        pixelsize: float = None,  # p/Angstrom, size of the pixels (overrides camera_length)
+        physical_pixelsize: float = None,  # mm, physical size of the pixels (overrides camera length)
+        wavelength: float = None,  # Angstrom, relativistic wavelength of the electron beam
+        stretch_amplitude=0.0,  # Stretch correction amplitude, %
+        stretch_azimuth=0.0,  # Stretch correction azimuth, degrees
+        path: str = None,  # directory for PETS input and beam centers
+        tiff_path: str = None,
+        smv_path: str = None,
+        mrc_path: str = None,
+        cbf_path: str = None,
+        nexus_path: str = None,
+        write_xds: bool = True,
+        write_dials: bool = True,
+        write_pets: bool = True,
+        write_red: bool = True,
+        workers: int = 4,
+    ):
+        if flatfield is not None:
+            flatfield, h = read_tiff(flatfield)
+        self.flatfield = flatfield
+
+        self.headers = {}
+        self.data = {}
+        self.data_shape = None
+
+        self.observed_range = set()
+        self.complete_range = set()
+        self.missing_range = set()
+
+        self.smv_subdrc = 'data'
+        self.untrusted_areas = []
+        self.use_beamstop = False
+        self.name = 'Instamatic'
+
+        from .XDS_template import XDS_template
+
+        self.XDS_template = XDS_template
+
+        self.start_angle = start_angle
+        self.end_angle = end_angle
+        self.osc_angle = osc_angle
+        self.rotation_axis = rotation_axis
+        self.acquisition_time = acquisition_time
+
+        self.pixelsize = pixelsize
+        self.physical_pixelsize = physical_pixelsize
+        self.wavelength = wavelength
+        self.stretch_amplitude = stretch_amplitude
+        self.stretch_azimuth = stretch_azimuth
+        self.do_stretch_correction = self.stretch_amplitude != 0
+
+        self.path = path
+        self.tiff_path = tiff_path
+        self.smv_path = smv_path
+        self.mrc_path = mrc_path
+        self.cbf_path = cbf_path
+        self.nexus_path = nexus_path
+        self.write_xds = write_xds
+        self.write_dials = write_dials
+        self.write_pets = write_pets
+        self.write_red = write_red
+
+        smv_data_path = smv_path / self.smv_subdrc if smv_path else None
+        for drc in (tiff_path, mrc_path, cbf_path, smv_data_path):
+            if drc is not None:
+                drc.mkdir(exist_ok=True, parents=True)
+
+        self.nexus = NXmxWriter(nexus_path) if nexus_path is not None else None
+
+        self.beam_center_stats = RunningStats(2)
+        self.mean_beam_center = np.zeros(2)
+        self.beam_center_std = np.zeros(2)
+
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = threading.BoundedSemaphore(2 * workers)
+        self._errors = []
+        self._closed = False
+
+    @property
+    def distance(self) -> float:
+        if not (self.wavelength and self.pixelsize and self.physical_pixelsize):
+            return 0.0
+        return (1 / self.wavelength) * (self.physical_pixelsize / self.pixelsize)
+
+    def add_frame(self, i: int, img: np.ndarray, h: dict) -> None:
+        """Add the image `img` with header `h` and sequence number `i` (the
+        first frame is 1), the frames may arrive in any order.
+
+        A `beam_center` in the header is used if available. Blocks if
+        too many frames are waiting to be written.
+        """
+        if self._closed:
+            raise RuntimeError('Cannot add frames to a closed conversion')
+        if self._errors:
+            raise self._errors[0]
+
+        if self.flatfield is not None:
+            img = apply_flatfield_correction(img, self.flatfield)
+
+        if 'beam_center' not in h:
+            if self.use_beamstop:
+                h['beam_center'] = find_beam_center_with_beamstop(img, z=99)
+            else:
+                h['beam_center'] = find_beam_centers(img[np.newaxis], sigma=10)[0]
+
+        with self._lock:
+            self.data_shape = img.shape
+            self.headers[i] = {key: h[key] for key in KEEP_HEADER_KEYS if key in h}
+            self.observed_range.add(i)
+            self.beam_center_stats.add(h['beam_center'])
+            self.mean_beam_center = self.beam_center_stats.mean
+            self.beam_center_std = self.beam_center_stats.std
+
+        self._pending.acquire()
+        future = self._executor.submit(self._write_frame, i, img, h)
+        future.add_done_callback(self._frame_written)
+
+    def _write_frame(self, i: int, img: np.ndarray, h: dict) -> None:
+        if self.tiff_path is not None:
+            write_tiff_frame(self.tiff_path, i, img, h)
+        if self.mrc_path is not None:
+            write_mrc_frame(self.mrc_path, i, img)
+        if self.smv_path is not None:
+            fn = self.smv_path / self.smv_subdrc / f'{i:05d}.img'
+            write_adsc(fn, np.ushort(img), header=self.smv_header(i, h, img.shape))
+        if self.cbf_path is not None:
+            write_cbf_frame(self.cbf_path, i, img, self.cbf_header(i, h))
+        if self.nexus is not None:
+            self.nexus.add(img, self.headers[i], index=i - 1)
+
+    def _frame_written(self, future) -> None:
+        self._pending.release()
+        e = future.exception()
+        if e is not None:
+            logger.error('Error writing frame: %s', e)
+            self._errors.append(e)
+
+    def close(
+        self,
+        end_angle: float = None,
+        osc_angle: float = None,
+        acquisition_time: float = None,
+        pixelsize: float = None,
+        finalize: bool = True,
+    ) -> None:
+        """Wait until all frames have been written, and finalize the SMV/CBF
+        headers, NeXus file and input files with the given values.
+
+        If `finalize` is False, only wait for the frames, e.g. if the
+        data collection was interrupted.
+        """
+        if not self._closed:
+            self._closed = True
+            self._executor.shutdown(wait=True)
+
+        try:
+            if self._errors:
+                raise self._errors[0]
+            if finalize and self.observed_range:
+                self._finalize(end_angle, osc_angle, acquisition_time, pixelsize)
+        finally:
+            if self.nexus is not None:
+                self.nexus.close()
+
+    def _finalize(self, end_angle, osc_angle, acquisition_time, pixelsize) -> None:
+        if end_angle is not None:
+            self.end_angle = end_angle
+        if osc_angle is not None:
+            self.osc_angle = osc_angle
+        if acquisition_time is not None:
+            self.acquisition_time = acquisition_time
+        if pixelsize is not None:
+            self.pixelsize = pixelsize
+
+        self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
+        self.missing_range = self.observed_range ^ self.complete_range
+
+        # same statistics as `get_beam_centers`
+        beam_centers = np.array([h['beam_center'] for h in self.headers.values()])
+        self.mean_beam_center = np.median(beam_centers, axis=0)
+        self.beam_center_std = np.std(beam_centers, axis=0)
+
+        self.check_settings()
+
+        if self.smv_path is not None:
+            path = self.smv_path / self.smv_subdrc
+            for i in self.observed_range:
+                header = self.smv_header(i, self.headers[i], self.data_shape)
+                update_adsc_header(path / f'{i:05d}.img', header)
+
+        if self.cbf_path is not None:
+            for i in self.observed_range:
+                header = self.cbf_header(i, self.headers[i])
+                update_cbf_header(self.cbf_path / f'{i:05d}.cbf', header)
+
+        if self.nexus is not None:
+            self.set_nexus_geometry(self.nexus)
+
+        self.write_input_files()
+
+    def write_input_files(self) -> None:
+        """Write the input files for data processing."""
+        if self.smv_path is not None:
+            if self.write_dials:
+                self.to_dials(self.smv_path)
+            if self.write_xds or self.write_dials:
+                self.write_xds_inp(self.smv_path)
+        if self.mrc_path is not None and self.write_red:
+            self.write_ed3d(self.mrc_path)
+        if self.path is not None:
+            if self.write_pets:
+                self.write_pets_inp(self.path)
+            self.write_beam_centers(self.path)
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from .ImgConversion import *
+from .ImgConversionStream import ImgConversionStream
 
 
 class ImgConversionTPX(ImgConversion):
@@ -9,7 +10,9 @@ class ImgConversionTPX(ImgConversion):
 
     The image buffer is passed as a list of tuples, where each tuple
     contains the index (int), image data (2D numpy array),
-    metadata/header (dict). The buffer index must start at 1.
+    metadata/header (dict). The buffer index must start at 1. For long
+    data collections, a `FrameStore` can be passed instead to keep the
+    frames on disk.
     """
 
     def __init__(
@@ -31,9 +34,6 @@ class ImgConversionTPX(ImgConversion):
             flatfield, h = read_tiff(flatfield)
         self.flatfield = flatfield
 
-        self.headers = {}
-        self.data = {}
-
         self.smv_subdrc = 'data'
 
         self.untrusted_areas = [
@@ -41,21 +41,7 @@ class ImgConversionTPX(ImgConversion):
             ('rectangle', ((255, 0), (262, 517))),
         ]
 
-        while len(buffer) != 0:
-            i, img, h = buffer.pop(0)
-
-            self.headers[i] = h
-
-            if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
-            else:
-                self.data[i] = img
-
-        self.observed_range = set(self.data.keys())
-        self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
-        self.missing_range = self.observed_range ^ self.complete_range
-
-        self.data_shape = img.shape
+        self.load_buffer(buffer)
 
         self.pixelsize = pixelsize
         self.physical_pixelsize = physical_pixelsize
@@ -87,3 +73,27 @@ class ImgConversionTPX(ImgConversion):
         self.XDS_template = XDS_template
 
         self.check_settings()
+
+
+class ImgConversionTPXStream(ImgConversionStream):
+    """Variant of `ImgConversionTPX` that converts the frames while they are
+    being collected, see `ImgConversionStream`."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.untrusted_areas = [
+            ('rectangle', ((0, 255), (517, 262))),
+            ('rectangle', ((255, 0), (262, 517))),
+        ]
+
+        # Stretch correction parameters
+        self.stretch_azimuth = config.camera.stretch_azimuth
+        self.stretch_amplitude = config.camera.stretch_amplitude
+        self.do_stretch_correction = self.stretch_amplitude != 0
+
+        self.name = 'TimePix_SU'
+
+        from .XDS_templateTPX import XDS_template
+
+        self.XDS_template = XDS_template
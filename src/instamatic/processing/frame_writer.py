@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import logging
+import os
+import time
+from multiprocessing import shared_memory
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from instamatic.formats import write_adsc
+from instamatic.server.frame_pool import SharedFramePool
+
+from .ImgConversion import write_cbf_frame, write_mrc_frame, write_tiff_frame
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('thread', 'process')
+
+# Shared memory blocks opened by a worker process, by name
+_shms = {}
+
+
+def default_workers(nframes: int) -> int:
+    """Number of workers to write `nframes` frames, one per CPU."""
+    return max(1, min(os.cpu_count() or 1, nframes))
+
+
+def write_frame(i: int, img: np.ndarray, tasks: list) -> List[Tuple[str, float]]:
+    """Write image `img` with sequence number `i` in the formats given by
+    `tasks`, a list of `(fmt, path, header)` tuples.
+
+    Returns a list with the time in seconds spent on each format.
+    """
+    times = []
+    for fmt, path, header in tasks:
+        t0 = time.perf_counter()
+        if fmt == 'tiff':
+            write_tiff_frame(path, i, img, header)
+        elif fmt == 'mrc':
+            write_mrc_frame(path, i, img)
+        elif fmt == 'smv':
+            write_adsc(path / f'{i:05d}.img', np.ushort(img), header=header)
+        elif fmt == 'cbf':
+            write_cbf_frame(path, i, img, header)
+        else:
+            raise ValueError(f'Unknown format: `{fmt}`')
+        times.append((fmt, time.perf_counter() - t0))
+    return times
+
+
+def write_shared_frame(
+    i: int, name: str, shape: tuple, dtype: str, tasks: list, **kwargs
+) -> List[Tuple[str, float]]:
+    """Write the frame in shared memory block `name`, called in a worker
+    process."""
+    shm = _shms.get(name)
+    if shm is None:
+        shm = _shms[name] = shared_memory.SharedMemory(name=name)
+    img = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return write_frame(i, img, tasks)
+
+
+class WriterStats:
+    """Collects the time spent writing each format."""
+
+    def __init__(self, backend: str, workers: int):
+        self.backend = backend
+        self.workers = workers
+        self.frames = collections.Counter()
+        self.seconds = collections.Counter()
+        self.t_start = time.perf_counter()
+        self.t_end = None
+
+    def add(self, times: List[Tuple[str, float]]) -> None:
+        for fmt, seconds in times:
+            self.frames[fmt] += 1
+            self.seconds[fmt] += seconds
+
+    def stop(self) -> None:
+        self.t_end = time.perf_counter()
+
+    def report(self) -> dict:
+        """Return the number of frames, the total time spent by the workers,
+        and the throughput of each format.
+
+        `frames_per_s` is the throughput of a single worker, and
+        `wall_frames_per_s` the throughput of all workers together
+        (assuming that the formats share the wall time in proportion to
+        the worker time spent on them).
+        """
+        wall = (self.t_end or time.perf_counter()) - self.t_start
+        total = sum(self.seconds.values())
+
+        formats = {}
+        for fmt, n in self.frames.items():
+            seconds = self.seconds[fmt]
+            share = wall * seconds / total if total else 0.0
+            formats[fmt] = {
+                'frames': n,
+                'seconds': seconds,
+                'frames_per_s': n / seconds if seconds else 0.0,
+                'wall_frames_per_s': n / share if share else 0.0,
+            }
+
+        return {
+            'backend': self.backend,
+            'workers': self.workers,
+            'wall_time': wall,
+            'formats': formats,
+        }
+
+    def __str__(self):
+        report = self.report()
+        lines = [
+            f'Wrote data with {report["workers"]} {report["backend"]} workers in {report["wall_time"]:.2f} s'
+        ]
+        for fmt, stats in report['formats'].items():
+            lines.append(
+                f'  {fmt:5s} {stats["frames"]:6d} frames, '
+                f'{stats["frames_per_s"]:8.1f} frames/s per worker, '
+                f'{stats["wall_frames_per_s"]:8.1f} frames/s'
+            )
+        return '\n'.join(lines)
+
+
+def write_frames(
+    indices,
+    get_image: Callable,
+    get_tasks: Callable,
+    backend: str = 'thread',
+    workers: int = None,
+) -> WriterStats:
+    """Write the frames with sequence numbers `indices` in parallel.
+
+    get_image: function returning the image of frame `i`
+    get_tasks: function returning the list of `(fmt, path, header)`
+        tuples for frame `i` (see `write_frame`)
+    backend: `thread` to write the frames in a thread pool, or `process`
+        to use a process pool. The images are passed to the worker
+        processes through a ring of shared memory slots instead of being
+        pickled. With both backends, at most two images per worker are
+        in transit, so that `get_image` can read them from disk lazily.
+    workers: number of workers, one per CPU if None
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend: `{backend}`, must be one of {BACKENDS}')
+
+    indices = sorted(indices)
+    if workers is None:
+        workers = default_workers(len(indices))
+
+    stats = WriterStats(backend, workers)
+
+    if backend == 'process':
+        _write_frames_process(indices, get_image, get_tasks, workers, stats)
+    else:
+        _write_frames_thread(indices, get_image, get_tasks, workers, stats)
+
+    stats.stop()
+    logger.info(str(stats))
+    return stats
+
+
+def _write_frames_thread(indices, get_image, get_tasks, workers: int, stats: WriterStats):
+    pending = set()
+
+    def wait(return_when):
+        done, _ = concurrent.futures.wait(pending, return_when=return_when)
+        for future in done:
+            pending.remove(future)
+            stats.add(future.result())
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for i in indices:
+            if len(pending) >= 2 * workers:
+                wait(concurrent.futures.FIRST_COMPLETED)
+            pending.add(executor.submit(write_frame, i, get_image(i), get_tasks(i)))
+
+        wait(concurrent.futures.ALL_COMPLETED)
+
+
+def _write_frames_process(indices, get_image, get_tasks, workers: int, stats: WriterStats):
+    pool = SharedFramePool(n_slots=2 * workers)
+    pending = {}
+
+    def wait(return_when):
+        done, _ = concurrent.futures.wait(pending, return_when=return_when)
+        for future in done:
+            slot, seq = pending.pop(future)
+            pool.release(slot, seq)
+            stats.add(future.result())
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for i in indices:
+                img = np.ascontiguousarray(get_image(i))
+
+                frame = pool.put(img, hold=True)
+                while frame is None:
+                    wait(concurrent.futures.FIRST_COMPLETED)
+                    frame = pool.put(img, hold=True)
+
+                future = executor.submit(write_shared_frame, i, tasks=get_tasks(i), **frame)
+                pending[future] = (frame['slot'], frame['seq'])
+
+            wait(concurrent.futures.ALL_COMPLETED)
+    finally:
+        pool.close()
@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import collections
+import logging
+import os
+import tempfile
+import threading
+from collections.abc import MutableMapping
+from pathlib import Path
+
+import numpy as np
+
+from instamatic import config
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('memmap', 'hdf5')
+
+
+class FrameData(MutableMapping):
+    """Dict-like view of the frames in a `FrameStore`, indexed by frame
+    number."""
+
+    def __init__(self, store: 'FrameStore'):
+        self._store = store
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self._store.get(i)
+
+    def __setitem__(self, i: int, img: np.ndarray) -> None:
+        self._store.set(i, img)
+
+    def __delitem__(self, i: int) -> None:
+        self._store.delete(i)
+
+    def __iter__(self):
+        return iter(sorted(self._store.observed_range))
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __contains__(self, i) -> bool:
+        return i in self._store
+
+
+class FrameStore:
+    """Stores the frames of a data collection with bounded memory use.
+
+    The last `keep` frames are kept in memory, older frames are spilled
+    to a preallocated memory-mapped file (`backend='memmap'`) or to a
+    chunked HDF5 dataset (`backend='hdf5'`). The file is created at
+    `path`, or in the temporary directory if no path is given, and is
+    grown as needed starting from `capacity` frames. It is removed by
+    `close` unless `delete` is False.
+
+    The frames are accessed like the `data` and `headers` dicts of
+    `ImgConversion`: `store.data[i]` and `store.headers[i]`, with the
+    frame numbers in `store.observed_range`. All frames must have the
+    same shape, and are stored with the dtype of the first frame (or
+    `dtype`), rounding floats if it is an integer type.
+
+    Usage:
+        store = FrameStore()
+        for i in range(n):
+            img, h = ctrl.get_image(exposure)
+            store.append((i, img, h))
+        img_conv = ImgConversion(buffer=store, ...)
+        ...
+        store.close()
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        backend: str = 'memmap',
+        keep: int = 32,
+        capacity: int = 256,
+        dtype=None,
+        delete: bool = True,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(
+                f'Unknown frame store backend: `{backend}`, must be one of {BACKENDS}'
+            )
+
+        self.backend = backend
+        self.keep = keep
+        self.capacity = max(capacity, 1)
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+        self.shape = None
+        self._delete_file = delete
+
+        if path is None:
+            suffix = '.h5' if backend == 'hdf5' else '.dat'
+            fd, path = tempfile.mkstemp(prefix='instamatic_frames_', suffix=suffix)
+            os.close(fd)
+        self.path = Path(path)
+
+        self.data = FrameData(self)
+        self.headers = {}
+
+        self._hot = collections.OrderedDict()
+        self._slots = {}
+        self._n_slots = 0
+        self._file = None
+        self._dataset = None
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}(path={str(self.path)!r}, backend={self.backend!r}, '
+            f'frames={len(self)}, in_memory={len(self._hot)})'
+        )
+
+    def __len__(self) -> int:
+        return len(self._hot) + len(self._slots)
+
+    def __contains__(self, i) -> bool:
+        return i in self._hot or i in self._slots
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    @property
+    def observed_range(self) -> set:
+        """Set with the numbers of the stored frames."""
+        with self._lock:
+            return set(self._hot) | set(self._slots)
+
+    def append(self, item: tuple) -> None:
+        """Add a `(i, img, h)` tuple, like the image buffer lists."""
+        self.add(*item)
+
+    def add(self, i: int, img: np.ndarray, h: dict = None) -> None:
+        """Store frame `i` with image `img` and header `h`."""
+        self.set(i, img)
+        self.headers[i] = h if h is not None else {}
+
+    def get(self, i: int) -> np.ndarray:
+        """Return the image of frame `i`."""
+        with self._lock:
+            if i in self._hot:
+                return self._hot[i]
+            return np.asarray(self._dataset[self._slots[i]])
+
+    def set(self, i: int, img: np.ndarray) -> None:
+        """Store the image of frame `i`, replacing any existing image."""
+        img = self._convert(img)
+
+        with self._lock:
+            if i in self._slots:
+                self._write(self._slots[i], img)
+                return
+
+            self._hot[i] = img
+            self._hot.move_to_end(i)
+            while len(self._hot) > self.keep:
+                self._spill(*self._hot.popitem(last=False))
+
+    def delete(self, i: int) -> None:
+        """Remove the image of frame `i` (the space on disk is not
+        reused)."""
+        with self._lock:
+            if i in self._hot:
+                del self._hot[i]
+            else:
+                del self._slots[i]
+
+    def flush(self) -> None:
+        """Write the frames in memory to disk."""
+        with self._lock:
+            while self._hot:
+                self._spill(*self._hot.popitem(last=False))
+            if self._file is not None:
+                self._file.flush()
+            elif self._dataset is not None:
+                self._dataset.flush()
+
+    def close(self) -> None:
+        """Release the frames and the file on disk."""
+        with self._lock:
+            self._hot.clear()
+            self._slots.clear()
+            self.headers.clear()
+
+            dataset, self._dataset = self._dataset, None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            elif dataset is not None:
+                # unmap the file, so that it can be deleted on Windows
+                dataset.flush()
+                mmap = dataset._mmap
+                del dataset
+                try:
+                    mmap.close()
+                except BufferError:
+                    logger.debug('Frames of %s are still in use, not unmapped', self.path)
+
+            if self._delete_file:
+                try:
+                    self.path.unlink()
+                except OSError as e:
+                    logger.warning('Could not delete frame store %s: %s', self.path, e)
+
+    def _convert(self, img: np.ndarray) -> np.ndarray:
+        img = np.asarray(img)
+
+        if self.shape is None:
+            self.shape = img.shape
+            if self.dtype is None:
+                self.dtype = img.dtype
+        elif img.shape != self.shape:
+            raise ValueError(f'Frame shape {img.shape} does not match the store: {self.shape}')
+
+        if img.dtype == self.dtype:
+            return img
+        if np.issubdtype(self.dtype, np.integer) and not np.issubdtype(img.dtype, np.integer):
+            img = np.round(img)
+        return img.astype(self.dtype)
+
+    def _spill(self, i: int, img: np.ndarray) -> None:
+        """Move frame `i` to disk, the lock must be held."""
+        slot = self._n_slots
+        if slot >= self.capacity or self._dataset is None:
+            self._allocate(max(self.capacity, slot + 1))
+        self._n_slots += 1
+        self._slots[i] = slot
+        self._write(slot, img)
+
+    def _write(self, slot: int, img: np.ndarray) -> None:
+        self._dataset[slot] = img
+
+    def _allocate(self, capacity: int) -> None:
+        """Create the file for `capacity` frames, or grow it to twice its
+        size."""
+        if self._dataset is not None:
+            capacity = max(capacity, 2 * self.capacity)
+
+        shape = (capacity, *self.shape)
+
+        if self.backend == 'hdf5':
+            import h5py
+
+            if self._file is None:
+                self._file = h5py.File(self.path, 'w')
+                self._dataset = self._file.create_dataset(
+                    'data',
+                    shape=shape,
+                    maxshape=(None, *self.shape),
+                    chunks=(1, *self.shape),
+                    dtype=self.dtype,
+                )
+            else:
+                self._dataset.resize(shape)
+        else:
+            mode = 'w+' if self._dataset is None else 'r+'
+            if self._dataset is not None:
+                self._dataset.flush()
+            # numpy extends the file if it is too small for `shape`, views of
+            # the previous map remain valid
+            self._dataset = np.memmap(self.path, dtype=self.dtype, mode=mode, shape=shape)
+
+        logger.debug('Allocated %d frames in %s', capacity, self.path)
+        self.capacity = capacity
+
+
+def get_frame_buffer(drc: str = None):
+    """Return an empty buffer for the frames of a data collection.
+
+    This is a list, or a `FrameStore` spilling to a file in `drc` (or
+    the temporary directory) if the `frame_store` setting is `memmap`
+    or `hdf5`. Use `release_frame_buffer` to free it.
+    """
+    backend = config.settings.frame_store
+    if backend in (None, 'memory'):
+        return []
+
+    path = None
+    if drc is not None:
+        path = Path(drc) / ('frames.h5' if backend == 'hdf5' else 'frames.dat')
+
+    return FrameStore(path=path, backend=backend, keep=config.settings.frame_store_keep)
+
+
+def release_frame_buffer(buffer) -> None:
+    """Free the frames in a buffer from `get_frame_buffer`."""
+    if isinstance(buffer, FrameStore):
+        buffer.close()
+    else:
+        buffer.clear()
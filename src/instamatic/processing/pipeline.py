@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class FramePipeline:
+    """Processes frames in background threads while they are being acquired.
+
+    Frames are put on a bounded queue by the acquisition loop (`put`),
+    and passed through each of the `stages` in order. A stage is a
+    callable that takes the item from the previous stage and returns the
+    item for the next one, or None to drop it. Stages can be given as
+    `(func, workers)` to process several frames concurrently, otherwise
+    one thread is used per stage. The queues between the stages are
+    bounded as well, so a slow stage eventually blocks `put` instead of
+    accumulating frames in memory.
+
+    Exceptions in a stage are logged, the failing frame is dropped and
+    the exception is raised again by `close`, which waits for all
+    frames to be processed and returns the items from the last stage.
+
+    Usage:
+        pipeline = FramePipeline(correct, (find_center, 2), write)
+        for i in range(n):
+            pipeline.put((i, img, h))
+        results = pipeline.close()
+    """
+
+    def __init__(self, *stages, maxsize: int = 32, name: str = 'FramePipeline'):
+        if not stages:
+            raise ValueError('The pipeline needs at least one stage')
+
+        self.name = name
+        self.results = []
+        self.errors = []
+        self.n_put = 0
+
+        self._queues = [queue.Queue(maxsize=maxsize) for _ in stages]
+        self._queues.append(None)  # the last stage collects the results
+        self._threads = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+        for n, stage in enumerate(stages):
+            func, workers = stage if isinstance(stage, tuple) else (stage, 1)
+            remaining = [workers]  # workers of this stage still running
+            for k in range(workers):
+                t = threading.Thread(
+                    target=self._run_stage,
+                    args=(func, n, remaining),
+                    name=f'{name}-{n}-{k}',
+                    daemon=True,
+                )
+                t.start()
+                self._threads.append(t)
+
+    def put(self, item) -> None:
+        """Add `item` to the pipeline, blocks if the first queue is full."""
+        if self._closed:
+            raise RuntimeError('Cannot add items to a closed pipeline')
+        self._queues[0].put(item)
+        self.n_put += 1
+
+    def close(self) -> List:
+        """Wait until all items have been processed and return the items from
+        the last stage (in order of completion)."""
+        if not self._closed:
+            self._closed = True
+            self._queues[0].put(_DONE)
+
+        for t in self._threads:
+            t.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+        return self.results
+
+    def _run_stage(self, func: Callable, n: int, remaining: list) -> None:
+        q_in = self._queues[n]
+        q_out = self._queues[n + 1]
+
+        while True:
+            item = q_in.get()
+            if item is _DONE:
+                # pass the sentinel on to the other workers of this stage
+                q_in.put(_DONE)
+                break
+
+            try:
+                item = func(item)
+            except Exception as e:
+                logger.exception('Error in stage %d of %s', n, self.name)
+                with self._lock:
+                    self.errors.append(e)
+                continue
+
+            if item is None:
+                continue
+
+            if q_out is None:
+                with self._lock:
+                    self.results.append(item)
+            else:
+                q_out.put(item)
+
+        with self._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+
+        if last and q_out is not None:
+            q_out.put(_DONE)
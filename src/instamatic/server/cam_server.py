@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import atexit
 import datetime
 import logging
 import pickle
@@ -12,17 +13,12 @@ import numpy as np
 
 from instamatic import config
 from instamatic.camera import Camera
-from instamatic.utils import high_precision_timers
 
+from .dispatcher import STREAM_DONE, STREAM_FRAME, Dispatcher, handle_connection, serve
 from .serializer import dumper, loader
 
-high_precision_timers.enable()
-
 if config.settings.cam_use_shared_memory:
-    from multiprocessing import shared_memory
-
-condition = threading.Condition()
-box = []
+    from .frame_pool import SharedFramePool
 
 HOST = config.settings.cam_server_host
 PORT = config.settings.cam_server_port
@@ -31,15 +27,19 @@ BUFSIZE = 4096
 
 is_local_connection = HOST in ('127.0.0.1', 'localhost')
 
+# Internal request sent when a client disconnects, releases its slots
+RELEASE_CLIENT = '__release_client__'
+
 
 class CamServer(threading.Thread):
     """Camera communcation server.
 
-    Takes a logger object `log`, command queue `q`, and name of the
-    camera `name` that is used to initialize the connection to the
+    Takes a logger object `log`, request dispatcher `q`, and name of
+    the camera `name` that is used to initialize the connection to the
     camera. Start the server using `CamServer.run` which will wait for
-    items to appear on `q` and execute them on the specified camera
-    instance.
+    requests to appear on `q` and execute them on the specified camera
+    instance. The response of each request is set on its own future, see
+    `Dispatcher`.
     """
 
     def __init__(self, log=None, q=None, name=None):
@@ -55,29 +55,29 @@ class CamServer(threading.Thread):
 
         self.verbose = False
 
-        self.buffers = {}
-
         self.use_shared_memory = config.settings.cam_use_shared_memory
         print('Use shared memory:', self.use_shared_memory)
 
-    def setup_shared_buffer(self, arr):
-        """Set up shared memory buffer.
+        if self.use_shared_memory:
+            self.frame_pool = SharedFramePool(n_slots=config.settings.cam_shared_memory_slots)
+            atexit.register(self.frame_pool.close)
 
-        Make a buffer for each binsize, and store the buffers to a dict.
-        """
-        self.shmem = shared_memory.SharedMemory(create=True, size=arr.nbytes)
-        buffer = np.ndarray(arr.shape, dtype=arr.dtype, buffer=self.shmem.buf)
-        self.buffers[arr.shape] = buffer
-        if self.verbose:
-            print(f'Created new buffer: `{self.shmem.name}` | {arr.shape} ({arr.dtype})')
+        # `(slot, seq)` of the shared memory slots held by each client
+        self._held = {}
 
-    def copy_data_to_shared_buffer(self, arr):
-        """Copy numpy image array to shared memory."""
-        if arr.shape not in self.buffers:
-            self.setup_shared_buffer(arr)
+    def copy_data_to_shared_buffer(self, arr, hold: bool = False):
+        """Copy numpy image array to the next free slot in shared memory.
 
-        buffer = self.buffers[arr.shape]
-        buffer[:] = arr[:]  # copy data to buffer
+        If `hold` is True, the slot is kept until the client releases
+        it. Returns a dict describing the slot, or None if all slots are
+        held.
+        """
+        info = self.frame_pool.put(arr, hold=hold)
+        if self.verbose and info:
+            print(
+                f'Copied frame {info["seq"]} to buffer `{info["name"]}` (slot {info["slot"]})'
+            )
+        return info
 
     def run(self):
         """Start server thread."""
@@ -89,36 +89,79 @@ class CamServer(threading.Thread):
         while True:
             now = datetime.datetime.now().strftime('%H:%M:%S.%f')
 
-            cmd = self.q.get()
-
-            with condition:
-                attr_name = cmd['attr_name']
-                args = cmd.get('args', ())
-                kwargs = cmd.get('kwargs', {})
-
-                try:
-                    ret = self.evaluate(attr_name, args, kwargs)
-                    status = 200
-                except Exception as e:
-                    traceback.print_exc()
-                    if self.log:
-                        self.log.exception(e)
-                    ret = (e.__class__.__name__, e.args)
-                    status = 500
-                else:
-                    if self.use_shared_memory:
-                        if attr_name == 'get_image':
-                            self.copy_data_to_shared_buffer(ret)
-                            ret = {
-                                'shape': ret.shape,
-                                'dtype': str(ret.dtype),
-                                'name': self.shmem.name,
-                            }
-
-                box.append((status, ret))
-                condition.notify()
-                if self.verbose:
-                    print(f'{now} | {status} {attr_name}: {ret}')
+            request = self.q.get()
+            cmd = request.cmd
+
+            attr_name = cmd['attr_name']
+            args = cmd.get('args', ())
+            kwargs = cmd.get('kwargs', {})
+
+            if self.use_shared_memory:
+                self.release_slots(request.client, cmd.get('release', ()))
+
+            if attr_name == RELEASE_CLIENT:
+                # the client disconnected, its slots are no longer used
+                n = self.release_slots(request.client, self._held.pop(request.client, ()))
+                self.q.complete(request, 200, n)
+                continue
+
+            # set by `handle_connection` for requests that stream their results
+            frames = cmd.get('frames')
+
+            try:
+                ret = self.evaluate(attr_name, args, kwargs)
+                if frames is not None:
+                    ret = self.stream(ret, frames)
+                status = 200
+            except Exception as e:
+                traceback.print_exc()
+                if self.log:
+                    self.log.exception(e)
+                ret = (e.__class__.__name__, e.args)
+                status = 500
+            else:
+                # `shm`: slot is overwritten later (legacy clients)
+                # `ring`: slot is kept until the client releases it
+                # `raw`: clients on a different machine
+                transport = cmd.get('transport', 'shm')
+                if self.use_shared_memory and transport in ('shm', 'ring'):
+                    if attr_name == 'get_image':
+                        hold = transport == 'ring'
+                        info = self.copy_data_to_shared_buffer(ret, hold=hold)
+                        if info is not None:
+                            if hold:
+                                held = self._held.setdefault(request.client, set())
+                                held.add((info['slot'], info['seq']))
+                            ret = info
+
+            if frames is not None:
+                frames.put((STREAM_DONE, None))
+            self.q.complete(request, status, ret)
+            if self.verbose:
+                print(f'{now} | {status} {attr_name}: {ret}')
+
+    def release_slots(self, client: str, items) -> int:
+        """Release the `(slot, seq)` pairs in `items` held by `client`,
+        returns the number of slots released."""
+        items = [tuple(item) for item in items]
+        held = self._held.get(client)
+        if held is not None:
+            held.difference_update(items)
+        if not self.use_shared_memory:
+            return 0
+        return self.frame_pool.release_many(items)
+
+    def stream(self, items, frames: queue.Queue) -> int:
+        """Put the frames from the iterable `items` on the `frames` queue as
+        they arrive, returns the number of frames.
+
+        The queue is bounded, so this blocks if the client falls behind.
+        """
+        n = 0
+        for item in items:
+            frames.put((STREAM_FRAME, item))
+            n += 1
+        return n
 
     def evaluate(self, attr_name: str, args: list, kwargs: dict):
         """Evaluate the function or attribute `attr_name` on `self.cam`, if
@@ -144,28 +187,36 @@ class CamServer(threading.Thread):
         return attrs
 
 
-def handle(conn, q):
-    """Handle incoming connection, put command on the Queue `q`, which is then
-    handled by TEMServer."""
-    with conn:
-        while True:
-            data = conn.recv(BUFSIZE)
-            if not data:
-                break
-
-            data = loader(data)
+def send_response(connection, response, msg_id: int, codec: int) -> None:
+    """Send `response` to the client, image data are sent as raw frames over
+    framed connections to skip serialization."""
+    status, ret = response
+    if connection.framed and status == 200 and isinstance(ret, np.ndarray):
+        connection.reply_array(ret, msg_id=msg_id)
+    else:
+        connection.reply(response, msg_id=msg_id, codec=codec)
 
-            if data == 'exit':
-                break
 
-            if data == 'kill':
-                break
+def handle(conn, q, addr=None):
+    """Handle incoming connection, submit each command to the dispatcher `q`,
+    which is then handled by CamServer.
 
-            with condition:
-                q.put(data)
-                condition.wait()
-                response = box.pop()
-                conn.sendall(dumper(response))
+    When the client disconnects, the shared memory slots it still holds
+    are released.
+    """
+    client = str(addr) if addr is not None else f'{id(conn):x}'
+    handle_connection(
+        conn,
+        q,
+        key='attr_name',
+        loader=loader,
+        dumper=dumper,
+        bufsize=BUFSIZE,
+        reply=send_response,
+        client=client,
+        stream=True,
+        on_close=lambda: q.submit({'attr_name': RELEASE_CLIENT}, client=client),
+    )
 
 
 def main():
@@ -185,6 +236,12 @@ The data sent over the socket is a pickled dictionary with the following element
 - `kwargs`: (Optiona) Dictionary of keyword arguments for the function (dict)
 
 The response is returned as a pickle object.
+
+Clients can switch the connection to length-prefixed frames by sending a `__negotiate__` request. Each frame starts with a fixed header containing the payload length, a message id, and the serializer used, so that large responses are never truncated. Over a framed connection, images are sent as raw array data (dtype/shape header followed by the image bytes) unless they are passed via shared memory. Shared memory frames are written to a ring of `cam_shared_memory_slots` slots. Clients can ask to keep a slot until they release it (by passing `release=[(slot, seq), ...]` with a later request), so that frames are not overwritten while they are in use. Slots that a client still holds when it disconnects are released.
+
+Requests with `stream=True` (e.g. `iter_movie`) send each image as a separate raw frame as soon as it is acquired, followed by the final response.
+
+Any number of clients can connect at the same time, each response is routed back to the connection that sent the request. Send `attr_name='__metrics__'` to get statistics on the request queue (e.g. queue depth and mean waiting time).
 """
 
     parser = argparse.ArgumentParser(
@@ -209,24 +266,16 @@ The response is returned as a pickle object.
     logging.captureWarnings(True)
     log = logging.getLogger(__name__)
 
-    q = queue.Queue(maxsize=100)
+    from instamatic.utils import high_precision_timers
 
-    cam_reader = CamServer(name=camera, log=log, q=q)
-    cam_reader.start()
+    high_precision_timers.enable()  # sleep timers with 1 ms resolution
 
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.bind((HOST, PORT))
-    s.listen(5)
+    q = Dispatcher(maxsize=100)
 
-    log.info(f'Server listening on {HOST}:{PORT}')
-    print(f'Server listening on {HOST}:{PORT}')
+    cam_reader = CamServer(name=camera, log=log, q=q)
+    cam_reader.start()
 
-    with s:
-        while True:
-            conn, addr = s.accept()
-            log.info('Connected by %s', addr)
-            print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn, q)).start()
+    serve(HOST, PORT, lambda conn, addr: handle(conn, q, addr), log=log)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import itertools
+import queue
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+from .protocol import METRICS, ServerConnection
+
+# Items on the `frames` queue of a streaming request
+STREAM_FRAME = 'frame'
+STREAM_DONE = 'done'
+
+# Number of frames a streaming request can run ahead of the client
+STREAM_BUFFER = 8
+
+
+class Request:
+    """Request from a client waiting to be evaluated by the device thread."""
+
+    __slots__ = ('request_id', 'cmd', 'future', 'client', 't_submit', 't_start')
+
+    def __init__(self, request_id: int, cmd: dict, client: str = None):
+        self.request_id = request_id
+        self.cmd = cmd
+        self.client = client
+        self.future = Future()
+        self.t_submit = time.perf_counter()
+        self.t_start = None
+
+
+class Dispatcher:
+    """Passes requests from any number of client connections to the single
+    thread that talks to the device (microscope or camera).
+
+    Every request gets a unique id and its own future, which is completed
+    by the device thread with the `(status, ret)` response. The
+    connection handler waits on its own futures only, so concurrent
+    clients never receive each other's responses.
+
+    Use `submit` on the connection side, and `get`/`complete` on the
+    device side. `metrics` returns statistics on the queue depth and
+    the time requests spend waiting and being evaluated.
+    """
+
+    def __init__(self, maxsize: int = 100):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        self.pending = {}
+
+        self._n_clients = 0
+        self._n_submitted = 0
+        self._n_completed = 0
+        self._max_depth = 0
+        self._wait_time = 0.0
+        self._service_time = 0.0
+
+    def submit(self, cmd: dict, client: str = None) -> Future:
+        """Queue `cmd` for evaluation, returns a future that holds the
+        `(status, ret)` response."""
+        request = Request(next(self._ids), cmd, client=client)
+        request.future.request_id = request.request_id
+
+        with self._lock:
+            self.pending[request.request_id] = request
+            self._n_submitted += 1
+
+        self._queue.put(request)
+
+        with self._lock:
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+
+        return request.future
+
+    def get(self, timeout: float = None) -> Request:
+        """Return the next request, called by the device thread."""
+        request = self._queue.get(timeout=timeout)
+        request.t_start = time.perf_counter()
+        return request
+
+    def complete(self, request: Request, status: int, ret) -> None:
+        """Set the response of `request`, called by the device thread."""
+        now = time.perf_counter()
+
+        with self._lock:
+            self.pending.pop(request.request_id, None)
+            self._n_completed += 1
+            self._wait_time += request.t_start - request.t_submit
+            self._service_time += now - request.t_start
+
+        request.future.set_result((status, ret))
+
+    def add_client(self) -> None:
+        with self._lock:
+            self._n_clients += 1
+
+    def remove_client(self) -> None:
+        with self._lock:
+            self._n_clients -= 1
+
+    def metrics(self) -> dict:
+        """Return statistics on the requests handled so far."""
+        with self._lock:
+            n = max(self._n_completed, 1)
+            return {
+                'clients': self._n_clients,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_depth,
+                'pending': len(self.pending),
+                'submitted': self._n_submitted,
+                'completed': self._n_completed,
+                'mean_wait_ms': 1000 * self._wait_time / n,
+                'mean_service_ms': 1000 * self._service_time / n,
+            }
+
+
+def send_response(connection: ServerConnection, response, msg_id: int, codec: int) -> None:
+    """Default way of sending a response to the client."""
+    connection.reply(response, msg_id=msg_id, codec=codec)
+
+
+def _write_responses(connection: ServerConnection, responses: queue.Queue, reply: Callable):
+    """Send the responses to the client in the order of the requests.
+
+    Streaming requests (with a `frames` queue) send each frame as it
+    arrives. After a send fails, the remaining responses and frames are
+    still consumed, so that the device thread never blocks on a
+    disconnected client.
+    """
+    connected = True
+
+    while True:
+        item = responses.get()
+        if item is None:
+            break
+
+        msg_id, codec, data, future = item
+
+        frames = data.get('frames') if isinstance(data, dict) else None
+        if frames is not None:
+            while True:
+                kind, frame = frames.get()
+                if kind == STREAM_DONE:
+                    break
+                if connected:
+                    try:
+                        connection.reply_array(frame, more=True, msg_id=msg_id)
+                    except OSError:
+                        connected = False
+
+        response = future.result()
+
+        if connected:
+            try:
+                reply(connection, response, msg_id, codec)
+            except OSError:
+                connected = False
+
+
+def handle_connection(
+    conn: socket.socket,
+    dispatcher: Dispatcher,
+    *,
+    key: str,
+    loader,
+    dumper,
+    bufsize: int,
+    reply: Callable = send_response,
+    client: str = None,
+    stream: bool = False,
+    on_close: Callable = None,
+) -> None:
+    """Read requests from `conn` and submit them to `dispatcher`.
+
+    Requests are read in this thread and the responses are written by a
+    separate thread in the order of the requests, so clients can send
+    several framed requests without waiting for the responses. `key` is
+    the name of the field with the function name (`func_name` or
+    `attr_name`), and `reply` is called to send each response. If
+    `stream` is True, framed requests with `stream=True` get a `frames`
+    queue for sending their results one at a time. `on_close` is called
+    once the connection has been closed, e.g. to free resources held for
+    the client.
+    """
+    connection = ServerConnection(conn, key=key, loader=loader, dumper=dumper, bufsize=bufsize)
+    responses = queue.Queue()
+
+    writer = threading.Thread(
+        target=_write_responses, args=(connection, responses, reply), daemon=True
+    )
+    writer.start()
+    dispatcher.add_client()
+
+    try:
+        while True:
+            try:
+                data = connection.receive()
+            except OSError:
+                break
+
+            if data is None:
+                break
+
+            if data == 'exit':
+                break
+
+            if data == 'kill':
+                break
+
+            if isinstance(data, dict) and data.get(key) == METRICS:
+                future = Future()
+                future.set_result((200, dispatcher.metrics()))
+            else:
+                if (
+                    stream
+                    and connection.framed
+                    and isinstance(data, dict)
+                    and data.get('stream')
+                ):
+                    data['frames'] = queue.Queue(maxsize=STREAM_BUFFER)
+                future = dispatcher.submit(data, client=client)
+
+            # the reader may receive the next request before this one is
+            # answered, so the id and codec are passed on with the response
+            responses.put((connection.msg_id, connection.codec, data, future))
+    finally:
+        responses.put(None)
+        writer.join()
+        dispatcher.remove_client()
+        conn.close()
+        if on_close is not None:
+            on_close()
+
+
+def serve(
+    host: str,
+    port: int,
+    handler: Callable,
+    *,
+    log=None,
+    stop: threading.Event = None,
+    ready: Callable = None,
+) -> None:
+    """Accept connections on `host`:`port` and start `handler(conn, addr)` in
+    a new thread for each of them.
+
+    Runs until `stop` is set. `ready` is called with the bound
+    listening socket once the server accepts connections.
+    """
+    if stop is None:
+        stop = threading.Event()
+
+    sel = selectors.DefaultSelector()
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind((host, port))
+    s.listen(5)
+    s.setblocking(False)
+    sel.register(s, selectors.EVENT_READ)
+
+    if log:
+        log.info(f'Server listening on {host}:{port}')
+    print(f'Server listening on {host}:{port}')
+
+    if ready:
+        ready(s)
+
+    with s, sel:
+        while not stop.is_set():
+            for _ in sel.select(timeout=0.5):
+                try:
+                    conn, addr = s.accept()
+                except BlockingIOError:
+                    continue
+
+                # may inherit the non-blocking mode of the listening socket
+                conn.setblocking(True)
+                if log:
+                    log.info('Connected by %s', addr)
+                print('Connected by', addr)
+                threading.Thread(target=handler, args=(conn, addr), daemon=True).start()
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import weakref
+from multiprocessing import shared_memory
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+
+class _Slot:
+    """Single frame in the shared memory ring."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.shm = None
+        self.shape = None
+        self.dtype = None
+        self.seq = 0
+        self.held = False
+
+    def allocate(self, shape: tuple, dtype: np.dtype) -> None:
+        """(Re)create the shared memory block for frames of `shape` and
+        `dtype`."""
+        self.close()
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.shape = shape
+        self.dtype = dtype
+
+    def close(self) -> None:
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class SharedFramePool:
+    """Ring of shared memory slots to pass images from the camera server to
+    clients on the same computer.
+
+    Each call to `put` copies a frame into the next free slot and returns
+    a description of the slot, including a sequence number that
+    identifies the frame. If `hold` is True, the slot is not reused
+    until the client releases it with `release(slot, seq)`, so the
+    client can use the data without copying it while the server fills
+    the next slot. If no slot is free, `put` returns None and the frame
+    must be sent some other way.
+
+    Slots are allocated on first use and re-allocated (with a new name)
+    when the shape or dtype of the frames changes, e.g. with binning.
+    """
+
+    def __init__(self, n_slots: int = 4):
+        if n_slots < 1:
+            raise ValueError('The frame pool needs at least 1 slot')
+
+        self.n_slots = n_slots
+        self._slots = [_Slot(i) for i in range(n_slots)]
+        self._next = 0
+        self._seq = 0
+
+    def __len__(self):
+        return self.n_slots
+
+    @property
+    def n_held(self) -> int:
+        """Number of slots waiting to be released by the client."""
+        return sum(slot.held for slot in self._slots)
+
+    def _next_free_slot(self) -> Optional[_Slot]:
+        for offset in range(self.n_slots):
+            slot = self._slots[(self._next + offset) % self.n_slots]
+            if not slot.held:
+                return slot
+        return None
+
+    def put(self, arr: np.ndarray, hold: bool = True) -> Optional[dict]:
+        """Copy `arr` into the next free slot.
+
+        Returns a dict with the `name`, `shape`, `dtype`, `slot`, and
+        `seq` of the frame, or None if all slots are held.
+        """
+        slot = self._next_free_slot()
+        if slot is None:
+            return None
+
+        if slot.shape != arr.shape or slot.dtype != arr.dtype:
+            slot.allocate(arr.shape, arr.dtype)
+
+        buffer = np.ndarray(arr.shape, dtype=arr.dtype, buffer=slot.shm.buf)
+        buffer[:] = arr[:]  # copy data to buffer
+
+        self._seq += 1
+        slot.seq = self._seq
+        slot.held = hold
+        self._next = (slot.index + 1) % self.n_slots
+
+        return {
+            'shape': arr.shape,
+            'dtype': str(arr.dtype),
+            'name': slot.shm.name,
+            'slot': slot.index,
+            'seq': slot.seq,
+        }
+
+    def release(self, slot: int, seq: int) -> bool:
+        """Release `slot` so that it can be reused.
+
+        `seq` must match the sequence number of the frame in the slot,
+        stale releases are ignored. Returns True if the slot was
+        released.
+        """
+        try:
+            item = self._slots[slot]
+        except (IndexError, TypeError):
+            return False
+
+        if item.seq != seq or not item.held:
+            return False
+
+        item.held = False
+        return True
+
+    def release_many(self, items: Iterable[Tuple[int, int]]) -> int:
+        """Release all `(slot, seq)` pairs in `items`, returns the number of
+        slots released."""
+        return sum(self.release(slot, seq) for slot, seq in items)
+
+    def close(self) -> None:
+        """Free all shared memory blocks."""
+        for slot in self._slots:
+            slot.close()
+            slot.held = False
+
+
+class SharedFrame:
+    """Owner of a frame in a shared memory slot on the client side.
+
+    Numpy arrays created from this object (and all views derived from
+    them) point directly into the shared memory block. The slot is
+    released when `release` is called or when the last array referring
+    to it has been garbage collected, whichever comes first.
+    """
+
+    def __init__(self, shm, shape: tuple, dtype: str, slot: int, seq: int, on_release):
+        # Store the address instead of exporting the buffer, so that the
+        # shared memory block can be closed independently. The reference
+        # to `shm` keeps the mapping open while any array points into it,
+        # also after the client has moved on to a re-allocated slot.
+        address = np.frombuffer(shm.buf, dtype=np.uint8).ctypes.data
+        self._shm = shm
+        self.__array_interface__ = {
+            'data': (address, False),
+            'shape': tuple(shape),
+            'typestr': np.dtype(dtype).str,
+            'version': 3,
+        }
+        self.slot = slot
+        self.seq = seq
+        self._finalizer = weakref.finalize(self, on_release, slot, seq)
+
+    @property
+    def released(self) -> bool:
+        return not self._finalizer.alive
+
+    def release(self) -> None:
+        """Release the slot; arrays pointing into it must no longer be used."""
+        self._finalizer()
+
+    @classmethod
+    def from_array(cls, arr: np.ndarray) -> Optional['SharedFrame']:
+        """Return the `SharedFrame` that owns the data of `arr`, if any."""
+        base = arr
+        while isinstance(base, np.ndarray):
+            base = base.base
+        return base if isinstance(base, cls) else None
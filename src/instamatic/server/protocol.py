@@ -0,0 +1,559 @@
+from __future__ import annotations
+
+import asyncio
+import socket
+import struct
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from instamatic.exceptions import TEMCommunicationError, exception_list
+
+from .serializer import CODEC_RAW, dumps, loads
+
+# Framed messages start with a fixed-size header:
+#
+# - magic (4 bytes): `b'IMTC'`
+# - version (uint8): protocol version
+# - codec (uint8): serializer used for the payload, see `serializer.CODECS`
+# - flags (uint16): reserved for message-specific options
+# - msg_id (uint32): message id, the server echoes the id of the request
+# - length (uint64): number of payload bytes following the header
+#
+# All fields are in network byte order.
+MAGIC = b'IMTC'
+VERSION = 1
+HEADER = struct.Struct('!4sBBHIQ')
+HEADER_SIZE = HEADER.size
+
+# Name of the request a client sends (in the legacy format) to switch the
+# connection to framed messages. Old servers do not know this attribute and
+# respond with an error, in which case the client keeps using the legacy format.
+NEGOTIATE = '__negotiate__'
+
+# Name of the request that returns the request metrics of the server, it is
+# answered by the connection handler without waiting for the device.
+METRICS = '__metrics__'
+
+# Name of the request that evaluates a list of calls in a single round trip,
+# its only argument is a list of dicts with `func_name`, `args`, and `kwargs`.
+BATCH = '__batch__'
+
+# Flag set on frames that are followed by more responses to the same request,
+# e.g. the individual images of a streamed movie.
+FLAG_MORE = 0x1
+
+# Arrays are sent as raw frames (codec `CODEC_RAW`), the payload starts with
+# the dtype string (16 bytes, e.g. `<u2`), the number of dimensions (uint8),
+# and the shape (3 x uint64, unused dimensions are 0), followed by the data.
+ARRAY_HEADER = struct.Struct('!16sB3Q')
+ARRAY_HEADER_SIZE = ARRAY_HEADER.size
+MAX_ARRAY_NDIM = 3
+
+# Payloads below this size are sent in the same call as the header to avoid
+# the delayed-ack penalty of two small consecutive writes.
+_COALESCE_LIMIT = 65536
+
+
+class ProtocolError(TEMCommunicationError):
+    pass
+
+
+class FrameHeader(NamedTuple):
+    version: int
+    codec: int
+    flags: int
+    msg_id: int
+    length: int
+
+
+def recv_into_exactly(sock: socket.socket, buf) -> int:
+    """Fill the writable buffer `buf` with data from `sock`.
+
+    Returns the number of bytes received, which is only less than the
+    size of `buf` if the connection was closed before any data arrived
+    (0). Raises `ConnectionError` if the connection is closed halfway.
+    """
+    view = memoryview(buf).cast('B')
+    size = view.nbytes
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            if received == 0:
+                return 0
+            raise ConnectionError(
+                f'Connection closed after {received} of {size} bytes were received'
+            )
+        received += n
+    return received
+
+
+def recv_exactly(sock: socket.socket, size: int) -> Optional[bytearray]:
+    """Receive exactly `size` bytes from `sock`.
+
+    Returns None if the connection was closed before any data arrived.
+    """
+    buf = bytearray(size)
+    if size and not recv_into_exactly(sock, buf):
+        return None
+    return buf
+
+
+def recv_header(sock: socket.socket) -> Optional[FrameHeader]:
+    """Receive and parse the header of the next frame.
+
+    Returns None if the connection was closed.
+    """
+    data = recv_exactly(sock, HEADER_SIZE)
+    if data is None:
+        return None
+
+    magic, *fields = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ProtocolError(f'Invalid frame header: {bytes(data)!r}')
+
+    header = FrameHeader(*fields)
+    if header.version > VERSION:
+        raise ProtocolError(f'Unsupported protocol version: {header.version}')
+
+    return header
+
+
+def send_frame(
+    sock: socket.socket,
+    payload,
+    *,
+    codec: int,
+    msg_id: int = 0,
+    flags: int = 0,
+) -> None:
+    """Send `payload` (bytes-like) as a single frame over `sock`."""
+    payload = memoryview(payload).cast('B')
+    header = HEADER.pack(MAGIC, VERSION, codec, flags, msg_id, payload.nbytes)
+    if payload.nbytes < _COALESCE_LIMIT:
+        sock.sendall(header + payload)
+    else:
+        sock.sendall(header)
+        sock.sendall(payload)
+
+
+def recv_frame(sock: socket.socket) -> Optional[Tuple[FrameHeader, bytearray]]:
+    """Receive a single frame from `sock`.
+
+    Returns a tuple with the header and the payload, or None if the
+    connection was closed.
+    """
+    header = recv_header(sock)
+    if header is None:
+        return None
+
+    payload = recv_exactly(sock, header.length)
+    if payload is None:
+        raise ConnectionError('Connection closed before the payload was received')
+
+    return header, payload
+
+
+def send_message(sock: socket.socket, obj, *, codec: int, msg_id: int = 0) -> None:
+    """Serialize `obj` with `codec` and send it as a single frame."""
+    send_frame(sock, dumps(obj, codec), codec=codec, msg_id=msg_id)
+
+
+def recv_message(sock: socket.socket) -> Optional[Tuple[FrameHeader, object]]:
+    """Receive a single frame and deserialize its payload.
+
+    Returns a tuple with the header and the object, or None if the
+    connection was closed.
+    """
+    frame = recv_frame(sock)
+    if frame is None:
+        return None
+
+    header, payload = frame
+    return header, loads(payload, header.codec)
+
+
+def send_array(
+    sock: socket.socket, arr: np.ndarray, *, msg_id: int = 0, flags: int = 0
+) -> None:
+    """Send the numpy array `arr` as a raw frame without serializing it."""
+    arr = np.ascontiguousarray(arr)
+    if arr.ndim > MAX_ARRAY_NDIM:
+        raise ValueError(f'Cannot send arrays with more than {MAX_ARRAY_NDIM} dimensions')
+
+    shape = arr.shape + (0,) * (MAX_ARRAY_NDIM - arr.ndim)
+    meta = ARRAY_HEADER.pack(arr.dtype.str.encode(), arr.ndim, *shape)
+    header = HEADER.pack(MAGIC, VERSION, CODEC_RAW, flags, msg_id, len(meta) + arr.nbytes)
+
+    sock.sendall(header + meta)
+    if arr.nbytes:
+        sock.sendall(memoryview(arr).cast('B'))
+
+
+def _unpack_array_header(header: FrameHeader, meta) -> Tuple[np.dtype, tuple]:
+    """Return the dtype and shape of the array in the raw frame described by
+    `header`, `meta` are the first `ARRAY_HEADER_SIZE` bytes of the
+    payload."""
+    dtype, ndim, *shape = ARRAY_HEADER.unpack(meta)
+    dtype = np.dtype(dtype.rstrip(b'\x00').decode())
+    shape = tuple(shape[:ndim])
+
+    if header.length != ARRAY_HEADER_SIZE + int(np.prod(shape)) * dtype.itemsize:
+        raise ProtocolError(
+            f'Frame length {header.length} does not match array {shape} ({dtype})'
+        )
+
+    return dtype, shape
+
+
+def recv_array(sock: socket.socket, header: FrameHeader, out: np.ndarray = None) -> np.ndarray:
+    """Receive the payload of the raw frame described by `header` directly
+    into a numpy array.
+
+    If `out` is given and matches the dtype and shape of the incoming
+    array, the data are received into it, otherwise a new array is
+    allocated.
+    """
+    if header.codec != CODEC_RAW:
+        raise ProtocolError(f'Expected a raw frame, got codec {header.codec}')
+
+    meta = recv_exactly(sock, ARRAY_HEADER_SIZE)
+    if meta is None:
+        raise ConnectionError('Connection closed before the array was received')
+
+    dtype, shape = _unpack_array_header(header, meta)
+
+    if out is None or out.dtype != dtype or out.shape != shape or not out.flags.c_contiguous:
+        out = np.empty(shape, dtype=dtype)
+
+    if out.nbytes and not recv_into_exactly(sock, out):
+        raise ConnectionError('Connection closed before the array was received')
+
+    return out
+
+
+def negotiate(sock: socket.socket, key: str, loader, dumper, bufsize: int) -> bool:
+    """Ask the server on the other end of `sock` to switch to framed messages.
+
+    The request is sent in the legacy format using `dumper`/`loader`,
+    `key` is the name of the field the server reads the attribute name
+    from (`func_name` or `attr_name`). Returns True if the server
+    supports framed messages.
+    """
+    dct = {key: NEGOTIATE, 'args': (), 'kwargs': {'version': VERSION}}
+    sock.sendall(dumper(dct))
+
+    response = sock.recv(bufsize)
+    if not response:
+        raise ConnectionError('Connection closed during protocol negotiation')
+
+    status, data = loader(response)
+    return status == 200 and isinstance(data, dict) and data.get('version', 0) >= 1
+
+
+class ServerConnection:
+    """Server side of a client connection.
+
+    Reads requests in the legacy format (a single serialized message per
+    `recv`) until the client negotiates framed messages, and sends each
+    response in the same format and with the same codec and message id
+    as the request it answers.
+    """
+
+    def __init__(self, sock: socket.socket, *, key: str, loader, dumper, bufsize: int):
+        self.sock = sock
+        self.key = key
+        self.loader = loader
+        self.dumper = dumper
+        self.bufsize = bufsize
+
+        self.framed = False
+        self.codec = None
+        self.msg_id = 0
+
+    def _is_negotiation(self, data) -> bool:
+        return isinstance(data, dict) and data.get(self.key) == NEGOTIATE
+
+    def receive(self):
+        """Return the next request, or None if the connection was closed."""
+        while True:
+            if self.framed:
+                message = recv_message(self.sock)
+                if message is None:
+                    return None
+                header, data = message
+                self.codec = header.codec
+                self.msg_id = header.msg_id
+            else:
+                raw = self.sock.recv(self.bufsize)
+                if not raw:
+                    return None
+                data = self.loader(raw)
+
+            if not self.framed and self._is_negotiation(data):
+                self.sock.sendall(self.dumper((200, {'version': VERSION})))
+                self.framed = True
+                continue
+
+            return data
+
+    def reply(self, response, msg_id: int = None, codec: int = None) -> None:
+        """Send `response` to the client.
+
+        `msg_id` and `codec` are the id and codec of the request it
+        answers, they default to those of the last request received.
+        Pass them explicitly if requests are answered after the next
+        request has been received.
+        """
+        if msg_id is None:
+            msg_id = self.msg_id
+        if codec is None:
+            codec = self.codec
+        if self.framed:
+            send_message(self.sock, response, codec=codec, msg_id=msg_id)
+        else:
+            self.sock.sendall(self.dumper(response))
+
+    def reply_array(self, arr: np.ndarray, more: bool = False, msg_id: int = None) -> None:
+        """Send the numpy array `arr` to the client as a raw frame.
+
+        Set `more` if further responses to the same request follow.
+        Only available once framed messages have been negotiated.
+        """
+        if not self.framed:
+            raise ProtocolError('Raw arrays require a framed connection')
+        if msg_id is None:
+            msg_id = self.msg_id
+        flags = FLAG_MORE if more else 0
+        send_array(self.sock, arr, msg_id=msg_id, flags=flags)
+
+
+def get_exception(status: int, data) -> Exception:
+    """Return the exception corresponding to an error response from the
+    server."""
+    if status == 500:
+        error_code, args = data
+        return exception_list.get(error_code, TEMCommunicationError)(*args)
+    else:
+        return ConnectionError(f'Unknown status code: {status}')
+
+
+async def read_exactly(reader: asyncio.StreamReader, size: int) -> Optional[bytes]:
+    """Read exactly `size` bytes from the asyncio stream `reader`.
+
+    Returns None if the connection was closed before any data arrived.
+    """
+    try:
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ConnectionError(
+            f'Connection closed after {len(e.partial)} of {size} bytes were received'
+        ) from e
+
+
+async def read_header(reader: asyncio.StreamReader) -> Optional[FrameHeader]:
+    """Asyncio version of `recv_header`."""
+    data = await read_exactly(reader, HEADER_SIZE)
+    if data is None:
+        return None
+
+    magic, *fields = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ProtocolError(f'Invalid frame header: {data!r}')
+
+    header = FrameHeader(*fields)
+    if header.version > VERSION:
+        raise ProtocolError(f'Unsupported protocol version: {header.version}')
+
+    return header
+
+
+async def read_array(reader: asyncio.StreamReader, header: FrameHeader) -> np.ndarray:
+    """Asyncio version of `recv_array`.
+
+    The data are copied into the array as they arrive, so the payload is
+    never held in memory twice.
+    """
+    if header.codec != CODEC_RAW:
+        raise ProtocolError(f'Expected a raw frame, got codec {header.codec}')
+
+    meta = await read_exactly(reader, ARRAY_HEADER_SIZE)
+    if meta is None:
+        raise ConnectionError('Connection closed before the array was received')
+
+    dtype, shape = _unpack_array_header(header, meta)
+    out = np.empty(shape, dtype=dtype)
+
+    view = memoryview(out).cast('B') if out.nbytes else b''
+    received = 0
+    while received < out.nbytes:
+        chunk = await reader.read(out.nbytes - received)
+        if not chunk:
+            raise ConnectionError('Connection closed before the array was received')
+        view[received : received + len(chunk)] = chunk
+        received += len(chunk)
+
+    return out
+
+
+class AsyncConnection:
+    """Client side of a framed connection for use with asyncio.
+
+    Any number of tasks can send requests over the same connection
+    without waiting for each other. A single reader task receives the
+    responses and passes each one to the request with the same message
+    id. Responses are `(status, data)` tuples, raw frames are received
+    as `(200, array)`.
+
+    Use `open` to connect and negotiate framed messages with the server.
+    """
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, *, codec: int
+    ):
+        self._reader = reader
+        self._writer = writer
+        self.codec = codec
+
+        self._msg_id = 0
+        self._pending: Dict[int, Union[asyncio.Future, asyncio.Queue]] = {}
+        self._write_lock = asyncio.Lock()
+        self._error = None
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+
+    @classmethod
+    async def open(
+        cls, host: str, port: int, *, key: str, loader, dumper, bufsize: int, codec: int
+    ) -> 'AsyncConnection':
+        """Connect to the server on `host`:`port` and switch the connection
+        to framed messages.
+
+        See `negotiate` for the meaning of the other arguments. Raises
+        `ProtocolError` if the server does not support framed messages.
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+
+        try:
+            dct = {key: NEGOTIATE, 'args': (), 'kwargs': {'version': VERSION}}
+            writer.write(dumper(dct))
+            await writer.drain()
+
+            response = await reader.read(bufsize)
+            if not response:
+                raise ConnectionError('Connection closed during protocol negotiation')
+
+            status, data = loader(response)
+            if not (status == 200 and isinstance(data, dict) and data.get('version', 0) >= 1):
+                raise ProtocolError('The server does not support framed messages')
+        except BaseException:
+            writer.close()
+            raise
+
+        return cls(reader, writer, codec=codec)
+
+    @property
+    def closed(self) -> bool:
+        return self._reader_task.done()
+
+    async def close(self) -> None:
+        """Close the connection, pending requests fail with
+        `ConnectionError`."""
+        self._writer.close()
+        try:
+            await self._reader_task
+        except Exception:
+            pass
+
+    async def _send(self, dct: dict, target) -> int:
+        if self._error is not None:
+            raise self._error
+
+        self._msg_id = (self._msg_id + 1) & 0xFFFFFFFF
+        msg_id = self._msg_id
+        self._pending[msg_id] = target
+
+        payload = dumps(dct, self.codec)
+        header = HEADER.pack(MAGIC, VERSION, self.codec, 0, msg_id, len(payload))
+
+        try:
+            async with self._write_lock:
+                self._writer.write(header)
+                self._writer.write(payload)
+                await self._writer.drain()
+        except BaseException:
+            self._pending.pop(msg_id, None)
+            raise
+
+        return msg_id
+
+    async def request(self, dct: dict) -> tuple:
+        """Send `dct` and return the `(status, data)` response."""
+        future = asyncio.get_running_loop().create_future()
+        msg_id = await self._send(dct, future)
+        try:
+            return await future
+        finally:
+            self._pending.pop(msg_id, None)
+
+    async def open_stream(self, dct: dict) -> Tuple[int, asyncio.Queue]:
+        """Send `dct` for a request with several responses.
+
+        Returns the message id and a queue that receives `(header,
+        response)` for every response, the last one is the response
+        without `FLAG_MORE`. If the connection fails, the exception is
+        put on the queue. Call `close_stream` once done.
+        """
+        responses = asyncio.Queue()
+        msg_id = await self._send(dct, responses)
+        return msg_id, responses
+
+    def close_stream(self, msg_id: int) -> None:
+        """Stop receiving the responses to `msg_id`, remaining responses are
+        discarded."""
+        self._pending.pop(msg_id, None)
+
+    async def _read_responses(self) -> None:
+        error = ConnectionError('Connection to the server was closed')
+
+        try:
+            while True:
+                header = await read_header(self._reader)
+                if header is None:
+                    break
+
+                if header.codec == CODEC_RAW:
+                    response = (200, await read_array(self._reader, header))
+                else:
+                    payload = await read_exactly(self._reader, header.length)
+                    if payload is None:
+                        raise ConnectionError(
+                            'Connection closed before the payload was received'
+                        )
+                    response = loads(payload, header.codec)
+
+                more = header.flags & FLAG_MORE
+                target = self._pending.get(header.msg_id)
+                if isinstance(target, asyncio.Queue):
+                    target.put_nowait((header, response))
+                    if not more:
+                        self._pending.pop(header.msg_id, None)
+                elif target is not None and not more:
+                    self._pending.pop(header.msg_id, None)
+                    if not target.done():
+                        target.set_result(response)
+                # otherwise the request was abandoned, discard the response
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            self._error = error
+            pending, self._pending = self._pending, {}
+            for target in pending.values():
+                if isinstance(target, asyncio.Queue):
+                    target.put_nowait(error)
+                elif not target.done():
+                    target.set_exception(error)
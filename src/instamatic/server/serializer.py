@@ -68,3 +68,53 @@ elif PROTOCOL == 'msgpack':
     dumper = msgpack_dumper
 else:
     raise ValueError(f'No such protocol: `{PROTOCOL}`')
+
+
+# Codec identifiers used in the header of framed messages (see `protocol.py`),
+# so that each side can decode a message regardless of its own configuration.
+# Codec `0` is reserved for raw binary payloads.
+CODEC_RAW = 0
+CODECS = {
+    'pickle': 1,
+    'json': 2,
+    'yaml': 3,
+    'msgpack': 4,
+}
+
+_loaders = {
+    CODECS['pickle']: pickle_loader,
+    CODECS['json']: json_loader,
+    CODECS['yaml']: yaml_loader,
+}
+
+_dumpers = {
+    CODECS['pickle']: pickle_dumper,
+    CODECS['json']: json_dumper,
+    CODECS['yaml']: yaml_dumper,
+}
+
+try:
+    _loaders[CODECS['msgpack']] = msgpack_loader
+    _dumpers[CODECS['msgpack']] = msgpack_dumper
+except NameError:
+    pass
+
+codec = CODECS[PROTOCOL]
+
+
+def loads(data, codec: int):
+    """Deserialize `data` using the codec identified by `codec`."""
+    try:
+        func = _loaders[codec]
+    except KeyError:
+        raise ValueError(f'No such codec: `{codec}`') from None
+    return func(data)
+
+
+def dumps(data, codec: int) -> bytes:
+    """Serialize `data` using the codec identified by `codec`."""
+    try:
+        func = _dumpers[codec]
+    except KeyError:
+        raise ValueError(f'No such codec: `{codec}`') from None
+    return func(data)
@@ -12,11 +12,10 @@ import traceback
 from instamatic import config
 from instamatic.TEMController import Microscope
 
+from .dispatcher import Dispatcher, handle_connection, serve
+from .protocol import BATCH
 from .serializer import dumper, loader
 
-condition = threading.Condition()
-box = []
-
 HOST = config.settings.tem_server_host
 PORT = config.settings.tem_server_port
 BUFSIZE = 1024
@@ -25,11 +24,12 @@ BUFSIZE = 1024
 class TemServer(threading.Thread):
     """TEM communcation server.
 
-    Takes a logger object `log`, command queue `q`, and name of the
+    Takes a logger object `log`, request dispatcher `q`, and name of the
     microscope `name` that is used to initialize the connection to the
     microscope. Start the server using `TemServer.run` which will wait
-    for items to appear on `q` and execute them on the specified
-    microscope instance.
+    for requests to appear on `q` and execute them on the specified
+    microscope instance. The response of each request is set on its own
+    future, see `Dispatcher`.
     """
 
     def __init__(self, log=None, q=None, name=None):
@@ -51,27 +51,29 @@ class TemServer(threading.Thread):
         while True:
             now = datetime.datetime.now().strftime('%H:%M:%S.%f')
 
-            cmd = self.q.get()
+            request = self.q.get()
+            cmd = request.cmd
 
-            with condition:
-                func_name = cmd['func_name']
-                args = cmd.get('args', ())
-                kwargs = cmd.get('kwargs', {})
+            func_name = cmd['func_name']
+            args = cmd.get('args', ())
+            kwargs = cmd.get('kwargs', {})
 
-                try:
+            try:
+                if func_name == BATCH:
+                    ret = self.evaluate_batch(*args)
+                else:
                     ret = self.evaluate(func_name, args, kwargs)
-                    status = 200
-                except Exception as e:
-                    traceback.print_exc()
-                    if self.log:
-                        self.log.exception(e)
-                    ret = (e.__class__.__name__, e.args)
-                    status = 500
-
-                box.append((status, ret))
-                condition.notify()
-                if self.verbose:
-                    print(f'{now} | {status} {func_name}: {ret}')
+                status = 200
+            except Exception as e:
+                traceback.print_exc()
+                if self.log:
+                    self.log.exception(e)
+                ret = (e.__class__.__name__, e.args)
+                status = 500
+
+            self.q.complete(request, status, ret)
+            if self.verbose:
+                print(f'{now} | {status} {func_name}: {ret}')
 
     def evaluate(self, func_name: str, args: list, kwargs: dict):
         """Evaluate the function `func_name` on `self.tem` and call it with
@@ -81,29 +83,40 @@ class TemServer(threading.Thread):
         ret = f(*args, **kwargs)
         return ret
 
-
-def handle(conn, q):
-    """Handle incoming connection, put command on the Queue `q`, which is then
-    handled by TEMServer."""
-    with conn:
-        while True:
-            data = conn.recv(BUFSIZE)
-            if not data:
-                break
-
-            data = loader(data)
-
-            if data == 'exit':
-                break
-
-            if data == 'kill':
-                break
-
-            with condition:
-                q.put(data)
-                condition.wait()
-                response = box.pop()
-                conn.send(dumper(response))
+    def evaluate_batch(self, calls: list) -> list:
+        """Evaluate a list of calls (dicts with `func_name`, `args`, and
+        `kwargs`) in order.
+
+        Returns a list with a `(status, ret)` tuple for every call,
+        errors do not stop the evaluation of the remaining calls.
+        """
+        results = []
+        for call in calls:
+            func_name = call['func_name']
+            try:
+                ret = self.evaluate(func_name, call.get('args', ()), call.get('kwargs', {}))
+                status = 200
+            except Exception as e:
+                if self.log:
+                    self.log.exception(e)
+                ret = (e.__class__.__name__, e.args)
+                status = 500
+            results.append((status, ret))
+        return results
+
+
+def handle(conn, q, addr=None):
+    """Handle incoming connection, submit each command to the dispatcher `q`,
+    which is then handled by TEMServer."""
+    handle_connection(
+        conn,
+        q,
+        key='func_name',
+        loader=loader,
+        dumper=dumper,
+        bufsize=BUFSIZE,
+        client=str(addr),
+    )
 
 
 def main():
@@ -130,6 +143,12 @@ The data sent over the socket is a serialized dictionary with the following elem
 - `kwargs`: (Optiona) Dictionary of keyword arguments for the function (dict)
 
 The response is returned as a serialized object.
+
+To evaluate several functions in one round trip, send `func_name='__batch__'` with a list of call dictionaries as the only argument. The calls are evaluated in order, and the response is a list with a `(status, return value)` tuple for every call.
+
+Clients can switch the connection to length-prefixed frames by sending a `__negotiate__` request. Each frame starts with a fixed header containing the payload length, a message id, and the serializer used, so that large responses are never truncated. Framed requests may be sent without waiting for the previous response, the responses are returned in order with the message id of their request.
+
+Any number of clients can connect at the same time, each response is routed back to the connection that sent the request. Send `func_name='__metrics__'` to get statistics on the request queue (e.g. queue depth and mean waiting time).
 """
 
     parser = argparse.ArgumentParser(
@@ -158,24 +177,12 @@ The response is returned as a serialized object.
     logging.captureWarnings(True)
     log = logging.getLogger(__name__)
 
-    q = queue.Queue(maxsize=100)
+    q = Dispatcher(maxsize=100)
 
     tem_reader = TemServer(name=microscope, log=log, q=q)
     tem_reader.start()
 
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.bind((HOST, PORT))
-    s.listen(5)
-
-    log.info(f'Server listening on {HOST}:{PORT}')
-    print(f'Server listening on {HOST}:{PORT}')
-
-    with s:
-        while True:
-            conn, addr = s.accept()
-            log.info('Connected by %s', addr)
-            print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn, q)).start()
+    serve(HOST, PORT, lambda conn, addr: handle(conn, q, addr), log=log)
 
 
 if __name__ == '__main__':
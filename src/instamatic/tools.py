@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import glob
+import itertools
 import os
 import sys
 from pathlib import Path
@@ -131,6 +132,90 @@ def find_beam_center(
     return center
 
 
+def refine_peak_max(profiles: np.ndarray, w: int = 10, method: str = 'parabolic') -> np.ndarray:
+    """Find the position of the maximum of each (smoothed) 1D profile in the
+    2D array `profiles` with subpixel precision.
+
+    `parabolic` fits a parabola through the largest value and its two
+    neighbours, `centroid` takes the center of mass of a window of size
+    2*w+1 around the largest value (after subtracting the minimum of the
+    window). Peaks at the edges return the position of the largest
+    value.
+    """
+    n, size = profiles.shape
+    rows = np.arange(n)
+    c = np.argmax(profiles, axis=1)
+
+    if method == 'parabolic':
+        inner = (c > 0) & (c < size - 1)
+        ci = np.clip(c, 1, size - 2)
+        y0 = profiles[rows, ci - 1]
+        y1 = profiles[rows, ci]
+        y2 = profiles[rows, ci + 1]
+        denom = y0 - 2 * y1 + y2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offset = np.where(denom < 0, 0.5 * (y0 - y2) / denom, 0.0)
+        return np.where(inner, c + offset, c).astype(float)
+
+    elif method == 'centroid':
+        index = c[:, None] + np.arange(-w, w + 1)
+        inner = (c >= w) & (c < size - w)
+        index = np.clip(index, 0, size - 1)
+        window = profiles[rows[:, None], index]
+        window = window - window.min(axis=1, keepdims=True)
+        total = window.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            centroid = (window * index).sum(axis=1) / total
+        return np.where(inner & (total > 0), centroid, c).astype(float)
+
+    else:
+        raise ValueError(f'Unknown method: `{method}`, must be `parabolic` or `centroid`')
+
+
+def find_beam_centers(
+    stack, sigma: int = 30, w: int = 10, method: str = 'parabolic', chunksize: int = 64
+) -> np.ndarray:
+    """Find the center of the primary beam in all images in `stack`, like
+    `find_beam_center`, but vectorized over the images.
+
+    `stack` is a 3D array (which can be a memory-mapped array or an HDF5
+    dataset) or an iterable of 2D images. The images are processed
+    `chunksize` at a time, so that only a chunk has to be in memory.
+    The projections along X/Y are smoothed with a gaussian filter with
+    standard deviation `sigma`, and the positions of the maxima are
+    refined with `refine_peak_max`.
+
+    Returns an array of shape (n, 2) with the beam centers.
+    """
+    if chunksize is None or chunksize < 1:
+        chunksize = max(len(stack), 1) if hasattr(stack, 'shape') else None
+
+    if hasattr(stack, 'shape'):
+        chunks = (stack[start : start + chunksize] for start in range(0, len(stack), chunksize))
+    else:
+        images = iter(stack)
+        chunks = iter(lambda: list(itertools.islice(images, chunksize)), [])
+
+    centers = []
+    for chunk in chunks:
+        if not isinstance(chunk, np.ndarray):
+            chunk = np.stack([np.asarray(img) for img in chunk])
+
+        xx = chunk.sum(axis=2, dtype=float)
+        yy = chunk.sum(axis=1, dtype=float)
+
+        xx = ndimage.gaussian_filter1d(xx, sigma, axis=1)
+        yy = ndimage.gaussian_filter1d(yy, sigma, axis=1)
+
+        cx = refine_peak_max(xx, w=w, method=method)
+        cy = refine_peak_max(yy, w=w, method=method)
+        centers.append(np.column_stack([cx, cy]))
+
+    if not centers:
+        return np.empty((0, 2))
+    return np.concatenate(centers)
+
+
 def find_beam_center_with_beamstop(
     img, z: int = None, method='thresh', plot=False
 ) -> (float, float):
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import numpy as np
 import pytest
 
 from instamatic.camera.camera_base import CameraBase
@@ -85,3 +86,79 @@ def test_init(cam):
     # Use "test" as the name of the camera, as this is where the settings are read from
     c = cam(name='test')
     assert isinstance(c, CameraBase)
+
+
+def test_iter_movie():
+    cam = CameraSimu(name='test')
+    frames = cam.iter_movie(3, exposure=0.001, binsize=2)
+
+    first = next(frames)
+    x, y = cam.get_camera_dimensions()
+    assert first.shape == (x // 2, y // 2)
+    assert len(list(frames)) == 2
+
+
+def test_timepix_arrange_data():
+    from instamatic.camera import camera_timepix
+
+    rng = np.random.default_rng(0)
+    raw = rng.integers(0, 1000, size=512 * 512).astype(np.int16)
+
+    expected = camera_timepix.arrange_data(raw)
+    camera_timepix.correct_cross(expected, factor=2.15)
+
+    out = np.empty((516, 516), dtype=np.int16)
+    ret = camera_timepix.arrange_data(raw, out=out, factor=2.15)
+
+    assert ret is out
+    np.testing.assert_array_equal(out, expected)
+    np.testing.assert_array_equal(
+        out[:255, :255], raw[: 256 * 256].reshape(256, 256)[:255, :255]
+    )
+
+
+def test_timepix_frame_pool():
+    import gc
+
+    from instamatic.camera import camera_timepix
+
+    def address(arr):
+        return arr.__array_interface__['data'][0]
+
+    pool = camera_timepix.FramePool((8, 8), dtype=np.int16, size=2)
+
+    a = pool.get()
+    b = pool.get()
+    assert address(a) != address(b)
+    assert pool.n_allocated == 0
+
+    # the pool is empty, so a new buffer is allocated
+    c = pool.get()
+    assert c.shape == (8, 8)
+    assert pool.n_allocated == 1
+
+    # views keep the buffer in use, it is reused once they are collected
+    view = np.rot90(a, k=3)
+    addr_a = address(a)
+    del a
+    gc.collect()
+    assert address(pool.get()) != addr_a  # the temporary frame is collected right away
+    del view
+    gc.collect()
+    assert address(pool.get()) == addr_a
+    assert pool.n_allocated == 2
+
+    # explicit release, while all other buffers are in use
+    x, y = pool.get(), pool.get()
+    assert pool.release(np.rot90(b, k=3))
+    assert not pool.release(b)
+    assert not pool.release(np.ones((8, 8)))
+    assert address(pool.get()) == address(b)
+
+    # a live view loop does not allocate new buffers
+    del x, y
+    n_allocated = pool.n_allocated
+    for _ in range(10):
+        frame = pool.get()
+    del frame
+    assert pool.n_allocated == n_allocated
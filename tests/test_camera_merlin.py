@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import pickle
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+from pytest import TEST_DATA
+
+from instamatic import config
+from instamatic.camera.camera_merlin import MPX_CMD, CameraMerlin
+
+from .mock.socket import SockMock
+
+
+def mpx_message(payload: bytes) -> bytes:
+    """Prefix `payload` with an MPX header, as sent on the data port."""
+    return f'MPX,{len(payload):010d}'.encode() + payload
+
+
+def tagged_frames(frame: bytes, n_frames: int):
+    """Return `n_frames` copies of the MIB `frame`, with the frame number
+    as the value of the first pixel."""
+    offset = 1 + 768  # leading comma and header of the test frame
+    for i in range(n_frames):
+        yield frame[:offset] + i.to_bytes(2, 'big') + frame[offset + 2 :]
+
+
+class MerlinServer:
+    """Local stand-in for the data port of the Merlin software, which sends
+    an acquisition header followed by the MPX `frames` to the first
+    client."""
+
+    def __init__(self, frames):
+        self.sock = socket.create_server(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.frames = frames
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        conn, _ = self.sock.accept()
+        with conn:
+            conn.sendall(mpx_message(b',HDR,acquisition header'))
+            try:
+                for frame in self.frames:
+                    conn.sendall(mpx_message(frame))
+            except OSError:
+                pass  # the client stopped the acquisition
+
+    def close(self):
+        self.thread.join()
+        self.sock.close()
+
+
+class CommandSockMock(SockMock):
+    """Command socket that accepts every command."""
+
+    def recv(self, bufsize: int) -> bytes:
+        return b'MPX,0000000012,CMD,0'
+
+
+class CameraMerlinStandIn(CameraMerlin):
+    host = '127.0.0.1'
+    commandport = 0
+    dataport = None
+
+    def load_defaults(self):
+        for key, val in config.camera.mapping.items():
+            setattr(self, key, val)
+
+    def establish_connection(self) -> None:
+        self.s_cmd = CommandSockMock()
+
+
+@pytest.fixture
+def raw_dataframe():
+    with open(TEST_DATA / 'merlin_raw_dataframe.pickle', 'rb') as f:
+        return bytes(pickle.load(f))
+
+
+@pytest.fixture
+def expected_data():
+    return np.flipud(np.load(TEST_DATA / 'merlin_expected_data.npy'))
+
+
+@pytest.fixture
+def merlin(raw_dataframe, request):
+    frames = request.param
+    if isinstance(frames, int):
+        frames = [raw_dataframe] * frames
+    else:
+        frames = tagged_frames(raw_dataframe, n_frames=frames[0])
+    server = MerlinServer(frames)
+    CameraMerlinStandIn.dataport = server.port
+    cam = CameraMerlinStandIn()
+    yield cam
+    cam.s_data.close()
+    server.close()
+
+
+@pytest.mark.parametrize('merlin', [200], indirect=True)
+def test_receive_movie(merlin, expected_data):
+    n_frames = 200
+
+    start = merlin.receive_data(nbytes=merlin.START_SIZE)
+    merlin.receive_data(nbytes=int(start[4:]))
+
+    data = merlin.receive_movie(n_frames)
+
+    assert data.shape == (n_frames, *expected_data.shape)
+    for frame in (data[0], data[n_frames // 2], data[-1]):
+        np.testing.assert_array_equal(frame, expected_data)
+        assert np.shares_memory(frame, data)
+
+
+@pytest.mark.parametrize('merlin', [2], indirect=True)
+def test_receive_closed(merlin):
+    start = merlin.receive_data(nbytes=merlin.START_SIZE)
+    merlin.receive_data(nbytes=int(start[4:]))
+
+    with pytest.raises(ConnectionError):
+        merlin.receive_movie(3)
+
+
+@pytest.mark.parametrize('merlin', [5], indirect=True)
+def test_get_movie(merlin, expected_data):
+    frames = merlin.get_movie(5, exposure=0.01)
+
+    assert len(frames) == 5
+    for frame in frames:
+        np.testing.assert_array_equal(frame, expected_data)
+    assert MPX_CMD('CMD', 'STARTACQUISITION') in merlin.s_cmd.sent
+
+
+@pytest.mark.parametrize('merlin', [(50,)], indirect=True)
+def test_iter_movie(merlin):
+    frames = [frame[0, 0] for frame in merlin.iter_movie(50, exposure=0.01)]
+    assert frames == list(range(50))
+
+
+@pytest.mark.parametrize('merlin', [(100,)], indirect=True)
+def test_stream_movie_drop(merlin):
+    received = []
+
+    def slow_consumer(i, frame):
+        time.sleep(0.01)
+        received.append((i, frame[0, 0]))
+
+    stream = merlin.stream_movie(
+        100, exposure=0.01, callback=slow_consumer, maxsize=4, block=False
+    )
+    stream.join()
+
+    assert stream.n_received == 100
+    assert stream.n_dropped > 0
+    assert len(received) + stream.n_dropped == 100
+    assert all(i == value for i, value in received)
+    assert [i for i, _ in received] == sorted(i for i, _ in received)
+
+
+@pytest.mark.parametrize('merlin', [(1000,)], indirect=True)
+def test_stream_movie_stop(merlin):
+    with merlin.stream_movie(1000, exposure=0.01, maxsize=2) as stream:
+        for i, frame in stream:
+            if i == 10:
+                break
+
+    assert not stream.running
+    assert stream.n_dropped == 0
+    assert stream.n_received < 1000
+    assert MPX_CMD('CMD', 'STOPACQUISITION') in merlin.s_cmd.sent
+
+
+@pytest.mark.parametrize('merlin', [(1000,)], indirect=True)
+def test_stream_movie_close_callback(merlin):
+    received = []
+
+    def slow_consumer(i, frame):
+        time.sleep(0.01)
+        received.append(i)
+
+    stream = merlin.stream_movie(1000, exposure=0.01, callback=slow_consumer, maxsize=2)
+    time.sleep(0.1)
+
+    closer = threading.Thread(target=stream.close, daemon=True)
+    closer.start()
+    closer.join(timeout=5)
+
+    assert not closer.is_alive()
+    assert not stream.running
+    assert 0 < len(received) < 1000
+    assert received == list(range(len(received)))
+    assert MPX_CMD('CMD', 'STOPACQUISITION') in merlin.s_cmd.sent
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+from instamatic import config
+from instamatic.camera.serval_io import ServalFrameStream, read_pgm
+
+
+def make_pgm(img: np.ndarray, comment: bool = False) -> bytes:
+    maxval = 255 if img.dtype == np.uint8 else 65535
+    header = b'P5\n# instamatic\n' if comment else b'P5\n'
+    header += f'{img.shape[1]} {img.shape[0]}\n{maxval}\n'.encode()
+    return header + img.astype(img.dtype.newbyteorder('>')).tobytes()
+
+
+class ServalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+
+        if self.path != '/measurement/image' or server.status != 200:
+            self.send_response(server.status if server.status != 200 else 404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        # frames are only available after the exposure
+        with server.lock:
+            server.next_frame = max(server.next_frame, time.perf_counter()) + server.frametime
+            wait = server.next_frame - time.perf_counter()
+            n = server.n_frames
+            server.n_frames += 1
+        time.sleep(max(wait, 0))
+
+        img = np.full((48, 64), n, dtype=np.uint16)
+        body = make_pgm(img)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/x-portable-graymap')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ServalServer(ThreadingHTTPServer):
+    """Local stand-in for the HTTP end-point of Serval that serves a new
+    frame every `frametime` seconds, with the frame number as pixel
+    values."""
+
+    daemon_threads = True
+
+    def __init__(self, frametime: float = 0.005, status: int = 200):
+        super().__init__(('127.0.0.1', 0), ServalHandler)
+        self.frametime = frametime
+        self.status = status
+        self.requests = []
+        self.n_frames = 0
+        self.next_frame = 0
+        self.lock = threading.Lock()
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def handle_error(self, request, client_address):
+        pass  # the client closes the connection when the stream is stopped
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+@pytest.fixture
+def serval(request):
+    server = ServalServer(**getattr(request, 'param', {}))
+    yield server
+    server.close()
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_read_pgm(dtype):
+    img = np.arange(12 * 7).reshape(7, 12).astype(dtype)
+
+    arr = read_pgm(make_pgm(img, comment=True))
+
+    assert arr.shape == (7, 12)
+    np.testing.assert_array_equal(arr, img)
+
+    with pytest.raises(ValueError):
+        read_pgm(b'P2\n1 1\n255\n0')
+
+
+def test_frame_stream(serval):
+    with ServalFrameStream(serval.url, drop=False) as stream:
+        frames = [stream.get(timeout=5) for _ in range(20)]
+
+        # the next frame is requested while the current one is consumed
+        time.sleep(0.05)
+        assert stream.n_received == 21
+
+    assert not stream.running
+    assert stream.n_dropped == 0
+    assert [frame[0, 0] for frame in frames] == list(range(20))
+    assert frames[0].dtype == np.dtype('=u2')
+    assert frames[0].flags.writeable
+
+
+@pytest.mark.parametrize('serval', [{'frametime': 0.001}], indirect=True)
+def test_frame_stream_drop(serval):
+    with ServalFrameStream(serval.url) as stream:
+        numbers = []
+        for _ in range(10):
+            numbers.append(stream.get(timeout=5)[0, 0])
+            time.sleep(0.02)
+
+    # only the most recent frames are returned
+    assert stream.n_dropped > 0
+    assert numbers == sorted(set(numbers))
+    assert numbers[-1] > 10
+
+
+@pytest.mark.parametrize('serval', [{'status': 500}], indirect=True)
+def test_frame_stream_error(serval):
+    stream = ServalFrameStream(serval.url)
+    with pytest.raises(ConnectionError):
+        stream.get(timeout=5)
+    stream.close()
+
+
+class ServalConnMock:
+    """Replaces the `serval_toolkit` connection, the frames are received
+    from the HTTP stand-in."""
+
+    def __init__(self):
+        self.detector_config = {'PixelDepth': 12}
+        self.calls = []
+        self.status = 'DA_RECORDING'
+
+    @property
+    def dashboard(self):
+        self.calls.append('dashboard')
+        return {'Measurement': {'Status': self.status}}
+
+    def set_detector_config(self, **kwargs):
+        self.calls.append(('set_detector_config', kwargs))
+
+    def measurement_start(self):
+        self.calls.append('measurement_start')
+        self.status = 'DA_RECORDING'
+
+    def measurement_stop(self):
+        self.calls.append('measurement_stop')
+        self.status = 'DA_IDLE'
+
+    def trigger_start(self):
+        self.calls.append('trigger_start')
+        if self.status != 'DA_RECORDING':
+            raise RuntimeError('No measurement running')
+
+    def get_image_stream(self, nTriggers, disable_tqdm):
+        return [np.zeros((48, 64), dtype=np.uint16)]
+
+
+def test_camera_continuous(serval):
+    from instamatic.camera.camera_serval import CameraServal
+
+    class CameraServalStandIn(CameraServal):
+        url = serval.url
+        detector_config = {'TriggerMode': 'SOFTWARESTART_TIMERSTOP'}
+
+        def load_defaults(self):
+            for key, val in config.camera.mapping.items():
+                setattr(self, key, val)
+
+        def establish_connection(self):
+            self.conn = ServalConnMock()
+            self.file_format = 'pgm'
+
+    cam = CameraServalStandIn()
+
+    # single frames, the settings and dashboard are only checked once
+    for _ in range(3):
+        cam.get_image(exposure=0.01)
+    assert cam.conn.calls.count('dashboard') == 1
+    assert cam.conn.calls.count('trigger_start') == 3
+    assert sum(isinstance(call, tuple) for call in cam.conn.calls) == 1
+
+    # the measurement ended on the Serval side, it is restarted in the same call
+    cam.conn.status = 'DA_IDLE'
+    cam.conn.calls.clear()
+    cam.get_image(exposure=0.01)
+    assert cam.conn.calls == [
+        'trigger_start',
+        'dashboard',
+        'measurement_start',
+        'trigger_start',
+    ]
+
+    cam.conn.calls.clear()
+    cam.start_continuous(exposure=0.005)
+    numbers = [cam.get_image(exposure=0.005)[0, 0] for _ in range(5)]
+    assert numbers == sorted(numbers)
+    assert cam.conn.calls == [
+        'measurement_stop',
+        (
+            'set_detector_config',
+            {
+                'TriggerMode': 'CONTINUOUS',
+                'ExposureTime': 0.005,
+                'TriggerPeriod': 0.005 + 0.00050001,
+                'nTriggers': 2**31 - 1,
+            },
+        ),
+        'measurement_start',
+    ]
+
+    cam.stop_continuous()
+    assert cam.conn.calls[-1] == ('set_detector_config', cam.detector_config)
+    assert all(path == '/measurement/image' for path in serval.requests)
+
+    # the stream fails, the error is raised once and the camera returns to single frames
+    cam.start_continuous(exposure=0.005)
+    serval.status = 500
+    cam.conn.calls.clear()
+    with pytest.raises(ConnectionError):
+        for _ in range(10):
+            cam.get_image(exposure=0.005)
+    assert cam._stream is None
+    assert cam.conn.calls == ['measurement_stop', ('set_detector_config', cam.detector_config)]
+
+    img = cam.get_image(exposure=0.005)
+    assert img.shape == (48, 64)
+    assert 'trigger_start' in cam.conn.calls
@@ -236,3 +236,204 @@ if __name__ == '__main__':
     from IPython import embed
 
     embed(banner1='')
+
+
+def test_state(ctrl):
+    ctrl.mode.set('mag1')
+    ctrl.spotsize = 3
+    ctrl.beamshift.set(10, 20)
+
+    state = ctrl.get_state()
+    assert state.FunctionMode == 'mag1'
+    assert state.SpotSize == 3
+    assert state.BeamShift == (10, 20)
+    assert state.DiffFocus is None  # not available in mag1
+    assert len(state.StagePosition) == 5
+
+    dct = ctrl.to_dict()
+    assert 'DiffFocus' not in dct
+    assert list(ctrl.to_dict('SpotSize', 'BeamShift')) == ['SpotSize', 'BeamShift']
+
+    with pytest.raises(KeyError):
+        ctrl.to_dict('rawr')
+
+
+def test_state_cache(ctrl):
+    from instamatic.TEMController.state import StateCache, StateReader
+
+    reader = StateReader(ctrl.tem, cache=StateCache(ttl=60))
+    ctrl.beamtilt.set(1, 2)
+    assert reader.snapshot('BeamTilt').BeamTilt == (1, 2)
+
+    # changed outside of the cache, old value is returned until it expires
+    ctrl.tem.setBeamTilt(3, 4)
+    assert reader.snapshot('BeamTilt').BeamTilt == (1, 2)
+    assert reader.snapshot('BeamTilt', fresh=True).BeamTilt == (3, 4)
+
+    # setters invalidate the cached value
+    ctrl.beamtilt._state_cache = reader.cache
+    try:
+        ctrl.beamtilt.set(5, 6)
+        assert reader.snapshot('BeamTilt').BeamTilt == (5, 6)
+    finally:
+        ctrl.beamtilt._state_cache = ctrl.state_cache
+
+    # the stage position is never cached by default
+    reader.snapshot('StagePosition')
+    assert reader.cache.get('StagePosition') == (False, None)
+
+
+def test_state_write_through(ctrl):
+    cache = ctrl.state_cache
+
+    ctrl.mode.set('mag1')
+    ctrl.magnification.index = 0
+    ctrl.brightness.set(123)
+    ctrl.imageshift1.set(5, 6)
+    assert cache.get('Brightness') == (False, None)
+    assert cache.get('ImageShift1') == (False, None)
+    assert cache.get('FunctionMode') == (True, 'mag1')
+    assert cache.get('Magnification') == (False, None)
+    assert ctrl.brightness.value == 123
+    assert cache.get('Brightness') == (True, 123)
+
+    # values changed behind the back of the controller are not seen until
+    # they expire, unless a fresh value is requested
+    ctrl.tem.setBrightness(456)
+    assert ctrl.brightness.value == 123
+    assert ctrl.brightness.get(fresh=True) == 456
+    assert ctrl.brightness.value == 456
+
+    mag = ctrl.magnification.value
+    assert cache.get('Magnification') == (True, mag)
+    ctrl.magnification.index = 1
+    assert ctrl.magnification.value != mag
+
+    ctrl.mode.set('diff')
+    assert cache.get('ImageShift1') == (False, None)  # the mode invalidates all values
+    ctrl.difffocus.set(100)
+    assert ctrl.difffocus.value == 100
+
+    ctrl.spotsize = 2
+    ctrl.beam.blank()
+    assert ctrl.beam.is_blanked
+    ctrl.beam.unblank()
+    assert ctrl.beam.get() == 'unblanked'
+    assert ctrl.to_dict('SpotSize', 'FunctionMode') == {'SpotSize': 2, 'FunctionMode': 'diff'}
+
+    ctrl.mode.set('mag1')
+
+
+def test_state_magnification_not_stored(ctrl, monkeypatch):
+    cache = ctrl.state_cache
+    ctrl.mode.set('mag1')
+    ctrl.magnification.index = 0
+    mag = ctrl.magnification.value
+    index = ctrl.magnification.index
+
+    # the microscope silently ignores the value, the cache must not keep it
+    monkeypatch.setattr(ctrl.magnification, '_setter', lambda value: None)
+    monkeypatch.setattr(ctrl.magnification, '_indexsetter', lambda index: None)
+
+    ctrl.magnification.set(mag + 1)
+    assert cache.get('Magnification') == (False, None)
+    assert ctrl.magnification.value == mag
+
+    ctrl.magnification.index = index + 1
+    assert cache.get('MagnificationIndex') == (False, None)
+    assert ctrl.magnification.index == index
+
+
+def test_state_clipped_values_not_stored(ctrl, monkeypatch):
+    cache = ctrl.state_cache
+    ctrl.mode.set('mag1')
+    ctrl.brightness.set(1000)
+    ctrl.imageshift1.set(10, 20)
+    assert ctrl.brightness.value == 1000
+    assert ctrl.imageshift1.get() == (10, 20)
+
+    # the microscope clips the values, the cache must not keep the requested ones
+    monkeypatch.setattr(
+        ctrl.brightness, '_setter', lambda value: ctrl.tem.setBrightness(min(value, 2000))
+    )
+    monkeypatch.setattr(
+        ctrl.imageshift1, '_setter', lambda x, y: ctrl.tem.setImageShift1(x // 2, y // 2)
+    )
+
+    ctrl.brightness.set(5000)
+    assert cache.get('Brightness') == (False, None)
+    assert ctrl.brightness.value == 2000
+
+    ctrl.imageshift1.set(100, 200)
+    assert cache.get('ImageShift1') == (False, None)
+    assert ctrl.imageshift1.get() == (50, 100)
+
+
+def test_telemetry(ctrl):
+    import time
+
+    from instamatic.TEMController.telemetry import TelemetrySampler
+
+    ctrl.mode.set('mag1')
+    sampler = TelemetrySampler(
+        ctrl.tem, channels={'stage': 0.005, 'difffocus': 0.01, 'high_tension': 1.0}, capacity=8
+    )
+    assert sampler.latest('stage') is None
+
+    t0 = time.perf_counter()
+    sampler.start()
+    time.sleep(0.2)
+    sampler.stop()
+    t1 = time.perf_counter()
+
+    t, pos = sampler.latest('stage')
+    assert t0 < t < t1
+    assert len(pos) == 5
+
+    times, values = sampler.window('stage')
+    assert len(times) == 8  # ring buffer is full
+    assert values.shape == (8, 5)
+    assert np.all(np.diff(times) > 0)
+
+    times, values = sampler.window('stage', t0=times[4])
+    assert len(times) == 4
+
+    # not available in mag1
+    assert sampler.latest('difffocus')[1] is None
+    assert isinstance(sampler.channels['difffocus'].last_error, ValueError)
+
+    # sampled once at the start
+    times, values = sampler.window('high_tension')
+    assert values.shape == (1, 1)
+
+
+def test_telemetry_first_sample_missing(ctrl):
+    from instamatic.TEMController.telemetry import TelemetrySampler
+
+    calls = []
+
+    def getter():
+        calls.append(None)
+        if len(calls) in (1, 3):
+            raise ValueError('not available')
+        return (3, 4)
+
+    clock = iter(range(100)).__next__
+    sampler = TelemetrySampler(ctrl.tem, channels={}, capacity=4, clock=clock)
+    channel = sampler.add_channel('beamshift', getter, interval=0.1)
+
+    sampler._sample(channel)
+    assert channel.latest() == (0.5, None)
+    assert isinstance(channel.last_error, ValueError)
+    times, values = channel.window()
+    assert times.tolist() == [0.5]
+    assert values.shape == (1, 0)
+
+    sampler._sample(channel)
+    sampler._sample(channel)
+    assert channel.latest() == (4.5, None)
+
+    # missing samples read as NaN, before and after the first value
+    times, values = channel.window()
+    assert times.tolist() == [0.5, 2.5, 4.5]
+    np.testing.assert_array_equal(values, [[np.nan, np.nan], [3, 4], [np.nan, np.nan]])
@@ -70,7 +70,7 @@ def test_write_rename_ext(format, write_func, alt, data, header, temp_data_file)
         ('h5', formats.write_hdf5, True, does_not_raise()),
         # Header is not supported
         ('mrc', formats.write_mrc, False, pytest.raises(ValueError, match='Header mismatch')),
-        ('cbf', formats.write_cbf, True, pytest.raises(NotImplementedError)),
+        ('cbf', formats.write_cbf, True, does_not_raise()),
         ('invalid_extension', lambda *args: None, False, pytest.raises(OSError)),
         ('does_not_exist.h5', lambda *args: None, False, pytest.raises(FileNotFoundError)),
     ],
@@ -91,3 +91,203 @@ def test_read(format, write_func, with_header, raises, data, header, temp_data_f
         # Check if the header we want is in the header we read
         if not all(str(v) == str(h.get(k)) for k, v in header.items()):
             raise ValueError('Header mismatch')
+
+
+def test_cbf_byte_offset(temp_data_file):
+    # deltas around the limits of the 1, 2, 4, and 8 byte encodings
+    deltas = [0, 1, -1, 127, -127, 128, -128, 32767, -32767, 32768, -32768]
+    deltas += [2**31 - 1, -(2**31) + 1, 2**31, -(2**31), 2**40, -(2**40), -32640, 0x80808080]
+    data = np.cumsum(np.array(deltas * 4, dtype=np.int64)).reshape(4, -1)
+
+    stream = formats.xdscbf.compByteOffset(data)
+    np.testing.assert_array_equal(formats.xdscbf.decByteOffset(stream), data.ravel())
+
+    out = temp_data_file + 'offset.cbf'
+    formats.write_cbf(out, data.astype(np.int64))
+    img, h = formats.read_cbf(out)
+
+    np.testing.assert_array_equal(img, data)
+    assert img.dtype == np.int64
+    assert h['X-Binary-Size'] == str(len(stream))
+
+
+def test_cbf_update_header(data, temp_data_file):
+    out = temp_data_file + 'update.cbf'
+    formats.write_cbf(out, data.astype(np.int32), header={'Start_angle': '0.0000 deg.'})
+
+    formats.update_cbf_header(
+        out, {'Start_angle': '10.0000 deg.', 'Angle_increment': '0.5 deg.'}
+    )
+    img, h = formats.read_cbf(out)
+
+    np.testing.assert_array_equal(img, data)
+    assert h['Start_angle'] == '10.0000 deg.'
+    assert h['Angle_increment'] == '0.5 deg.'
+
+
+def test_nexus_writer(temp_data_file):
+    out = temp_data_file + 'stack.nxs'
+    frames = [np.full((16, 8), i, dtype=np.uint16) for i in range(5)]
+
+    with formats.NXmxWriter(out, flush_every=2) as writer:
+        for i, img in enumerate(frames[:3]):
+            writer.add(img, {'i': i, 'name': f'image_{i}', 'center': (i, 2 * i)})
+        # frame 3 is missing
+        writer.add(frames[4], {'i': 4, 'extra': True}, index=4)
+        writer.set_geometry(wavelength=0.0251, distance=500.0, start_angle=-10, osc_angle=0.5)
+
+        assert len(writer) == 5
+
+    img, h = formats.read_image(out)
+    np.testing.assert_array_equal(img, frames[0])
+    assert h == {'i': 0, 'name': 'image_0', 'center': [0, 0]}
+
+    img, h = formats.read_nexus(out, index=3)
+    assert not img.any()
+    assert h == {}
+
+    img, h = formats.read_nexus(out, index=4)
+    np.testing.assert_array_equal(img, frames[4])
+    assert h == {'i': 4, 'extra': 1}
+
+    with formats.h5py.File(out, 'r') as f:
+        assert f['entry'].attrs['NX_class'] == 'NXentry'
+        assert f['entry/data/data'].compression == 'gzip'
+        assert f['entry/data/data'].chunks == (1, 16, 8)
+        assert f['entry/instrument/beam/incident_wavelength'][()] == 0.0251
+        np.testing.assert_allclose(
+            f['entry/sample/goniometer/omega'], [-10, -9.5, -9, -8.5, -8]
+        )
+
+
+def test_nexus_writer_flush(temp_data_file):
+    import os
+
+    sizes = []
+    for flush_every in (1, 0):
+        out = temp_data_file + f'flush_{flush_every}.nxs'
+        with formats.NXmxWriter(out, flush_every=flush_every, compression=None) as writer:
+            writer.set_geometry(start_angle=0, osc_angle=0.5)
+            for i in range(300):
+                h = {'i': i, 'name': f'image_{i}'}
+                if i == 200:
+                    h['i'] = 'last'  # the column is converted to strings
+                writer.add(np.zeros((4, 4), dtype=np.uint8), h)
+                if i == 0:
+                    writer.flush()
+                    column = writer.file['entry/headers/name']
+            # the columns are grown in place, not recreated on every flush
+            assert writer.file['entry/headers/name'] == column
+        sizes.append(os.path.getsize(out))
+
+        img, h = formats.read_nexus(out, index=150)
+        assert h == {'i': 150.0, 'name': 'image_150'}
+        img, h = formats.read_nexus(out, index=200)
+        assert h == {'i': 'last', 'name': 'image_200'}
+        with formats.h5py.File(out, 'r') as f:
+            np.testing.assert_allclose(f['entry/sample/goniometer/omega'], np.arange(300) * 0.5)
+
+    # flushing after every frame does not leave unused space in the file
+    assert sizes[0] < 1.5 * sizes[1]
+
+
+def test_mrc_stack(temp_data_file):
+    from instamatic.formats.mrc import MRCStack, cache_data, read_image
+
+    out = temp_data_file + 'stack.mrc'
+    frames = np.arange(5 * 32 * 16, dtype=np.uint16).reshape(5, 32, 16)
+    for i, img in enumerate(frames):
+        formats.write_mrc(out, img, index=i)
+
+    with MRCStack(out) as stack:
+        assert len(stack) == 5
+        assert stack.shape == (5, 32, 16)
+        assert isinstance(stack[2], np.memmap)
+        np.testing.assert_array_equal(stack[2], frames[2])
+        np.testing.assert_array_equal(stack.read(1, 4), frames[1:4])
+        np.testing.assert_array_equal(stack[::2], frames[::2])
+
+        with pytest.raises(OSError):
+            stack.read_image(5)
+
+    kwargs = cache_data()
+    for i, img in enumerate(frames):
+        np.testing.assert_array_equal(read_image(out, index=i, **kwargs)[0], img)
+    assert list(kwargs['cache']) == [out]
+
+    mrc, h = read_image(out, index=3)
+    np.testing.assert_array_equal(mrc, frames[3])
+
+
+def test_header_loader():
+    import yaml
+
+    from instamatic.formats.header_loader import HeaderLoader
+
+    # as written by `yaml.dump` without the representers in `config.utils`
+    text = """\
+array: !!python/object/apply:numpy.core.multiarray._reconstruct
+  args:
+  - !!python/name:numpy.ndarray ''
+  - !!python/tuple [0]
+  - !!binary |
+    Yg==
+  state: !!python/tuple
+  - 1
+  - !!python/tuple [2, 3]
+  - &id001 !!python/object/apply:numpy.dtype
+    args: [u2, false, true]
+    state: !!python/tuple [3, <, null, null, null, -1, -1, 0]
+  - false
+  - !!binary |
+    AAABAAIAAwAEAAUA
+dtype: !!python/object/apply:numpy.dtype
+  args: [i4, false, true]
+  state: !!python/tuple [3, '>', null, null, null, -1, -1, 0]
+nested:
+  list: [1, !!python/tuple [2, 3]]
+scalar: !!python/object/apply:numpy.core.multiarray.scalar
+- *id001
+- !!binary |
+  BwA=
+tuple: !!python/tuple [1, 2.5]
+"""
+    loaded = yaml.load(text, Loader=HeaderLoader)
+
+    assert loaded['tuple'] == (1, 2.5)
+    assert loaded['nested'] == {'list': [1, (2, 3)]}
+    assert loaded['dtype'] == np.dtype('>i4')
+    assert loaded['scalar'] == 7
+    assert loaded['scalar'].dtype == np.uint16
+    np.testing.assert_array_equal(loaded['array'], np.arange(6, dtype=np.uint16).reshape(2, 3))
+    assert loaded['array'].flags.writeable
+
+    # arbitrary functions are not called
+    loaded = yaml.load('!!python/object/apply:os.system ["exit 1"]', Loader=HeaderLoader)
+    assert loaded == ['exit 1']
+
+
+def test_iter_tiff_dataset(tmp_path):
+    frames = {i: np.full((16, 16), i, dtype=np.uint16) for i in range(1, 21)}
+    fns = []
+    for i, img in frames.items():
+        fn = tmp_path / f'image_{i:05d}.tiff'
+        formats.write_tiff(fn, img, header={'i': i})
+        fns.append(fn)
+
+    read = []
+
+    def reader(fn):
+        read.append(fn)
+        return formats.read_tiff(fn)
+
+    dataset = formats.iter_tiff_dataset(reversed(fns), workers=2, reader=reader)
+    i, img, h = next(dataset)
+    assert (i, h['i']) == (1, 1)
+    assert len(read) <= 5
+
+    items = [(i, img, h)] + list(dataset)
+    assert [i for i, img, h in items] == list(frames)
+    for i, img, h in items:
+        np.testing.assert_array_equal(img, frames[i])
+        assert h['i'] == i
@@ -34,3 +34,70 @@ def test_load_mib(raw_dataframe, expected_data):
     assert array.shape == expected_data.shape
 
     np.testing.assert_array_equal(array, expected_data)
+
+
+def test_load_mib_frames(raw_dataframe, expected_data):
+    n = 1000
+    buffer = bytes(raw_dataframe[1:]) * n
+
+    data = load_mib(buffer)
+
+    assert data.shape == (n, *expected_data.shape)
+    assert np.shares_memory(data, np.frombuffer(buffer, dtype=np.uint8))
+    np.testing.assert_array_equal(np.flipud(data[-1]), expected_data)
+
+
+def test_load_mib_cross(raw_dataframe, expected_data):
+    array = load_mib(raw_dataframe[1:], add_cross=True).squeeze()
+
+    assert array.shape == (515, 515)
+    assert not array[256:259].any()
+    assert not array[:, 256:259].any()
+    np.testing.assert_array_equal(array[:256, :256], np.flipud(expected_data)[:256, :256])
+    np.testing.assert_array_equal(array[259:, 259:], np.flipud(expected_data)[256:, 256:])
+
+
+def encode_raw(frame: np.ndarray, counter_depth: int) -> bytes:
+    """Encode a 256x1024 strip of 4 chips as RAW (R64) data, by packing the
+    pixels into 64-bit words with the first pixel in the lowest bits."""
+    if counter_depth == 24:
+        return encode_raw(frame >> 12, 12) + encode_raw(frame & 0xFFF, 12)
+
+    bits = {1: 1, 6: 8, 12: 16}[counter_depth]
+    pixels = frame.ravel().tolist()
+    per_word = 64 // bits
+
+    out = bytearray()
+    for start in range(0, len(pixels), per_word):
+        word = sum(p << (bits * k) for k, p in enumerate(pixels[start : start + per_word]))
+        out += word.to_bytes(8, 'big')
+    return bytes(out)
+
+
+def raw_header(counter_depth: int) -> bytes:
+    head = ['MQ1', '000001', '00768', '04', '0512', '0512', 'R64', '   2x2', '0F']
+    head += ['MQ1A', '2023-05-12T09:33:58.206654135Z', '50000000ns', str(counter_depth), '']
+    return ','.join(head).encode().ljust(768, b'\x00')
+
+
+@pytest.mark.parametrize('counter_depth', [1, 6, 12, 24])
+def test_load_mib_raw(counter_depth):
+    rng = np.random.default_rng(counter_depth)
+    frames = rng.integers(0, 2**counter_depth, size=(3, 256, 1024))
+
+    buffer = b''.join(
+        raw_header(counter_depth) + encode_raw(frame, counter_depth) for frame in frames
+    )
+    data = load_mib(buffer)
+
+    assert data.shape == (3, 512, 512)
+    for frame, strip in zip(data, frames):
+        chips = np.split(strip, 4, axis=1)
+        np.testing.assert_array_equal(frame[256:, :256], chips[0])
+        np.testing.assert_array_equal(frame[256:, 256:], chips[1])
+        np.testing.assert_array_equal(frame[:256, 256:], np.rot90(chips[2], 2))
+        np.testing.assert_array_equal(frame[:256, :256], np.rot90(chips[3], 2))
+
+    with_cross = load_mib(buffer, add_cross=True)
+    assert with_cross.shape == (3, 515, 515)
+    np.testing.assert_array_equal(with_cross[:, 259:, 259:], data[:, 256:, 256:])
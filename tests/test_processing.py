@@ -0,0 +1,401 @@
+from __future__ import annotations
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from instamatic.formats import read_adsc, read_cbf, read_mrc, read_nexus, read_tiff
+from instamatic.processing.framestore import FrameStore
+from instamatic.processing.ImgConversion import write_mrc_frame, write_tiff_frame
+from instamatic.processing.ImgConversionTPX import ImgConversionTPX, ImgConversionTPXStream
+from instamatic.processing.pipeline import FramePipeline
+
+
+def test_pipeline():
+    pipeline = FramePipeline(lambda x: x + 1, lambda x: 2 * x, maxsize=2)
+    for i in range(20):
+        pipeline.put(i)
+
+    results = pipeline.close()
+
+    assert pipeline.n_put == 20
+    assert sorted(results) == [2 * (i + 1) for i in range(20)]
+
+
+def test_pipeline_workers():
+    active = []
+    lock = threading.Lock()
+    max_active = [0]
+
+    def slow(x):
+        with lock:
+            active.append(x)
+            max_active[0] = max(max_active[0], len(active))
+        time.sleep(0.01)
+        with lock:
+            active.remove(x)
+        return x
+
+    pipeline = FramePipeline((slow, 4), maxsize=8)
+    for i in range(20):
+        pipeline.put(i)
+
+    assert sorted(pipeline.close()) == list(range(20))
+    assert max_active[0] > 1
+
+
+def test_pipeline_drop_and_errors():
+    def check(x):
+        if x == 3:
+            raise ValueError('bad frame')
+        return x if x % 2 else None
+
+    pipeline = FramePipeline(check)
+    for i in range(10):
+        pipeline.put(i)
+
+    with pytest.raises(ValueError):
+        pipeline.close()
+
+    assert sorted(pipeline.results) == [1, 5, 7, 9]
+
+    with pytest.raises(RuntimeError):
+        pipeline.put(11)
+
+
+def test_write_frame(tmp_path):
+    img = np.arange(64 * 64, dtype=np.uint16).reshape(64, 64)
+    h = {'ImageExposureTime': 0.5}
+
+    write_tiff_frame(tmp_path, 7, img, h)
+    write_mrc_frame(tmp_path, 7, img)
+
+    tiff, header = read_tiff(tmp_path / '00007.tiff')
+    np.testing.assert_array_equal(tiff, img)
+    assert header['ImageExposureTime'] == 0.5
+
+    mrc, _ = read_mrc(tmp_path / '00007.mrc')
+    assert mrc.shape == img.shape
+
+
+@pytest.mark.parametrize('backend', ['memmap', 'hdf5'])
+def test_frame_store(backend, tmp_path):
+    path = tmp_path / 'frames'
+    store = FrameStore(path, backend=backend, keep=4, capacity=2)
+
+    frames = [np.full((8, 8), i, dtype=np.uint16) for i in range(20)]
+    for i, img in enumerate(frames, start=1):
+        store.append((i, img, {'i': i}))
+
+    assert len(store) == 20
+    assert store.observed_range == set(range(1, 21))
+    assert store.capacity >= 16
+    assert len(store._hot) == 4
+    assert path.exists()
+
+    for i in store.observed_range:
+        np.testing.assert_array_equal(store.data[i], frames[i - 1])
+        assert store.headers[i] == {'i': i}
+
+    # frames on disk are updated in place, floats are rounded
+    store.data[1] = np.full((8, 8), 41.6)
+    assert store.data[1].dtype == np.uint16
+    assert store.data[1][0, 0] == 42
+
+    del store.data[2]
+    assert 2 not in store.data
+    assert list(store.data) == [1] + list(range(3, 21))
+
+    with pytest.raises(ValueError):
+        store.add(21, np.zeros((4, 4)))
+
+    store.close()
+    assert not path.exists()
+
+
+def test_frame_store_close(tmp_path, monkeypatch, caplog):
+    path = tmp_path / 'frames'
+    store = FrameStore(path, keep=0)
+    store.add(1, np.ones((8, 8), dtype=np.uint16))
+    mmap = store._dataset._mmap
+
+    def unlink(self):
+        raise PermissionError('file in use')
+
+    monkeypatch.setattr(type(path), 'unlink', unlink)
+    with caplog.at_level('WARNING', logger='instamatic.processing.framestore'):
+        store.close()
+
+    assert mmap.closed
+    assert 'Could not delete frame store' in caplog.text
+
+
+def test_img_conversion_frame_store(tmp_path):
+    rng = np.random.default_rng(0)
+    frames = [
+        (i, rng.integers(0, 100, size=(64, 64)).astype(np.uint16), {'ImageGetTime': i})
+        for i in range(1, 11)
+    ]
+
+    kwargs = {
+        'osc_angle': 0.5,
+        'start_angle': 0,
+        'end_angle': 5,
+        'rotation_axis': 0,
+        'acquisition_time': 0.1,
+        'flatfield': None,
+        'pixelsize': 0.01,
+        'physical_pixelsize': 0.055,
+        'wavelength': 0.025,
+    }
+
+    conv_list = ImgConversionTPX(buffer=list(frames), **kwargs)
+
+    with FrameStore(tmp_path / 'frames', keep=2) as store:
+        for item in frames:
+            store.append(item)
+        conv_store = ImgConversionTPX(buffer=store, **kwargs)
+
+        assert conv_store.observed_range == conv_list.observed_range
+        assert conv_store.data_shape == (64, 64)
+        np.testing.assert_allclose(conv_store.mean_beam_center, conv_list.mean_beam_center)
+
+        conv_store.threadpoolwriter(tiff_path=tmp_path / 'tiff', workers=2)
+        assert len(list((tmp_path / 'tiff').iterdir())) == 10
+
+
+def test_img_conversion_stream(tmp_path):
+    rng = np.random.default_rng(1)
+
+    def make_frame(i):
+        img = rng.integers(0, 20, size=(64, 64)).astype(np.uint16)
+        img[30 + i % 3, 32] = 5000
+        h = {'ImageGetTime': 1000.0 + i, 'ImageExposureTime': 0.1}
+        return i, img, h
+
+    # frame 5 is missing
+    frames = [make_frame(i) for i in range(1, 11) if i != 5]
+
+    kwargs = {
+        'start_angle': 10,
+        'rotation_axis': 0.5,
+        'flatfield': None,
+        'physical_pixelsize': 0.055,
+        'wavelength': 0.025,
+    }
+    final = {'end_angle': 15, 'osc_angle': 0.5, 'acquisition_time': 0.1, 'pixelsize': 0.01}
+
+    batch_path = tmp_path / 'batch'
+    batch_path.mkdir()
+    conv = ImgConversionTPX(
+        buffer=[(i, img.copy(), dict(h)) for i, img, h in frames], **kwargs, **final
+    )
+    conv.threadpoolwriter(
+        smv_path=batch_path / 'SMV',
+        mrc_path=batch_path / 'RED',
+        cbf_path=batch_path / 'CBF',
+        workers=2,
+    )
+    conv.to_dials(batch_path / 'SMV')
+    conv.write_beam_centers(batch_path)
+    conv.nexus_writer(batch_path / 'data.nxs')
+
+    stream_path = tmp_path / 'stream'
+    stream = ImgConversionTPXStream(
+        **kwargs,
+        path=stream_path,
+        smv_path=stream_path / 'SMV',
+        mrc_path=stream_path / 'RED',
+        cbf_path=stream_path / 'CBF',
+        nexus_path=stream_path / 'data.nxs',
+        workers=2,
+    )
+    for i, img, h in reversed(frames):
+        stream.add_frame(i, img, h)
+
+    assert stream.beam_center_stats.n == 9
+    assert stream.data == {}
+
+    stream.close(**final)
+
+    with pytest.raises(RuntimeError):
+        stream.add_frame(11, *make_frame(11)[1:])
+
+    assert stream.missing_range == {5}
+    np.testing.assert_allclose(stream.mean_beam_center, conv.mean_beam_center)
+
+    for i in range(1, 11):
+        img, h = read_adsc(stream_path / 'SMV' / 'data' / f'{i:05d}.img')
+        img_batch, h_batch = read_adsc(batch_path / 'SMV' / 'data' / f'{i:05d}.img')
+        np.testing.assert_array_equal(img, img_batch)
+        if i != 5:
+            assert h == h_batch
+            img, h = read_cbf(stream_path / 'CBF' / f'{i:05d}.cbf')
+            img_batch, h_batch = read_cbf(batch_path / 'CBF' / f'{i:05d}.cbf')
+            np.testing.assert_array_equal(img, img_batch)
+            assert h == h_batch
+            img, h = read_nexus(stream_path / 'data.nxs', index=i - 1)
+            img_batch, h_batch = read_nexus(batch_path / 'data.nxs', index=i - 1)
+            np.testing.assert_array_equal(img, img_batch)
+            assert h['ImageGetTime'] == h_batch['ImageGetTime']
+
+    np.testing.assert_allclose(
+        np.loadtxt(stream_path / 'beam_centers.txt'),
+        np.loadtxt(batch_path / 'beam_centers.txt'),
+    )
+
+    for fn in ('SMV/XDS.INP', 'SMV/dials_variables.sh', 'RED/1.ed3d', 'pets.pts'):
+        assert (stream_path / fn).exists()
+
+
+def test_write_frames_bounded(monkeypatch):
+    from instamatic.processing import frame_writer
+
+    workers = 2
+    fetched = []
+    written = []
+
+    def get_image(i):
+        # frames are only read from the store shortly before they are written
+        assert len(fetched) - len(written) <= 2 * workers
+        fetched.append(i)
+        return np.zeros((4, 4), dtype=np.uint16)
+
+    def write_frame(i, img, tasks):
+        time.sleep(0.005)
+        written.append(i)
+        return [('tiff', 0.005)]
+
+    monkeypatch.setattr(frame_writer, 'write_frame', write_frame)
+    stats = frame_writer.write_frames(
+        range(40), get_image, lambda i: [], backend='thread', workers=workers
+    )
+
+    assert sorted(written) == list(range(40))
+    assert stats.frames['tiff'] == 40
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_threadpoolwriter_backend(backend, tmp_path):
+    rng = np.random.default_rng(2)
+    frames = [
+        (
+            i,
+            rng.integers(0, 1000, size=(32, 32)).astype(np.uint16),
+            {'ImageGetTime': 1000.0 + i, 'ImageExposureTime': 0.1, 'beam_center': (16, 16)},
+        )
+        for i in range(1, 13)
+    ]
+    data = {i: img for i, img, h in frames}
+
+    conv = ImgConversionTPX(
+        buffer=frames,
+        osc_angle=0.5,
+        start_angle=0,
+        end_angle=6,
+        rotation_axis=0,
+        acquisition_time=0.1,
+        flatfield=None,
+        pixelsize=0.01,
+        physical_pixelsize=0.055,
+        wavelength=0.025,
+    )
+
+    report = conv.threadpoolwriter(
+        tiff_path=tmp_path / 'tiff',
+        smv_path=tmp_path / 'SMV',
+        mrc_path=tmp_path / 'RED',
+        cbf_path=tmp_path / 'CBF',
+        workers=2,
+        backend=backend,
+    )
+
+    assert report['backend'] == backend
+    assert report['workers'] == 2
+    for fmt in ('tiff', 'mrc', 'smv', 'cbf'):
+        assert report['formats'][fmt]['frames'] == 12
+
+    for i, img in data.items():
+        tiff, h = read_tiff(tmp_path / 'tiff' / f'{i:05d}.tiff')
+        np.testing.assert_array_equal(tiff, img)
+        smv, header = read_adsc(tmp_path / 'SMV' / 'data' / f'{i:05d}.img')
+        np.testing.assert_array_equal(smv, img)
+        assert header['BEAMLINE'] == 'TimePix_SU'
+        mrc, _ = read_mrc(tmp_path / 'RED' / f'{i:05d}.mrc')
+        np.testing.assert_array_equal(mrc, np.flipud(img))
+        cbf, header = read_cbf(tmp_path / 'CBF' / f'{i:05d}.cbf')
+        np.testing.assert_array_equal(cbf, img)
+        assert header['Start_angle'] == f'{(i - 1) * 0.5:.4f} deg.'
+        cy, cx = conv.mean_beam_center
+        assert header['Beam_xy'] == f'({cx:.2f}, {cy:.2f}) pixels'
+
+
+@pytest.mark.parametrize('method', ['parabolic', 'centroid'])
+def test_find_beam_centers(method, tmp_path):
+    from instamatic.tools import find_beam_centers
+
+    rng = np.random.default_rng(3)
+    yy, xx = np.mgrid[0:128, 0:96]
+    true = np.column_stack([rng.uniform(30, 100, size=10), rng.uniform(30, 70, size=10)])
+
+    stack = np.empty((10, 128, 96), dtype=np.uint16)
+    for k, (cx, cy) in enumerate(true):
+        beam = 3000 * np.exp(-((yy - cx) ** 2 + (xx - cy) ** 2) / (2 * 3**2))
+        stack[k] = rng.poisson(5, size=(128, 96)) + beam
+
+    centers = find_beam_centers(stack, sigma=5, method=method, chunksize=None)
+    np.testing.assert_allclose(centers, true, atol=0.1)
+
+    # chunked, from a memory-mapped file and from a list of images
+    mmap = np.memmap(tmp_path / 'stack.dat', dtype=stack.dtype, mode='w+', shape=stack.shape)
+    mmap[:] = stack
+    np.testing.assert_allclose(
+        find_beam_centers(mmap, sigma=5, method=method, chunksize=3), centers
+    )
+    np.testing.assert_allclose(find_beam_centers(list(stack), sigma=5, method=method), centers)
+
+
+def test_refine_peak_max_edges():
+    from instamatic.tools import refine_peak_max
+
+    profiles = np.array([[5.0, 4, 3, 2, 1], [1, 2, 3, 4, 5], [1, 2, 5, 2, 1]])
+    np.testing.assert_allclose(refine_peak_max(profiles), [0, 4, 2])
+    np.testing.assert_allclose(refine_peak_max(profiles, w=1, method='centroid'), [0, 4, 2])
+
+    with pytest.raises(ValueError):
+        refine_peak_max(profiles, method='spline')
+
+
+def test_img_conversion_iterable(tmp_path):
+    from instamatic.formats import iter_tiff_dataset, write_tiff
+
+    rng = np.random.default_rng(4)
+    frames = [
+        (i, rng.integers(0, 100, size=(32, 32)).astype(np.uint16), {'ImageGetTime': i})
+        for i in range(1, 9)
+    ]
+    for i, img, h in frames:
+        write_tiff(tmp_path / f'{i:05d}.tiff', img, header=h)
+
+    kwargs = {
+        'osc_angle': 0.5,
+        'start_angle': 0,
+        'end_angle': 4,
+        'rotation_axis': 0,
+        'acquisition_time': 0.1,
+        'flatfield': None,
+        'pixelsize': 0.01,
+        'physical_pixelsize': 0.055,
+        'wavelength': 0.025,
+    }
+
+    conv_list = ImgConversionTPX(buffer=list(frames), **kwargs)
+    conv_iter = ImgConversionTPX(
+        buffer=iter_tiff_dataset(tmp_path.glob('*.tiff'), workers=2), **kwargs
+    )
+
+    assert conv_iter.observed_range == conv_list.observed_range
+    assert conv_iter.headers[3]['ImageGetTime'] == 3
+    np.testing.assert_allclose(conv_iter.mean_beam_center, conv_list.mean_beam_center)
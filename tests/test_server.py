@@ -0,0 +1,680 @@
+from __future__ import annotations
+
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from instamatic.exceptions import TEMValueError
+from instamatic.server import protocol
+from instamatic.server.serializer import CODECS, pickle_dumper, pickle_loader
+
+PICKLE = CODECS['pickle']
+
+
+@pytest.fixture
+def sockpair():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_frame_roundtrip_large(sockpair):
+    a, b = sockpair
+    arr = np.arange(1_000_000, dtype=np.uint32)
+
+    t = threading.Thread(target=protocol.send_message, args=(a, arr), kwargs={'codec': PICKLE})
+    t.start()
+    header, ret = protocol.recv_message(b)
+    t.join()
+
+    assert header.codec == PICKLE
+    np.testing.assert_array_equal(ret, arr)
+
+
+def test_frame_pipelined(sockpair):
+    a, b = sockpair
+    for i in range(5):
+        protocol.send_message(a, {'i': i}, codec=CODECS['json'], msg_id=i)
+
+    for i in range(5):
+        header, ret = protocol.recv_message(b)
+        assert header.msg_id == i
+        assert ret == {'i': i}
+
+
+def test_frame_closed(sockpair):
+    a, b = sockpair
+    a.close()
+    assert protocol.recv_message(b) is None
+
+
+def test_frame_truncated(sockpair):
+    a, b = sockpair
+    a.sendall(protocol.HEADER.pack(protocol.MAGIC, protocol.VERSION, PICKLE, 0, 1, 100))
+    a.sendall(b'x' * 10)
+    a.close()
+    with pytest.raises(ConnectionError):
+        protocol.recv_message(b)
+
+
+def test_frame_invalid_magic(sockpair):
+    a, b = sockpair
+    a.sendall(b'\x00' * protocol.HEADER_SIZE)
+    with pytest.raises(protocol.ProtocolError):
+        protocol.recv_message(b)
+
+
+def serve_echo(sock):
+    conn = protocol.ServerConnection(
+        sock, key='func_name', loader=pickle_loader, dumper=pickle_dumper, bufsize=1024
+    )
+    while True:
+        data = conn.receive()
+        if data is None:
+            break
+        conn.reply((200, data))
+
+
+@pytest.mark.parametrize('framed', [True, False])
+def test_server_connection(sockpair, framed):
+    client, server = sockpair
+    t = threading.Thread(target=serve_echo, args=(server,))
+    t.start()
+
+    if framed:
+        assert protocol.negotiate(
+            client, key='func_name', loader=pickle_loader, dumper=pickle_dumper, bufsize=1024
+        )
+        protocol.send_message(client, {'func_name': 'f'}, codec=PICKLE, msg_id=42)
+        header, response = protocol.recv_message(client)
+        assert header.msg_id == 42
+    else:
+        client.sendall(pickle_dumper({'func_name': 'f'}))
+        response = pickle_loader(client.recv(1024))
+
+    assert response == (200, {'func_name': 'f'})
+
+    client.shutdown(socket.SHUT_RDWR)
+    t.join()
+
+
+def test_negotiate_legacy_server(sockpair):
+    """Old servers respond to the negotiation request with an error."""
+    client, server = sockpair
+
+    def legacy_server():
+        server.recv(1024)
+        server.sendall(pickle_dumper((500, ('AttributeError', ('__negotiate__',)))))
+
+    t = threading.Thread(target=legacy_server)
+    t.start()
+    assert not protocol.negotiate(
+        client, key='func_name', loader=pickle_loader, dumper=pickle_dumper, bufsize=1024
+    )
+    t.join()
+
+
+@pytest.fixture(scope='module')
+def tem_server():
+    """Start a TEM server with the simulated microscope on a free port."""
+    from instamatic.server import tem_server
+    from instamatic.server.dispatcher import Dispatcher, serve
+    from instamatic.TEMController import microscope_client
+
+    q = Dispatcher()
+    server = tem_server.TemServer(q=q)
+    server.daemon = True
+    server.start()
+
+    stop = threading.Event()
+    ready = []
+    started = threading.Event()
+
+    def on_ready(s):
+        ready.append(s.getsockname()[1])
+        started.set()
+
+    threading.Thread(
+        target=serve,
+        args=('localhost', 0, lambda conn, addr: tem_server.handle(conn, q, addr)),
+        kwargs={'stop': stop, 'ready': on_ready},
+        daemon=True,
+    ).start()
+    assert started.wait(5)
+
+    port = microscope_client.PORT
+    microscope_client.PORT = ready[0]
+    try:
+        yield q
+    finally:
+        microscope_client.PORT = port
+        stop.set()
+
+
+@pytest.fixture(scope='module')
+def tem_client(tem_server):
+    from instamatic.TEMController import microscope_client
+
+    return microscope_client.MicroscopeClient(interface='simulate')
+
+
+def test_tem_client(tem_client):
+    assert tem_client._framed
+
+    tem_client.setSpotSize(3)
+    assert tem_client.getSpotSize() == 3
+
+    pos = tem_client.getStagePosition()
+    assert len(pos) == 5
+
+    with pytest.raises(AttributeError):
+        tem_client.does_not_exist()
+
+
+@pytest.mark.parametrize(
+    'arr',
+    [
+        np.arange(512 * 512, dtype=np.uint16).reshape(512, 512),
+        np.random.random((3, 4, 5)),
+        np.zeros((0, 4), dtype=np.int32),
+        np.arange(10)[::2],
+    ],
+)
+def test_array_roundtrip(sockpair, arr):
+    a, b = sockpair
+    t = threading.Thread(target=protocol.send_array, args=(a, arr), kwargs={'msg_id': 7})
+    t.start()
+    header = protocol.recv_header(b)
+    ret = protocol.recv_array(b, header)
+    t.join()
+
+    assert header.msg_id == 7
+    assert ret.dtype == arr.dtype
+    np.testing.assert_array_equal(ret, arr)
+
+
+def test_array_reuse_buffer(sockpair):
+    a, b = sockpair
+    out = np.empty((4, 4), dtype=np.uint16)
+
+    protocol.send_array(a, np.ones((4, 4), dtype=np.uint16))
+    ret = protocol.recv_array(b, protocol.recv_header(b), out=out)
+    assert ret is out
+
+    # shape changes (e.g. binning) allocate a new array
+    protocol.send_array(a, np.ones((2, 2), dtype=np.uint16))
+    ret = protocol.recv_array(b, protocol.recv_header(b), out=out)
+    assert ret is not out
+    assert ret.shape == (2, 2)
+
+
+def test_frame_pool():
+    from instamatic.server.frame_pool import SharedFramePool
+
+    pool = SharedFramePool(n_slots=2)
+    try:
+        arr = np.arange(16, dtype=np.uint16).reshape(4, 4)
+
+        info1 = pool.put(arr)
+        info2 = pool.put(arr + 1)
+        assert pool.n_held == 2
+        assert pool.put(arr) is None  # all slots held
+
+        assert not pool.release(info1['slot'], info1['seq'] + 100)  # stale
+        assert pool.release(info1['slot'], info1['seq'])
+
+        info3 = pool.put(arr + 2)
+        assert info3['slot'] == info1['slot']
+        assert info3['seq'] > info2['seq']
+        assert info3['name'] == info1['name']
+
+        pool.release_many([(info2['slot'], info2['seq'])])
+        info4 = pool.put(arr[::2])  # shape changed, new block
+        assert info4['slot'] == info2['slot']
+        assert info4['name'] != info2['name']
+        assert info4['shape'] == (2, 4)
+    finally:
+        pool.close()
+
+
+def test_shared_frame_release():
+    import gc
+
+    from instamatic.server.frame_pool import SharedFrame, SharedFramePool
+
+    pool = SharedFramePool(n_slots=2)
+    released = []
+
+    def on_release(slot, seq):
+        released.append((slot, seq))
+
+    try:
+        arr = np.arange(16, dtype=np.float32).reshape(4, 4)
+
+        info = pool.put(arr)
+        shm = pool._slots[info['slot']].shm
+        img = np.asarray(
+            SharedFrame(
+                shm, info['shape'], info['dtype'], info['slot'], info['seq'], on_release
+            )
+        )
+        np.testing.assert_array_equal(img, arr)
+
+        # views keep the frame alive
+        view = np.rot90(img)[::2]
+        del img
+        gc.collect()
+        assert not released
+        del view
+        gc.collect()
+        assert released == [(info['slot'], info['seq'])]
+
+        info = pool.put(arr)
+        shm = pool._slots[info['slot']].shm
+        img = np.asarray(
+            SharedFrame(
+                shm, info['shape'], info['dtype'], info['slot'], info['seq'], on_release
+            )
+        )
+        SharedFrame.from_array(img[1:]).release()
+        assert len(released) == 2
+        assert SharedFrame.from_array(np.ones(3)) is None
+    finally:
+        pool.close()
+
+
+def test_shared_frame_reallocated_slot():
+    import gc
+    from types import SimpleNamespace
+
+    from instamatic.camera.camera_client import CamClient
+    from instamatic.server.frame_pool import SharedFramePool
+
+    pool = SharedFramePool(n_slots=1)
+    released = []
+    client = SimpleNamespace(
+        _slot_shms={}, verbose=False, _add_release=lambda *item: released.append(item)
+    )
+
+    def get_frame(arr):
+        info = pool.put(arr, hold=False)
+        return CamClient.get_frame_from_shared_memory(client, **info)
+
+    try:
+        arr = np.arange(16, dtype=np.uint16).reshape(4, 4)
+        img = get_frame(arr)
+        old = client._slot_shms[0]
+
+        # new shape, the server re-allocates the only slot with a new name
+        img2 = get_frame(np.ones((2, 2), dtype=np.float32))
+        assert client._slot_shms[0] is not old
+        del old
+        gc.collect()
+
+        # the previous block stays mapped while `img` refers to it
+        np.testing.assert_array_equal(img, arr)
+        np.testing.assert_array_equal(img2, 1)
+    finally:
+        del img, img2
+        gc.collect()
+        pool.close()
+
+
+def test_tem_client_call_many(tem_client):
+    tem_client.setSpotSize(2)
+    spotsize, pos, err = tem_client.call_many(
+        ['getSpotSize', ('getStagePosition', ()), ('setFunctionMode', ('x',))],
+        return_exceptions=True,
+    )
+    assert spotsize == 2
+    assert len(pos) == 5
+    assert isinstance(err, TEMValueError)
+
+    with pytest.raises(TEMValueError):
+        tem_client.call_many([('setFunctionMode', ('x',)), 'getSpotSize'])
+
+    with pytest.raises(AttributeError):
+        tem_client.call_many(['does_not_exist'])
+
+
+def test_tem_client_batch(tem_client):
+    with tem_client.batch() as b:
+        b.setSpotSize(4)
+        spotsize = b.getSpotSize()
+        ht = b.getHTValue()
+
+    assert spotsize.result() == 4
+    assert ht.result() == tem_client.getHTValue()
+
+
+def test_tem_client_concurrent(tem_server, tem_client):
+    """Requests from several connections and threads get their own
+    responses."""
+    from instamatic.TEMController import microscope_client
+
+    clients = [tem_client] + [
+        microscope_client.MicroscopeClient(interface='simulate') for _ in range(2)
+    ]
+    errors = []
+
+    def work(client):
+        try:
+            for _ in range(20):
+                ht, spotsize = client.call_many(['getHTValue', 'getSpotSize'])
+                assert ht is not None
+                assert len(client.getStagePosition()) == 5
+        except Exception as e:
+            errors.append(e)
+
+    # two threads share each connection
+    threads = [threading.Thread(target=work, args=(client,)) for client in clients * 2]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+
+    metrics = tem_client.get_server_metrics()
+    assert metrics['clients'] >= 3
+    assert metrics['completed'] >= 240
+    assert metrics['pending'] == 0
+
+
+def test_tem_server_pipelined(tem_server):
+    """Framed requests can be sent without waiting for the responses."""
+    from instamatic.TEMController import microscope_client
+
+    s = socket.create_connection(('localhost', microscope_client.PORT))
+    try:
+        assert protocol.negotiate(
+            s, key='func_name', loader=pickle_loader, dumper=pickle_dumper, bufsize=1024
+        )
+        for i in range(1, 6):
+            if i % 2:
+                dct = {'func_name': 'setSpotSize', 'args': (i,)}
+            else:
+                dct = {'func_name': 'getSpotSize'}
+            protocol.send_message(s, dct, codec=PICKLE, msg_id=i)
+
+        for i in range(1, 6):
+            header, (status, ret) = protocol.recv_message(s)
+            assert header.msg_id == i
+            assert status == 200
+            if i % 2 == 0:
+                assert ret == i - 1
+    finally:
+        s.close()
+
+
+def test_tem_server_pipelined_codecs(tem_server):
+    """Each response is encoded with the codec of its own request."""
+    from instamatic.TEMController import microscope_client
+
+    codecs = [CODECS['json'], PICKLE] * 5
+
+    s = socket.create_connection(('localhost', microscope_client.PORT))
+    try:
+        assert protocol.negotiate(
+            s, key='func_name', loader=pickle_loader, dumper=pickle_dumper, bufsize=1024
+        )
+        for i, codec in enumerate(codecs):
+            protocol.send_message(s, {'func_name': 'getSpotSize'}, codec=codec, msg_id=i)
+
+        for i, codec in enumerate(codecs):
+            header, (status, ret) = protocol.recv_message(s)
+            assert header.msg_id == i
+            assert header.codec == codec
+            assert status == 200
+    finally:
+        s.close()
+
+
+def test_async_tem_client(tem_server):
+    import asyncio
+
+    from instamatic.TEMController.microscope_client import AsyncMicroscopeClient
+
+    async def main():
+        async with AsyncMicroscopeClient(interface='simulate') as tem:
+            await tem.setSpotSize(5)
+            spotsize, pos, ht = await asyncio.gather(
+                tem.getSpotSize(), tem.getStagePosition(), tem.getHTValue()
+            )
+            assert spotsize == 5
+            assert len(pos) == 5
+
+            results = await tem.call_many(
+                ['getSpotSize', ('setFunctionMode', ('x',))], return_exceptions=True
+            )
+            assert results[0] == 5
+            assert isinstance(results[1], TEMValueError)
+
+            with pytest.raises(TEMValueError):
+                await tem.setFunctionMode('x')
+
+            with pytest.raises(AttributeError):
+                tem.does_not_exist
+
+            # many concurrent requests over the same connection
+            values = await asyncio.gather(*(tem.getSpotSize() for _ in range(50)))
+            assert values == [5] * 50
+
+    asyncio.run(main())
+
+
+def test_async_connection_stream():
+    import asyncio
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('localhost', 0))
+    listener.listen(1)
+    port = listener.getsockname()[1]
+
+    def serve():
+        sock, _ = listener.accept()
+        conn = protocol.ServerConnection(
+            sock, key='attr_name', loader=pickle_loader, dumper=pickle_dumper, bufsize=1024
+        )
+        while True:
+            data = conn.receive()
+            if data is None:
+                break
+            if data.get('stream'):
+                for i in range(data['n']):
+                    conn.reply_array(np.full((4, 4), i), more=True)
+            conn.reply((200, data['attr_name']))
+        sock.close()
+
+    t = threading.Thread(target=serve, daemon=True)
+    t.start()
+
+    async def main():
+        connection = await protocol.AsyncConnection.open(
+            'localhost',
+            port,
+            key='attr_name',
+            loader=pickle_loader,
+            dumper=pickle_dumper,
+            bufsize=1024,
+            codec=PICKLE,
+        )
+
+        msg_id, responses = await connection.open_stream(
+            {'attr_name': 'movie', 'stream': True, 'n': 3}
+        )
+        # the response to this request arrives after the stream
+        status, data = await connection.request({'attr_name': 'other'})
+        assert (status, data) == (200, 'other')
+
+        frames = []
+        while True:
+            header, (status, data) = await responses.get()
+            if not header.flags & protocol.FLAG_MORE:
+                break
+            frames.append(data[0, 0])
+        connection.close_stream(msg_id)
+        assert frames == [0, 1, 2]
+        assert data == 'movie'
+
+        # responses to abandoned streams are discarded
+        msg_id, _ = await connection.open_stream({'attr_name': 'movie', 'stream': True, 'n': 2})
+        connection.close_stream(msg_id)
+        assert await connection.request({'attr_name': 'last'}) == (200, 'last')
+
+        await connection.close()
+        with pytest.raises(ConnectionError):
+            await connection.request({'attr_name': 'closed'})
+
+    try:
+        asyncio.run(main())
+    finally:
+        listener.close()
+
+
+def test_tem_client_state(tem_client):
+    from instamatic.TEMController.state import StateReader
+
+    tem_client.setFunctionMode('mag1')
+    tem_client.setSpotSize(2)
+
+    before = tem_client.get_server_metrics()['completed']
+    state = StateReader(tem_client).snapshot()
+    assert tem_client.get_server_metrics()['completed'] == before + 1  # single batch
+
+    assert state.FunctionMode == 'mag1'
+    assert state.SpotSize == 2
+    assert state.DiffFocus is None
+    assert len(state.StagePosition) == 5
+
+
+@pytest.fixture(scope='module')
+def cam_server():
+    """Start a CAM server with the simulated camera on a free port."""
+    from instamatic.camera import camera_client
+    from instamatic.server import cam_server
+    from instamatic.server.dispatcher import Dispatcher, serve
+
+    q = Dispatcher()
+    server = cam_server.CamServer(q=q, name='test')
+    server.daemon = True
+    server.start()
+
+    stop = threading.Event()
+    ready = []
+    started = threading.Event()
+
+    def on_ready(s):
+        ready.append(s.getsockname()[1])
+        started.set()
+
+    threading.Thread(
+        target=serve,
+        args=('localhost', 0, lambda conn, addr: cam_server.handle(conn, q, addr)),
+        kwargs={'stop': stop, 'ready': on_ready},
+        daemon=True,
+    ).start()
+    assert started.wait(5)
+
+    port = camera_client.PORT
+    camera_client.PORT = ready[0]
+    try:
+        yield server
+    finally:
+        camera_client.PORT = port
+        stop.set()
+
+
+@pytest.fixture(scope='module')
+def cam_client(cam_server):
+    from instamatic.camera import camera_client
+
+    return camera_client.CamClient(name='test', interface='simulate')
+
+
+def test_cam_client_stream_movie(cam_client):
+    import time
+
+    n_frames, exposure = 5, 0.2
+
+    t0 = time.perf_counter()
+    frames = cam_client.get_movie(n_frames, exposure=exposure, binsize=2)
+    first = next(frames)
+    t_first = time.perf_counter() - t0
+    rest = list(frames)
+    t_total = time.perf_counter() - t0
+
+    # the first frame is sent as soon as it is acquired, not with the movie
+    assert t_first < t_total - 2 * exposure
+    assert first.shape == (256, 256)
+    assert len(rest) == n_frames - 1
+
+    # the connection can be used again after the stream
+    assert cam_client.get_image(exposure=0.001, binsize=2).shape == (256, 256)
+
+
+def test_cam_server_release_on_disconnect(cam_server, cam_client):
+    import gc
+    import time
+
+    from instamatic.camera import camera_client
+
+    pool = cam_server.frame_pool
+
+    # frames of the other tests are released with the next request
+    gc.collect()
+    cam_client.get_image_dimensions()
+    assert pool.n_held == 0
+
+    # a client that holds all slots and disconnects without releasing them
+    s = socket.create_connection(('localhost', camera_client.PORT))
+    try:
+        assert protocol.negotiate(
+            s, key='attr_name', loader=pickle_loader, dumper=pickle_dumper, bufsize=1024
+        )
+        for i in range(len(pool)):
+            dct = {'attr_name': 'get_image', 'kwargs': {'exposure': 0.001}, 'transport': 'ring'}
+            protocol.send_message(s, dct, codec=PICKLE, msg_id=i)
+            header, (status, info) = protocol.recv_message(s)
+            assert 'slot' in info
+        assert pool.n_held == len(pool)
+    finally:
+        s.close()
+
+    for _ in range(50):
+        if pool.n_held == 0:
+            break
+        time.sleep(0.1)
+    assert pool.n_held == 0
+
+    # other clients still receive their images through shared memory
+    img = cam_client.get_image(exposure=0.001)
+    from instamatic.server.frame_pool import SharedFrame
+
+    assert SharedFrame.from_array(img) is not None
+
+
+def test_cam_client_native_movie(cam_server, cam_client, monkeypatch):
+    from instamatic.camera.camera_base import CameraBase
+    from instamatic.camera.camera_simu import CameraSimu
+
+    calls = []
+
+    class CameraGapless(CameraSimu):
+        """Camera with a dedicated movie mode, like CameraServal."""
+
+        def get_movie(self, n_frames, exposure=None, binsize=None, **kwargs):
+            calls.append((n_frames, exposure, binsize))
+            return [np.full((4, 4), i, dtype=np.uint16) for i in range(n_frames)]
+
+        iter_movie = CameraBase.iter_movie
+
+    monkeypatch.setattr(cam_server.cam, '__class__', CameraGapless)
+
+    frames = list(cam_client.get_movie(3, exposure=0.01, binsize=2))
+
+    assert calls == [(3, 0.01, 2)]
+    assert [frame[0, 0] for frame in frames] == [0, 1, 2]